@@ -0,0 +1,138 @@
+# earn_backend/daraja.py
+"""
+Shared Daraja (M-Pesa) HTTP client.
+
+One `DarajaClient` per credential set (STK push and B2C use different apps), obtained
+with `get_client(...)`. Each client keeps:
+  - its OAuth token, reused until `expires_in` minus a refresh margin; concurrent callers
+    wait on one fetch instead of each requesting a token;
+  - a keep-alive requests.Session, so a payment is one request on a warm TLS connection
+    rather than a token round trip plus a fresh handshake.
+
+Settings (all optional):
+    DARAJA_TOKEN_REFRESH_MARGIN   seconds before expiry a token is replaced (default 60)
+    DARAJA_POOL_SIZE              keep-alive connections per client (default 10)
+"""
+import base64
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://api.safaricom.co.ke'
+# Used when the token response has no usable expires_in (Daraja normally sends 3599)
+DEFAULT_EXPIRES_IN = 3599
+TOKEN_TIMEOUT = 10
+
+
+class DarajaAuthError(Exception):
+    """Raised when no OAuth token could be obtained; nothing was sent to Daraja."""
+
+
+class DarajaClient:
+    def __init__(self, consumer_key, consumer_secret, base_url=DEFAULT_BASE_URL, refresh_margin=None, pool_size=None):
+        self.base_url = base_url.rstrip('/')
+        self.refresh_margin = (
+            refresh_margin if refresh_margin is not None
+            else int(getattr(settings, 'DARAJA_TOKEN_REFRESH_MARGIN', 60))
+        )
+        self._basic_auth = base64.b64encode(f"{consumer_key}:{consumer_secret}".encode()).decode()
+
+        pool_size = pool_size or int(getattr(settings, 'DARAJA_POOL_SIZE', 10))
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self.token_fetches = 0
+
+    # ========================
+    # OAUTH TOKEN
+    # ========================
+
+    def get_token(self):
+        """Cached access token, fetched (once, under a lock) when missing or about to expire. None on failure."""
+        token = self._token
+        if token and time.monotonic() < self._expires_at:
+            return token
+
+        with self._lock:
+            if self._token and time.monotonic() < self._expires_at:
+                return self._token
+            try:
+                response = self.session.get(
+                    f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials",
+                    headers={"Authorization": f"Basic {self._basic_auth}"},
+                    timeout=TOKEN_TIMEOUT
+                )
+                response.raise_for_status()
+                data = response.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f"Failed to retrieve Daraja access token: {e}")
+                return None
+
+            self.token_fetches += 1
+            try:
+                expires_in = int(data.get('expires_in', DEFAULT_EXPIRES_IN))
+            except (TypeError, ValueError):
+                expires_in = DEFAULT_EXPIRES_IN
+            self._token = data.get('access_token')
+            self._expires_at = time.monotonic() + max(expires_in - self.refresh_margin, 0)
+            return self._token
+
+    def invalidate_token(self, token=None):
+        """Drop the cached token (only if it is still `token`, when given)."""
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+    # ========================
+    # REQUESTS
+    # ========================
+
+    def post(self, path, payload, timeout=30):
+        """
+        POST JSON with the bearer token and return the requests.Response.
+        A 401 (token revoked early) is retried once with a fresh token; Daraja rejected
+        the first call, so nothing was processed twice.
+        Raises DarajaAuthError if no token is available, and requests exceptions as usual.
+        """
+        for attempt in (1, 2):
+            token = self.get_token()
+            if not token:
+                raise DarajaAuthError("Failed to authenticate with Daraja")
+            response = self.session.post(
+                f"{self.base_url}{path}",
+                json=payload,
+                headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+                timeout=timeout
+            )
+            if response.status_code == 401 and attempt == 1:
+                self.invalidate_token(token)
+                continue
+            return response
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(consumer_key, consumer_secret, base_url=DEFAULT_BASE_URL):
+    """Process-wide client for one credential set."""
+    key = (consumer_key, consumer_secret, base_url.rstrip('/'))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = DarajaClient(consumer_key, consumer_secret, base_url)
+                _clients[key] = client
+    return client
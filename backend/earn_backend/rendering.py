@@ -0,0 +1,181 @@
+# earn_backend/rendering.py
+"""
+Shared PDF rendering service.
+
+Statements, receipts and any future documents render through `render_service.run(fn, ...)`.
+The work happens in a small pool of worker processes that load WeasyPrint and fonts once
+and keep compiled stylesheets, so requests and job workers never cold-start the layout engine.
+
+Settings (all optional):
+    PDF_RENDER_WORKERS      worker processes (default 2; 0 renders in-process)
+    PDF_RENDER_MAX_QUEUE    renders allowed to wait for a free worker (default 16)
+    PDF_RENDER_WAIT         seconds to wait for a queue slot before RenderQueueFull (default 30)
+    PDF_RENDER_TIMEOUT      seconds to wait for a single render (default 120)
+
+Worker processes are spawned fresh and never touch Django, so anything passed to run()
+must be a module-level function plus plain picklable data (strings, dicts, numbers).
+"""
+import hashlib
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueueFull(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+# ========================
+# WORKER-SIDE STATE (one copy per pool process)
+# ========================
+
+_font_config = None
+_compiled_css = {}
+
+
+def _get_font_config():
+    global _font_config
+    if _font_config is None:
+        from weasyprint.text.fonts import FontConfiguration
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def _warm_worker():
+    """Pool initializer: import WeasyPrint, load fonts and lay out one page before real work arrives."""
+    try:
+        from weasyprint import HTML
+        HTML(string='<p>warm-up</p>').write_pdf(font_config=_get_font_config())
+    except Exception as e:
+        # Non-WeasyPrint documents (reportlab receipts) can still use this worker
+        logger.warning(f"PDF worker warm-up skipped: {e}")
+
+
+def html_to_pdf(html_string, stylesheet=None, metadata=None):
+    """
+    Runs inside a worker: HTML string -> PDF bytes.
+    `stylesheet` is CSS text; it is compiled once per worker and reused for every later render.
+    """
+    from weasyprint import HTML, CSS
+
+    font_config = _get_font_config()
+    stylesheets = []
+    if stylesheet:
+        css_key = hashlib.sha1(stylesheet.encode()).hexdigest()
+        css = _compiled_css.get(css_key)
+        if css is None:
+            css = _compiled_css[css_key] = CSS(string=stylesheet, font_config=font_config)
+        stylesheets.append(css)
+
+    return HTML(string=html_string).write_pdf(
+        stylesheets=stylesheets,
+        font_config=font_config,
+        presentational_hints=True,
+        metadata=metadata or {},
+    )
+
+
+# ========================
+# CALLER SIDE
+# ========================
+
+class RenderService:
+    """Process pool with a hard concurrency limit and queue-depth counters."""
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.workers = None
+        self.max_queue = None
+        self.in_flight = 0
+        self.peak_queue_depth = 0
+        self.rendered = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _configure(self):
+        # Read lazily: this module is imported by worker processes where Django is not set up
+        from django.conf import settings
+
+        with self._lock:
+            if self._slots is not None:
+                return
+            self.workers = max(int(getattr(settings, 'PDF_RENDER_WORKERS', 2)), 0)
+            self.max_queue = max(int(getattr(settings, 'PDF_RENDER_MAX_QUEUE', 16)), 0)
+            self.wait_timeout = getattr(settings, 'PDF_RENDER_WAIT', 30)
+            self.render_timeout = getattr(settings, 'PDF_RENDER_TIMEOUT', 120)
+            self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.max_queue)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_warm_worker,
+                )
+            return self._executor
+
+    @property
+    def queue_depth(self):
+        """Renders waiting for a free worker right now."""
+        return max(self.in_flight - max(self.workers or 0, 1), 0)
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on a warm worker and return its result (usually PDF bytes)."""
+        self._configure()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            self.rejected += 1
+            logger.warning(f"⚠️ PDF render rejected: queue full ({self.stats()})")
+            raise RenderQueueFull("PDF renderer is busy. Please try again shortly.")
+
+        with self._lock:
+            self.in_flight += 1
+            self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+        try:
+            if self.workers == 0:
+                result = fn(*args, **kwargs)
+            else:
+                future = self._get_executor().submit(fn, *args, **kwargs)
+                result = future.result(timeout=self.render_timeout)
+            self.rendered += 1
+            return result
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault in a native lib); start a fresh pool next time
+            self.failed += 1
+            with self._lock:
+                self._executor = None
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'peak_queue_depth': self.peak_queue_depth,
+            'rendered': self.rendered,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+# Process-wide service used by statements and receipts
+render_service = RenderService()
@@ -77,6 +77,16 @@ CHANNEL_LAYERS = {
     "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
 }
 
+# Shared by daphne and every worker process: cache invalidations (survey catalogue
+# version, active subscription) must be seen by all of them, which rules out the
+# per-process LocMemCache default. The table is created by `manage.py createcachetable`.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('CACHE_LOCATION', default='django_cache'),
+    }
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -106,6 +116,8 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Generated files (cached statements). Served only through authenticated views, never via MEDIA_URL.
+MEDIA_ROOT = config('MEDIA_ROOT', default=str(BASE_DIR / 'media'))
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 FIREBASE_PROJECT_ID = config('FIREBASE_PROJECT_ID')
@@ -9,9 +9,9 @@ from users.models import User
 from referrals.models import ReferralTransaction
 from .models import OnboardingStep
 from users.utils import send_welcome_email
+from users.firebase_keys import key_store
 
 from jose import jwt
-import requests
 from django.conf import settings
 import time
 from datetime import timedelta
@@ -20,10 +20,10 @@ from django.utils import timezone
 
 def verify_firebase_token(token):
     try:
-        resp = requests.get('https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com')
-        keys = resp.json()
         header = jwt.get_unverified_header(token)
-        public_key = keys[header['kid']]
+        public_key = key_store.get_key(header['kid'])
+        if not public_key:
+            raise ValidationError('Unknown signing key')
         decoded_token = jwt.decode(
             token,
             public_key,
@@ -0,0 +1,166 @@
+# subscriptions/callbacks.py
+"""
+Processing for Daraja STK push callbacks. The webhook (SubscriptionCallbackView) only
+stores the payload in the callback inbox; `process_callback_inbox` calls
+apply_stk_callback() with it. Errors propagate so the inbox can retry the row.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import UserSubscription, SubscriptionTransaction
+from .utils import create_receipt
+from users.utils import send_welcome_aboard_email
+
+logger = logging.getLogger(__name__)
+
+
+def stk_serial_key(data):
+    """Inbox ordering key: callbacks for one checkout are applied one at a time, in order."""
+    checkout_id = data.get('Body', {}).get('stkCallback', {}).get('CheckoutRequestID')
+    return f"checkout:{checkout_id}" if checkout_id else None
+
+
+def apply_stk_callback(data):
+    """
+    Apply one STK callback payload.
+
+    On successful payment:
+      1. Marks the transaction as completed.
+      2. Expires any other active subscription the user has (prevents UniqueConstraint violation).
+      3. Activates the pending subscription.
+      4. Generates a receipt and sends a welcome email if applicable.
+
+    Idempotent: safe to apply duplicate callbacks.
+    """
+    result = data.get('Body', {}).get('stkCallback', {})
+    checkout_id = result.get('CheckoutRequestID')
+    result_code = result.get('ResultCode')
+
+    if not checkout_id:
+        logger.error("Missing CheckoutRequestID in subscription callback")
+        return
+
+    # --- Lookup transaction ---
+    try:
+        transaction_record = SubscriptionTransaction.objects.select_related(
+            'subscription', 'subscription__plan', 'subscription__user'
+        ).get(checkout_request_id=checkout_id)
+    except SubscriptionTransaction.DoesNotExist:
+        logger.warning(f"Callback for unknown CheckoutRequestID: {checkout_id}")
+        return
+
+    # --- Idempotency: already processed ---
+    if transaction_record.status == 'completed':
+        logger.info(f"Duplicate callback for completed transaction {checkout_id}")
+        return
+
+    subscription = transaction_record.subscription
+    user = subscription.user
+
+    # ----------------------------------------------------------------
+    # PAYMENT SUCCESS
+    # ----------------------------------------------------------------
+    if result_code == 0:
+        callback_metadata = result.get('CallbackMetadata', {}).get('Item', [])
+        receipt_number = None
+        trans_date = None
+
+        for item in callback_metadata:
+            name = item.get('Name')
+            value = item.get('Value')
+            if name == 'MpesaReceiptNumber':
+                receipt_number = str(value)
+            elif name == 'TransactionDate':
+                trans_date = str(value)
+
+        with transaction.atomic():
+            # 1. Mark transaction as completed
+            transaction_record.status = 'completed'
+            transaction_record.mpesa_receipt_number = receipt_number or ''
+            if trans_date:
+                from datetime import datetime
+                try:
+                    transaction_record.transaction_date = datetime.strptime(
+                        trans_date, '%Y%m%d%H%M%S'
+                    )
+                except ValueError:
+                    transaction_record.transaction_date = timezone.now()
+            else:
+                transaction_record.transaction_date = timezone.now()
+            transaction_record.save()
+
+            # 2. Expire any OTHER active subscription for this user.
+            #    This is the fix for the UniqueConstraint violation and ensures
+            #    the user is seamlessly moved from their old plan to the new one.
+            old_subs = UserSubscription.objects.filter(
+                user=user,
+                status='active',
+            ).exclude(id=subscription.id)
+
+            if old_subs.exists():
+                logger.info(
+                    f"Expiring {old_subs.count()} old active subscription(s) "
+                    f"for user {user.email} before activating sub {subscription.id}"
+                )
+                old_subs.update(status='expired', updated_at=timezone.now())
+
+            # 3. Activate the newly paid subscription
+            now = timezone.now()
+            subscription.status = 'active'
+            subscription.start_date = now
+            subscription.end_date = now + timedelta(days=subscription.plan.duration_days)
+            # Reset grace_end_date so the model.save() recalculates it
+            subscription.grace_end_date = None
+            subscription.save()
+
+            # 4. Generate PDF receipt (non-blocking: failure doesn't abort activation)
+            try:
+                create_receipt(transaction_record)
+            except Exception as e:
+                logger.error(
+                    f"Failed to generate receipt for transaction {transaction_record.id}: {e}"
+                )
+
+            # 5. Welcome email on first paid purchase
+            has_paid_before = UserSubscription.objects.filter(
+                user=user,
+                is_trial=False,
+                status='active',
+            ).exclude(id=subscription.id).exists()
+
+            if not has_paid_before:
+                try:
+                    send_welcome_aboard_email(user, subscription)
+                except Exception as e:
+                    logger.warning(
+                        f"Failed to send welcome email to {user.email}: {e}"
+                    )
+
+        logger.info(
+            f"Subscription {subscription.id} activated for user {user.email} "
+            f"(plan: {subscription.plan.get_name_display()}, "
+            f"expires: {subscription.end_date.date()})"
+        )
+
+    # ----------------------------------------------------------------
+    # PAYMENT FAILED
+    # ----------------------------------------------------------------
+    else:
+        result_desc = result.get('ResultDesc', 'Unknown error')
+        logger.warning(
+            f"STK failed for subscription {checkout_id}: {result_desc}"
+        )
+
+        with transaction.atomic():
+            transaction_record.status = 'failed'
+            transaction_record.error_message = result_desc
+            transaction_record.save()
+
+            # Cancel the pending subscription so the user can try again cleanly
+            if subscription.status == 'pending':
+                subscription.status = 'cancelled'
+                subscription.cancelled_at = timezone.now()
+                subscription.save()
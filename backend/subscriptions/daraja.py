@@ -5,6 +5,8 @@ from django.conf import settings
 import logging
 from decouple import config
 
+from earn_backend.daraja import DarajaAuthError, get_client
+
 logger = logging.getLogger(__name__)
 
 # Daraja credentials
@@ -14,19 +16,14 @@ DARAJA_SHORTCODE = config('DARAJA_SHORTCODE', default='174379')
 DARAJA_PASSKEY = config('DARAJA_PASSKEY')
 DARAJA_CALLBACK_URL = config('DARAJA_CALLBACK_URL')
 DARAJA_TILL_NUMBER = config('DARAJA_TILL_NUMBER')
+DARAJA_BASE_URL = config('DARAJA_BASE_URL', default='https://api.safaricom.co.ke')
+
+def _client():
+    return get_client(DARAJA_CONSUMER_KEY, DARAJA_CONSUMER_SECRET, DARAJA_BASE_URL)
 
 def get_access_token():
-    """Fetch Daraja OAuth2 access token."""
-    api_url = "https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-    credentials = base64.b64encode(f"{DARAJA_CONSUMER_KEY}:{DARAJA_CONSUMER_SECRET}".encode()).decode()
-    headers = {"Authorization": f"Basic {credentials}"}
-    try:
-        response = requests.get(api_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        return response.json().get('access_token')
-    except Exception as e:
-        logger.error(f"Failed to retrieve Daraja access token: {str(e)}")
-        return None
+    """Daraja OAuth2 access token, cached until shortly before it expires."""
+    return _client().get_token()
 
 def normalize_phone(phone: str) -> str:
     """Convert phone to 254... format."""
@@ -51,11 +48,6 @@ def generate_stk_push(phone_number: str, amount: int, account_reference: str, tr
         logger.error(f"Phone normalization failed: {e}")
         return {"error": str(e)}
 
-    access_token = get_access_token()
-    if not access_token:
-        return {"error": "Unable to authenticate with Daraja"}
-
-    api_url = "https://api.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     password = base64.b64encode(f"{DARAJA_SHORTCODE}{DARAJA_PASSKEY}{timestamp}".encode()).decode()
 
@@ -73,15 +65,12 @@ def generate_stk_push(phone_number: str, amount: int, account_reference: str, tr
         "TransactionDesc": transaction_desc
     }
 
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-
     try:
-        response = requests.post(api_url, json=payload, headers=headers, timeout=30)
+        response = _client().post("/mpesa/stkpush/v1/processrequest", payload, timeout=30)
         response.raise_for_status()
         return response.json()
+    except DarajaAuthError:
+        return {"error": "Unable to authenticate with Daraja"}
     except requests.exceptions.RequestException as e:
         logger.error(f"STK Push request failed: {str(e)}")
         return {"error": "Failed to reach Daraja API"}
\ No newline at end of file
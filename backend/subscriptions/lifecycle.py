@@ -0,0 +1,300 @@
+# subscriptions/lifecycle.py
+"""
+Daily subscription lifecycle pipeline: 3-day reminders, grace warnings, expiry.
+
+Each phase walks its candidates in id-ordered chunks (keyset, never OFFSET).
+Reminder and grace emails for a chunk fan out to a bounded thread pool. Expiry is one
+conditional UPDATE per chunk, and its notices are queued in the same transaction, so a
+row is never left expired without its notice. After every chunk the position is written
+to a checkpoint file, so a run that dies halfway resumes where it stopped (same clock,
+same windows).
+
+Run with: python manage.py process_subscriptions [--batch-size N] [--workers N]
+"""
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import UserSubscription
+from .utils import send_subscription_email, clear_subscription_caches
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('reminders', 'grace_warnings', 'expiry')
+PHASE_COUNTERS = {'reminders': 'reminders_sent', 'grace_warnings': 'grace_updated', 'expiry': 'expired'}
+
+
+def default_checkpoint_path():
+    return getattr(
+        settings, 'SUBSCRIPTION_JOB_CHECKPOINT',
+        os.path.join(settings.BASE_DIR, 'var', 'process_subscriptions.checkpoint.json')
+    )
+
+
+# ========================
+# CHECKPOINT
+# ========================
+
+class Checkpoint:
+    """Progress of one daily run, persisted as JSON after every chunk."""
+
+    def __init__(self, path, now, phase=PHASES[0], last_id=0, counters=None):
+        self.path = path
+        self.now = now
+        self.phase = phase
+        self.last_id = last_id
+        self.counters = counters or {'reminders_sent': 0, 'grace_updated': 0, 'expired': 0, 'errors': 0}
+
+    @classmethod
+    def load_or_start(cls, path, resume=True):
+        """Resume today's unfinished run if there is one, otherwise start fresh."""
+        now = timezone.now()
+        if resume and path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                started = parse_datetime(data['now'])
+                if started and started.date() == now.date() and data.get('phase') in PHASES:
+                    return cls(path, started, data['phase'], data.get('last_id', 0), data.get('counters')), True
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable subscription checkpoint {path}: {e}")
+        return cls(path, now), False
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({
+                'now': self.now.isoformat(),
+                'phase': self.phase,
+                'last_id': self.last_id,
+                'counters': self.counters,
+            }, f)
+        os.replace(tmp, self.path)
+
+    def advance(self, last_id):
+        self.last_id = last_id
+        self.save()
+
+    def next_phase(self):
+        index = PHASES.index(self.phase) + 1
+        self.phase = PHASES[index] if index < len(PHASES) else 'done'
+        self.last_id = 0
+        self.save()
+
+    def finish(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# ========================
+# CANDIDATE SETS
+# ========================
+
+def _reminder_candidates(now):
+    # (end_date - now).days == 3
+    return UserSubscription.objects.filter(
+        status='active',
+        end_date__gte=now + timedelta(days=3),
+        end_date__lt=now + timedelta(days=4),
+    )
+
+
+def _grace_warning_candidates(now):
+    # Past end_date, inside grace, with 1 or 2 whole days of grace left
+    return UserSubscription.objects.filter(
+        status='active',
+        end_date__lt=now,
+        grace_end_date__gte=now + timedelta(days=1),
+        grace_end_date__lt=now + timedelta(days=3),
+    )
+
+
+def _expiry_candidates(now):
+    # Mirrors UserSubscription.is_active_with_grace() being False for an active row
+    return UserSubscription.objects.filter(
+        status='active',
+        end_date__lt=now,
+    ).filter(Q(grace_end_date__isnull=True) | Q(grace_end_date__lt=now))
+
+
+# ========================
+# EMAIL FAN-OUT
+# ========================
+
+def _send_slice(subs, email_for):
+    """Runs on a pool thread: send one slice of a chunk over this thread's own DB connection."""
+    sent = errors = 0
+    try:
+        for sub in subs:
+            try:
+                if send_subscription_email(subscription=sub, **email_for(sub)):
+                    sent += 1
+            except Exception as e:
+                logger.error(f"Failed to send lifecycle email for sub {sub.id}: {e}")
+                errors += 1
+    finally:
+        connection.close()
+    return sent, errors
+
+
+def _fan_out(pool, workers, subs, email_for):
+    """Send emails for a chunk with at most `workers` in flight. Returns (sent, errors)."""
+    if not subs:
+        return 0, 0
+    slices = [subs[i::workers] for i in range(workers) if subs[i::workers]]
+    sent = errors = 0
+    for s, e in pool.map(lambda part: _send_slice(part, email_for), slices):
+        sent += s
+        errors += e
+    return sent, errors
+
+
+def _reminder_email(sub):
+    return {
+        'email_type': 'expiry_reminder_3day',
+        'subject': f'Your {sub.plan.get_name_display()} Subscription Expires in 3 Days',
+        'template_name': 'emails/subscription_expiry_reminder.html',
+        'context': {'days_remaining': 3},
+    }
+
+
+def _grace_email_factory(now):
+    def grace_email(sub):
+        grace_days_left = (sub.grace_end_date - now).days
+        return {
+            'email_type': 'grace_period_warning',
+            'subject': f'Grace Period: {grace_days_left} Days Left to Renew',
+            'template_name': 'emails/subscription_grace_warning.html',
+            'context': {'grace_days_remaining': grace_days_left},
+        }
+    return grace_email
+
+
+def _expired_email(sub):
+    return {
+        'email_type': 'expired_notice',
+        'subject': 'Your Qezzy Subscription Has Expired',
+        'template_name': 'emails/subscription_expired_notice.html',
+        'context': {'plan_name': sub.plan.get_name_display()},
+    }
+
+
+# ========================
+# PIPELINE
+# ========================
+
+def _chunks(queryset, last_id, batch_size):
+    """Yield id-ordered chunks (with user and plan loaded) after last_id."""
+    queryset = queryset.select_related('user', 'plan').order_by('id')
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not chunk:
+            return
+        last_id = chunk[-1].id
+        yield chunk
+
+
+def _expire_chunk(chunk, now):
+    """
+    Flip a chunk to 'expired' with one conditional UPDATE and queue the expired notices
+    in the same transaction. Returns (rows that moved, email errors).
+    Rows locked by another transaction (a renewal in flight) are skipped, not waited on.
+
+    The resumed run only re-selects rows that are still 'active', so the notices must
+    commit together with the status change or a crash in between would lose them.
+    """
+    errors = 0
+    with transaction.atomic():
+        ids = set(
+            _expiry_candidates(now)
+            .select_for_update(skip_locked=True)
+            .filter(id__in=[s.id for s in chunk])
+            .values_list('id', flat=True)
+        )
+        if ids:
+            UserSubscription.objects.filter(id__in=ids, status='active').update(
+                status='expired', updated_at=timezone.now()
+            )
+
+        expired = [s for s in chunk if s.id in ids]
+        for sub in expired:
+            sub.status = 'expired'
+            try:
+                # Savepoint: one bad email must not roll back the chunk's expiry
+                with transaction.atomic():
+                    send_subscription_email(subscription=sub, **_expired_email(sub))
+            except Exception as e:
+                logger.error(f"Failed to queue expired notice for sub {sub.id}: {e}")
+                errors += 1
+
+    # .update() skips post_save, so drop the cached access decisions here
+    clear_subscription_caches([s.user_id for s in expired])
+    return expired, errors
+
+
+def run_lifecycle(batch_size=1000, workers=4, checkpoint_path=None, resume=True, dry_run=False, log=None):
+    """
+    Run (or resume) today's lifecycle pass. Returns the counters dict.
+    `log` is an optional callable for progress lines (the management command's stdout).
+    """
+    log = log or (lambda message: None)
+    workers = max(int(workers), 1)
+    if dry_run:
+        checkpoint_path = None  # A dry run never writes or resumes progress
+
+    checkpoint, resumed = Checkpoint.load_or_start(checkpoint_path, resume=resume)
+    now = checkpoint.now
+    counters = checkpoint.counters
+    if resumed:
+        log(f'↩️  Resuming run started {now:%Y-%m-%d %H:%M:%S} at {checkpoint.phase} after id {checkpoint.last_id}')
+
+    candidates = {
+        'reminders': _reminder_candidates,
+        'grace_warnings': _grace_warning_candidates,
+        'expiry': _expiry_candidates,
+    }
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while checkpoint.phase != 'done':
+            phase = checkpoint.phase
+            queryset = candidates[phase](now)
+
+            if dry_run:
+                count = queryset.count()
+                counters[PHASE_COUNTERS[phase]] += count
+                log(f'  [DRY] {phase}: {count} subscription(s)')
+                checkpoint.next_phase()
+                continue
+
+            for chunk in _chunks(queryset, checkpoint.last_id, batch_size):
+                if phase == 'reminders':
+                    sent, errors = _fan_out(pool, workers, chunk, _reminder_email)
+                    counters['reminders_sent'] += sent
+                elif phase == 'grace_warnings':
+                    sent, errors = _fan_out(pool, workers, chunk, _grace_email_factory(now))
+                    counters['grace_updated'] += sent
+                else:
+                    expired, errors = _expire_chunk(chunk, now)
+                    counters['expired'] += len(expired)
+                    counters['grace_updated'] += len(expired)
+
+                counters['errors'] += errors
+                checkpoint.advance(chunk[-1].id)
+                log(f'  ✅ {phase}: through id {chunk[-1].id}')
+
+            checkpoint.next_phase()
+
+    checkpoint.finish()
+    logger.info(f"Subscription lifecycle run finished: {counters}")
+    return counters
@@ -0,0 +1,77 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from earn_backend.rendering import render_service
+from subscriptions.models import SubscriptionTransaction, SubscriptionReceipt
+from subscriptions.utils import build_receipt
+
+logger = logging.getLogger('subscriptions.management')
+
+
+class Command(BaseCommand):
+    help = 'Generates missing SubscriptionReceipts for completed transactions in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Transactions rendered and saved per batch (default: 200).')
+        parser.add_argument('--limit', type=int, default=0, help='Stop after this many receipts (0 = all).')
+        parser.add_argument('--concurrency', type=int, default=4, help='Receipts rendered in parallel (default: 4; the render pool caps real parallelism).')
+        parser.add_argument('--dry-run', action='store_true', help='Only count transactions missing a receipt.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        limit = options['limit']
+
+        missing = (
+            SubscriptionTransaction.objects
+            .filter(status='completed', receipt__isnull=True)
+            .select_related('subscription__plan')
+            .order_by('id')
+        )
+
+        total_missing = missing.count()
+        self.stdout.write(f'🧾 {total_missing} completed transactions without a receipt.')
+        if options['dry_run'] or not total_missing:
+            return
+
+        created = failed = 0
+        last_id = 0
+
+        with ThreadPoolExecutor(max_workers=max(options['concurrency'], 1)) as pool:
+            while not limit or created + failed < limit:
+                size = batch_size if not limit else min(batch_size, limit - created - failed)
+                batch = list(missing.filter(id__gt=last_id)[:size])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                receipts = []
+                for tx, result in zip(batch, pool.map(self._build, batch)):
+                    if result is None:
+                        failed += 1
+                    else:
+                        receipts.append(result)
+
+                # One INSERT per batch; ignore_conflicts covers a receipt created concurrently by the callback
+                SubscriptionReceipt.objects.bulk_create(receipts, ignore_conflicts=True)
+                created += len(receipts)
+                self.stdout.write(f'  ✅ {created} receipts created so far (last transaction id {last_id})')
+
+        render_service.shutdown()
+
+        self.stdout.write()
+        self.stdout.write('📊 SUMMARY:')
+        self.stdout.write(f'  🧾 Receipts created: {created}')
+        self.stdout.write(f'  ❌ Failed: {failed}')
+        stats = render_service.stats()
+        self.stdout.write(f'  🖨️  Renderer: {stats["rendered"]} rendered, peak queue depth {stats["peak_queue_depth"]}')
+        if failed:
+            self.stdout.write(self.style.WARNING('⚠️  Some receipts failed; see logs and re-run to retry them.'))
+
+    def _build(self, tx):
+        try:
+            return build_receipt(tx)
+        except Exception as e:
+            logger.error(f"Receipt backfill failed for transaction {tx.id}: {e}", exc_info=True)
+            return None
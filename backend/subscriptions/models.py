@@ -265,13 +265,17 @@ class SubscriptionReceipt(models.Model):
     def __str__(self):
         return f"Receipt {self.receipt_number} for {self.transaction.user.email}"
 
+    @staticmethod
+    def generate_receipt_number():
+        prefix = 'RCP'
+        timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
+        random_suffix = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
+        return f"{prefix}-{timestamp}-{random_suffix}"
+
     def save(self, *args, **kwargs):
         """Auto-generate receipt number if not set."""
         if not self.receipt_number:
-            prefix = 'RCP'
-            timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
-            random_suffix = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
-            self.receipt_number = f"{prefix}-{timestamp}-{random_suffix}"
+            self.receipt_number = self.generate_receipt_number()
         super().save(*args, **kwargs)
 
     def increment_download(self):
@@ -0,0 +1,94 @@
+# subscriptions/receipts.py
+"""
+Receipt layout. Runs on the shared render pool (earn_backend.rendering), whose worker
+processes have no Django, so this module must only import reportlab and take plain data.
+"""
+import io
+import threading
+
+# Static parts per plan version, built once per process: {plan_key: dict}
+_plan_parts = {}
+# Cached flowables are shared between builds; serialize builds when rendering in-process
+_build_lock = threading.Lock()
+
+
+def _static_parts(plan_key, plan_name):
+    """Styles, header, plan row and footer for one SubscriptionPlan version."""
+    parts = _plan_parts.get(plan_key)
+    if parts is not None:
+        return parts
+
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import TableStyle, Paragraph, Spacer
+
+    styles = getSampleStyleSheet()
+
+    # Custom styles
+    title_style = ParagraphStyle('ReceiptTitle', parent=styles['Title'], fontSize=18, textColor=colors.HexColor('#8B5E00'), spaceAfter=10)
+    subtitle_style = ParagraphStyle('SubTitle', parent=styles['Normal'], fontSize=12, textColor=colors.gray, spaceAfter=15)
+    label_style = ParagraphStyle('Label', parent=styles['Normal'], fontSize=10, textColor=colors.gray)
+    value_style = ParagraphStyle('Value', parent=styles['Normal'], fontSize=11, textColor=colors.black)
+    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=9, textColor=colors.gray, alignment=1)
+
+    parts = {
+        'label_style': label_style,
+        'value_style': value_style,
+        # Header
+        'header': [
+            Paragraph('Qezzy Kenya', title_style),
+            Paragraph('Subscription Payment Receipt', subtitle_style),
+        ],
+        'labels': {
+            label: Paragraph(label, label_style)
+            for label in ['Receipt Number', 'Date', 'Plan', 'Amount', 'M-Pesa Reference', 'Status']
+        },
+        'plan_value': Paragraph(plan_name, value_style),
+        'table_style': TableStyle([
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
+            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f9f9f9')),
+            ('PADDING', (0, 0), (-1, -1), 8),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]),
+        # Footer
+        'footer': [
+            Spacer(1, 20),
+            Paragraph('Thank you for your payment. This receipt serves as proof of subscription activation.', styles['Italic']),
+            Spacer(1, 10),
+            Paragraph('© Qezzy Kenya • www.qezzykenya.company • Support: support@qezzykenya.company', footer_style),
+        ],
+    }
+    _plan_parts[plan_key] = parts
+    return parts
+
+
+def build_receipt_pdf(data: dict) -> bytes:
+    """
+    Lay out a subscription receipt from plain values:
+    plan_key, plan_name, receipt_number, date, amount, mpesa_reference, status.
+    Only the per-transaction cells are built here; the rest comes from _static_parts().
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Table, Paragraph
+
+    parts = _static_parts(data['plan_key'], data['plan_name'])
+    labels = parts['labels']
+    value_style = parts['value_style']
+
+    # Transaction Details Table
+    table = Table([
+        [labels['Receipt Number'], Paragraph(data['receipt_number'], value_style)],
+        [labels['Date'], Paragraph(data['date'], value_style)],
+        [labels['Plan'], parts['plan_value']],
+        [labels['Amount'], Paragraph(data['amount'], value_style)],
+        [labels['M-Pesa Reference'], Paragraph(data['mpesa_reference'], value_style)],
+        [labels['Status'], Paragraph(data['status'], value_style)],
+    ], colWidths=[60*mm, 100*mm])
+    table.setStyle(parts['table_style'])
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=20*mm, leftMargin=20*mm, topMargin=20*mm, bottomMargin=20*mm)
+    with _build_lock:
+        doc.build(parts['header'] + [table] + parts['footer'])
+    return buffer.getvalue()
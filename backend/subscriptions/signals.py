@@ -2,12 +2,12 @@ import logging
 from datetime import timedelta
 
 from django.db import transaction
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 
 from .models import UserSubscription, SubscriptionTransaction, SubscriptionReceipt, SubscriptionEmailLog
-from .utils import send_subscription_email, generate_receipt_pdf
+from .utils import send_subscription_email, create_receipt, clear_subscription_cache
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +23,21 @@ def auto_calculate_grace_period(sender, instance, **kwargs):
         instance.grace_end_date = instance.end_date + timedelta(days=2)
 
 
+@receiver(post_save, sender=UserSubscription)
+@receiver(post_delete, sender=UserSubscription)
+def invalidate_subscription_cache(sender, instance, **kwargs):
+    """
+    Drop the cached active subscription for this user.
+    Cleared now and again on commit, so a read racing the transaction cannot re-cache stale data.
+    """
+    if UserSubscription.user.is_cached(instance):
+        clear_subscription_cache(instance.user)
+    else:
+        clear_subscription_cache(user_id=instance.user_id)
+    user_id = instance.user_id
+    transaction.on_commit(lambda: clear_subscription_cache(user_id=user_id))
+
+
 @receiver(post_save, sender=UserSubscription)
 def handle_subscription_lifecycle_emails(sender, instance, created, update_fields=None, **kwargs):
     """
@@ -119,11 +134,7 @@ def ensure_receipt_on_completion(sender, instance, created, update_fields=None,
 
     try:
         with transaction.atomic():
-            pdf_buffer = generate_receipt_pdf(instance)
-            SubscriptionReceipt.objects.create(
-                transaction=instance,
-                pdf_file=pdf_buffer,
-            )
+            create_receipt(instance)
         logger.info(f"Signal generated fallback receipt for transaction {instance.id}")
     except Exception as e:
         logger.error(
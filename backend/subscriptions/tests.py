@@ -1,3 +1,146 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from users.models import OutboundEmail, User
+from withdrawals.models import CallbackInbox
+
+from . import lifecycle
+from .models import SubscriptionEmailLog, SubscriptionPlan, UserSubscription
+from .utils import _subscription_cache_key, get_active_subscription
+from .views import SubscriptionCallbackView
+
+
+class LifecycleExpiryResumeTests(TestCase):
+    """A run that dies during expiry must not leave expired subscriptions without their notice."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        self.checkpoint = os.path.join(self.dir, 'lifecycle.json')
+
+        plan = SubscriptionPlan.objects.create(name='basic', price_kes=Decimal('100.00'), tier_level=1)
+        now = timezone.now()
+        self.subs = []
+        for i in range(5):
+            user = User.objects.create_user(email=f'expiring{i}@example.com', referral_code=f'EXP{i:05d}')
+            self.subs.append(UserSubscription.objects.create(
+                user=user, plan=plan, status='active',
+                start_date=now - timedelta(days=40),
+                end_date=now - timedelta(days=10),
+                grace_end_date=now - timedelta(days=7),
+            ))
+
+    def _notice_logs(self):
+        return SubscriptionEmailLog.objects.filter(subscription__in=self.subs, email_type='expired_notice')
+
+    def test_crash_while_queueing_notices_is_resumed_without_losing_any(self):
+        real_send = lifecycle.send_subscription_email
+        calls = {'n': 0}
+
+        def dies_once(**kwargs):
+            calls['n'] += 1
+            if calls['n'] == 2:
+                raise KeyboardInterrupt  # the process is killed mid-chunk
+            return real_send(**kwargs)
+
+        with mock.patch.object(lifecycle, 'send_subscription_email', side_effect=dies_once):
+            with self.assertRaises(KeyboardInterrupt):
+                lifecycle.run_lifecycle(batch_size=2, workers=2, checkpoint_path=self.checkpoint)
+
+        # The interrupted chunk rolled back as a whole: nothing expired without a notice
+        expired_ids = set(UserSubscription.objects.filter(id__in=[s.id for s in self.subs], status='expired')
+                          .values_list('id', flat=True))
+        self.assertEqual(set(self._notice_logs().values_list('subscription_id', flat=True)), expired_ids)
+
+        counters = lifecycle.run_lifecycle(batch_size=2, workers=2, checkpoint_path=self.checkpoint)
+
+        self.assertEqual(counters['expired'], 5)
+        self.assertEqual(UserSubscription.objects.filter(id__in=[s.id for s in self.subs], status='expired').count(), 5)
+        self.assertEqual(self._notice_logs().count(), 5)
+        self.assertEqual(OutboundEmail.objects.filter(kind='subscription:expired_notice').count(), 5)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_failed_notice_does_not_undo_the_expiry(self):
+        with mock.patch.object(lifecycle, 'send_subscription_email', side_effect=RuntimeError('template error')):
+            counters = lifecycle.run_lifecycle(batch_size=2, workers=2, checkpoint_path=self.checkpoint)
+
+        self.assertEqual(counters['expired'], 5)
+        self.assertEqual(counters['errors'], 5)
+        self.assertEqual(UserSubscription.objects.filter(id__in=[s.id for s in self.subs], status='expired').count(), 5)
+
+
+class ActiveSubscriptionCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.plan = SubscriptionPlan.objects.create(name='basic', price_kes=Decimal('100.00'), tier_level=1)
+        self.user = User.objects.create_user(email='cached@example.com', referral_code='CACHE001')
+
+    def _request_user(self):
+        # Each request authenticates a fresh User object
+        return User.objects.get(pk=self.user.pk)
+
+    def _subscribe_elsewhere(self):
+        """Activation as the callback worker does it; no signal reaches this process's memo."""
+        now = timezone.now()
+        UserSubscription.objects.bulk_create([UserSubscription(
+            user=self.user, plan=self.plan, status='active', start_date=now, end_date=now + timedelta(days=30)
+        )])
+
+    def test_no_subscription_is_not_shared_across_requests(self):
+        self.assertIsNone(get_active_subscription(self._request_user()))
+        self.assertIsNone(cache.get(_subscription_cache_key(self.user.pk)))
+
+        self._subscribe_elsewhere()
+
+        sub = get_active_subscription(self._request_user())
+        self.assertIsNotNone(sub)
+        self.assertEqual(sub.plan.tier_level, 1)
+
+    def test_active_subscription_is_shared_until_saved(self):
+        self._subscribe_elsewhere()
+        sub = get_active_subscription(self._request_user())
+
+        user = self._request_user()
+        with self.assertNumQueries(1):  # the shared cache read only
+            self.assertEqual(get_active_subscription(user).id, sub.id)
+
+        sub.status = 'cancelled'
+        sub.save()
+        self.assertIsNone(get_active_subscription(self._request_user()))
+
+
+class SubscriptionCallbackViewTests(TestCase):
+    """The STK webhook only stores callbacks that come from Safaricom."""
+
+    payload = {'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 0}}}
+
+    def _post(self, remote_addr, **extra):
+        request = RequestFactory().post(
+            '/api/subscriptions/callback/daraja/', self.payload, content_type='application/json',
+            REMOTE_ADDR=remote_addr, **extra
+        )
+        return SubscriptionCallbackView.as_view()(request)
+
+    def test_other_ips_are_refused(self):
+        with self.assertLogs('withdrawals.utils', 'WARNING'):
+            response = self._post('203.0.113.7')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(CallbackInbox.objects.exists())
+
+    def test_safaricom_callback_is_stored_for_the_worker(self):
+        response = self._post('196.201.214.200')
+
+        self.assertEqual(response.status_code, 200)
+        row = CallbackInbox.objects.get()
+        self.assertEqual((row.kind, row.serial_key, row.status), ('stk', 'checkout:ws_CO_1', 'pending'))
+        self.assertEqual(row.remote_addr, '196.201.214.200')
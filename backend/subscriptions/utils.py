@@ -4,11 +4,13 @@ from datetime import timedelta, datetime
 from decimal import Decimal
 
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.db import transaction
-from django.template.loader import render_to_string
 from django.utils import timezone
-from django.utils.html import strip_tags
+
+from users.emails import preferences_url_for, render_email
+from users.outbox import enqueue_email
 
 from .models import (
     UserSubscription,
@@ -25,20 +27,80 @@ logger = logging.getLogger(__name__)
 # ACCESS & TIER UTILITIES
 # ========================
 
-def get_active_subscription(user):
-    """
-    Return the user's currently active subscription (including grace period).
-    Returns None if no active or grace-period subscription exists.
-    """
-    now = timezone.now()
+_NO_SUBSCRIPTION = 'none'
+
+
+def _subscription_cache_key(user_id):
+    return f'subscriptions:active:{user_id}'
+
+
+def _load_active_subscription(user):
     # Query active subscriptions first
-    subs = UserSubscription.objects.filter(user=user, status='active').order_by('-start_date')
+    subs = UserSubscription.objects.filter(user=user, status='active').select_related('plan').order_by('-start_date')
     for sub in subs:
         if sub.is_active_with_grace():
             return sub
     return None
 
 
+def get_active_subscription(user, use_cache=True):
+    """
+    Return the user's currently active subscription (including grace period).
+    Returns None if no active or grace-period subscription exists.
+
+    Resolved once per request (memoized on the user object). A found subscription is also
+    shared across requests for SUBSCRIPTION_CACHE_TTL seconds (default 60); every
+    UserSubscription save clears it (see signals.py). "No subscription" is never shared:
+    activation runs in the callback worker, and a user who has just paid must not wait
+    out a cached "none". Pass use_cache=False when you are about to modify the result.
+    """
+    if not use_cache:
+        return _load_active_subscription(user)
+
+    sub = getattr(user, '_active_subscription', None)
+    if sub is None:
+        key = _subscription_cache_key(user.pk)
+        sub = cache.get(key)
+        if sub is None:
+            sub = _load_active_subscription(user) or _NO_SUBSCRIPTION
+            if sub != _NO_SUBSCRIPTION:
+                cache.set(key, sub, timeout=getattr(settings, 'SUBSCRIPTION_CACHE_TTL', 60))
+        user._active_subscription = sub
+
+    if sub == _NO_SUBSCRIPTION:
+        return None
+    # A cached subscription can lapse without being saved; grace is time-based
+    if not sub.is_active_with_grace():
+        clear_subscription_cache(user)
+        return get_active_subscription(user)
+    return sub
+
+
+def clear_subscription_cache(user=None, user_id=None):
+    """Forget the cached active subscription for a user (object memo and shared cache)."""
+    if user is not None:
+        try:
+            del user._active_subscription
+        except AttributeError:
+            pass
+        user_id = user.pk
+    if user_id is not None:
+        cache.delete(_subscription_cache_key(user_id))
+
+
+def clear_subscription_caches(user_ids):
+    """Bulk form of clear_subscription_cache for set-based status updates."""
+    keys = [_subscription_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+
+
+def get_user_tier_level(user) -> int:
+    """Highest tier level the user can open right now (0 = Free only)."""
+    sub = get_active_subscription(user)
+    return sub.plan.tier_level if sub else 0
+
+
 def can_access_tier(user, target_tier_level: int) -> bool:
     """
     Check if a user's subscription grants access to a specific tier level.
@@ -82,8 +144,9 @@ def _should_send_email(user, email_type: str) -> bool:
 
 def send_subscription_email(subscription: UserSubscription, email_type: str, subject: str, template_name: str, context: dict = None):
     """
-    Send a subscription-related email, log it, and prevent duplicates within 1 hour.
+    Queue a subscription-related email, log it, and prevent duplicates within 1 hour.
     Mirrors the preference-respecting pattern in users/utils.py.
+    Returns True once queued; delivery is recorded on the log by the outbox worker.
     """
     user = subscription.user
     context = context or {}
@@ -103,7 +166,7 @@ def send_subscription_email(subscription: UserSubscription, email_type: str, sub
         return False
 
     # Build context
-    preferences_url = user.get_preferences_url() if hasattr(user, 'get_preferences_url') else None
+    preferences_url = preferences_url_for(user)
     base_context = {
         'first_name': user.first_name.title() or 'User',
         'email': user.email,
@@ -121,168 +184,100 @@ def send_subscription_email(subscription: UserSubscription, email_type: str, sub
     context.update(base_context)
 
     # Render templates
-    html_content = render_to_string(template_name, context)
-    text_content = strip_tags(html_content)
-
-    msg = EmailMultiAlternatives(
-        subject=subject,
-        body=text_content,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[user.email]
-    )
-    msg.attach_alternative(html_content, "text/html")
-
-    try:
-        msg.send()
-        # Log successful send
-        SubscriptionEmailLog.objects.create(
-            subscription=subscription,
-            email_type=email_type,
-            sent_at=timezone.now(),
-            delivered=True,
-            recipient_email=user.email
-        )
-        logger.info(f"Sent {email_type} email to {user.email}")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to send {email_type} email to {user.email}: {str(e)}")
-        SubscriptionEmailLog.objects.create(
+    html_content, text_content = render_email(template_name, context)
+
+    # Queue for the outbox worker; it flips the log to delivered (or records the error)
+
+    with transaction.atomic():
+        log = SubscriptionEmailLog.objects.create(
             subscription=subscription,
             email_type=email_type,
             sent_at=timezone.now(),
             delivered=False,
-            error_message=str(e),
             recipient_email=user.email
         )
-        return False
+        enqueue_email(
+            to_email=user.email,
+            subject=subject,
+            text_body=text_content,
+            html_body=html_content,
+            kind=f'subscription:{email_type}',
+            subscription_log=log
+        )
+    logger.info(f"Queued {email_type} email to {user.email}")
+    return True
 
 
 # ========================
 # PDF RECEIPT GENERATOR
 # ========================
 
-def generate_receipt_pdf(transaction: SubscriptionTransaction) -> io.BytesIO:
+def receipt_data(transaction: SubscriptionTransaction, receipt_number=None) -> dict:
+    """Plain values printed on a receipt (safe to send to a render worker)."""
+    if receipt_number is None:
+        receipt = getattr(transaction, 'receipt', None) if transaction.pk else None
+        receipt_number = receipt.receipt_number if receipt else 'PENDING'
+    plan = transaction.subscription.plan
+    return {
+        # Static layout is cached per plan version in the render worker
+        'plan_key': f'{plan.pk}:{plan.updated_at.timestamp() if plan.updated_at else 0}',
+        'plan_name': plan.get_name_display(),
+        'receipt_number': receipt_number,
+        'date': transaction.transaction_date.strftime('%d %b %Y, %H:%M') if transaction.transaction_date else 'Pending',
+        'amount': f'KES {transaction.amount:.2f}',
+        'mpesa_reference': transaction.mpesa_receipt_number or 'N/A',
+        'status': transaction.status.upper(),
+    }
+
+
+def generate_receipt_pdf(transaction: SubscriptionTransaction, receipt_number=None) -> io.BytesIO:
     """
     Generate a clean, professional PDF receipt for a completed subscription transaction.
-    Returns an io.BytesIO buffer ready for Django FileField storage.
+    Layout runs on the shared render pool. Returns an io.BytesIO buffer.
     """
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib import colors
-    from reportlab.lib.units import mm
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=20*mm, leftMargin=20*mm, topMargin=20*mm, bottomMargin=20*mm)
-    elements = []
-    styles = getSampleStyleSheet()
-
-    # Custom styles
-    title_style = ParagraphStyle('ReceiptTitle', parent=styles['Title'], fontSize=18, textColor=colors.HexColor('#8B5E00'), spaceAfter=10)
-    subtitle_style = ParagraphStyle('SubTitle', parent=styles['Normal'], fontSize=12, textColor=colors.gray, spaceAfter=15)
-    label_style = ParagraphStyle('Label', parent=styles['Normal'], fontSize=10, textColor=colors.gray)
-    value_style = ParagraphStyle('Value', parent=styles['Normal'], fontSize=11, textColor=colors.black)
-    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=9, textColor=colors.gray, alignment=1)
-
-    # Header
-    elements.append(Paragraph('Qezzy Kenya', title_style))
-    elements.append(Paragraph('Subscription Payment Receipt', subtitle_style))
-
-    # Transaction Details Table
-    data = [
-        [Paragraph('Receipt Number', label_style), Paragraph(transaction.receipt.receipt_number, value_style)] if hasattr(transaction, 'receipt') else ['Receipt Number', 'PENDING'],
-        [Paragraph('Date', label_style), Paragraph(transaction.transaction_date.strftime('%d %b %Y, %H:%M'), value_style) if transaction.transaction_date else ['Date', 'Pending']],
-        [Paragraph('Plan', label_style), Paragraph(transaction.subscription.plan.get_name_display(), value_style)],
-        [Paragraph('Amount', label_style), Paragraph(f'KES {transaction.amount:.2f}', value_style)],
-        [Paragraph('M-Pesa Reference', label_style), Paragraph(transaction.mpesa_receipt_number or 'N/A', value_style)],
-        [Paragraph('Status', label_style), Paragraph(transaction.status.upper(), value_style)],
-    ]
-
-    table = Table(data, colWidths=[60*mm, 100*mm])
-    table.setStyle(TableStyle([
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f9f9f9')),
-        ('PADDING', (0, 0), (-1, -1), 8),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]))
-    elements.append(table)
-    elements.append(Spacer(1, 20))
-
-    # Footer
-    elements.append(Paragraph('Thank you for your payment. This receipt serves as proof of subscription activation.', styles['Italic']))
-    elements.append(Spacer(1, 10))
-    elements.append(Paragraph('© Qezzy Kenya • www.qezzykenya.company • Support: support@qezzykenya.company', footer_style))
-
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
+    from earn_backend.rendering import render_service
+    from .receipts import build_receipt_pdf
+
+    return io.BytesIO(render_service.run(build_receipt_pdf, receipt_data(transaction, receipt_number)))
+
+
+def build_receipt(transaction: SubscriptionTransaction) -> SubscriptionReceipt:
+    """
+    Render a receipt and return an UNSAVED SubscriptionReceipt with its PDF attached.
+    The receipt number is chosen first so it is printed on the PDF.
+    """
+    receipt_number = SubscriptionReceipt.generate_receipt_number()
+    pdf_buffer = generate_receipt_pdf(transaction, receipt_number)
+    receipt = SubscriptionReceipt(transaction=transaction, receipt_number=receipt_number)
+    receipt.pdf_file.save(f'{receipt_number}.pdf', ContentFile(pdf_buffer.getvalue()), save=False)
+    return receipt
+
+
+def create_receipt(transaction: SubscriptionTransaction) -> SubscriptionReceipt:
+    """Render and store the receipt for a completed transaction."""
+    receipt = build_receipt(transaction)
+    receipt.save()
+    return receipt
 
 
 # ========================
 # DAILY EXPIRY PROCESSOR
 # ========================
 
-def process_daily_subscription_tasks():
+def process_daily_subscription_tasks(batch_size=1000, workers=4):
     """
     Run this function daily via cron, Celery beat, or django-q.
     Handles:
       1. Sending 3-day expiry reminders
       2. Sending grace period warnings (day 1 & 2 after expiry)
       3. Updating expired subscriptions status
+    Chunked and resumable; see subscriptions/lifecycle.py.
     """
-    now = timezone.now()
-    tomorrow = now + timedelta(days=1)
-
-    # 1. 3-Day Expiry Reminders
-    subscriptions_expiring_soon = UserSubscription.objects.filter(
-        status='active',
-        end_date__gt=now,
-        end_date__lte=tomorrow + timedelta(days=3)
-    )
-    for sub in subscriptions_expiring_soon:
-        days_left = (sub.end_date - now).days
-        if days_left == 3:
-            send_subscription_email(
-                subscription=sub,
-                email_type='expiry_reminder_3day',
-                subject=f'Your {sub.plan.get_name_display()} Subscription Expires in 3 Days',
-                template_name='emails/subscription_expiry_reminder.html',
-                context={'days_remaining': 3}
-            )
-
-    # 2. Grace Period Warnings & Status Updates
-    expired_subscriptions = UserSubscription.objects.filter(
-        status='active',
-        end_date__lt=now
-    )
-    for sub in expired_subscriptions:
-        if sub.is_active_with_grace():
-            # Still in grace period: warn user
-            grace_days_left = (sub.grace_end_date - now).days if sub.grace_end_date else 0
-            if grace_days_left in (2, 1):
-                send_subscription_email(
-                    subscription=sub,
-                    email_type='grace_period_warning',
-                    subject=f'Grace Period: {grace_days_left} Days Left to Renew',
-                    template_name='emails/subscription_grace_warning.html',
-                    context={'grace_days_remaining': grace_days_left}
-                )
-        else:
-            # Grace period fully over: expire and restrict
-            with transaction.atomic():
-                sub.status = 'expired'
-                sub.save()
-                send_subscription_email(
-                    subscription=sub,
-                    email_type='expired_notice',
-                    subject='Your Qezzy Subscription Has Expired',
-                    template_name='emails/subscription_expired_notice.html',
-                    context={'plan_name': sub.plan.get_name_display()}
-                )
-
-    logger.info(f"Processed {len(subscriptions_expiring_soon)} upcoming expiries, {len(expired_subscriptions)} grace/expired updates.")
+    from .lifecycle import default_checkpoint_path, run_lifecycle
+
+    counters = run_lifecycle(batch_size=batch_size, workers=workers, checkpoint_path=default_checkpoint_path())
+    logger.info(f"Processed {counters['reminders_sent']} upcoming expiries, {counters['grace_updated']} grace/expired updates.")
     return {
-        'reminders_sent': len(subscriptions_expiring_soon),
-        'grace_updated': len(expired_subscriptions)
+        'reminders_sent': counters['reminders_sent'],
+        'grace_updated': counters['grace_updated']
     }
-
@@ -3,7 +3,7 @@ import uuid
 from datetime import timedelta
 from decimal import Decimal
 
-from django.db import transaction, IntegrityError
+from django.db import transaction
 from django.http import HttpResponse, HttpResponseForbidden
 from django.utils import timezone
 from django.utils.decorators import method_decorator
@@ -26,11 +26,12 @@ from .models import (
 )
 from .utils import (
     send_subscription_email,
-    generate_receipt_pdf,
+    create_receipt,
     get_active_subscription,
 )
 from .daraja import generate_stk_push, normalize_phone
-from users.utils import send_welcome_aboard_email
+from withdrawals import inbox as callback_inbox
+from withdrawals.utils import get_client_ip, require_safaricom_ip
 
 logger = logging.getLogger(__name__)
 
@@ -271,16 +272,15 @@ class InitiateSubscriptionPaymentView(APIView):
 
 
 @method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(require_safaricom_ip, name='dispatch')
 class SubscriptionCallbackView(APIView):
     """
     POST /api/subscriptions/callback/daraja/
     Daraja webhook callback handler.
 
-    On successful payment:
-      1. Marks the transaction as completed.
-      2. Expires any other active subscription the user has (prevents UniqueConstraint violation).
-      3. Activates the pending subscription.
-      4. Generates a receipt and sends a welcome email if applicable.
+    Only accepts Safaricom's callback IPs, stores the payload in the callback inbox and
+    acknowledges immediately. `python manage.py process_callback_inbox` then applies it
+    (subscriptions.callbacks.apply_stk_callback): activation, receipt and welcome email.
 
     Idempotent: safe to receive duplicate callbacks.
     """
@@ -291,146 +291,11 @@ class SubscriptionCallbackView(APIView):
         logger.info(f"Subscription Daraja callback received: {data}")
 
         try:
-            result = data.get('Body', {}).get('stkCallback', {})
-            checkout_id = result.get('CheckoutRequestID')
-            result_code = result.get('ResultCode')
-
-            if not checkout_id:
+            if not isinstance(data, dict) or not callback_inbox.receive('stk', data, get_client_ip(request) or None):
                 logger.error("Missing CheckoutRequestID in subscription callback")
                 return HttpResponse('ERROR', status=status.HTTP_400_BAD_REQUEST)
+            return HttpResponse('OK')
 
-            # --- Lookup transaction ---
-            try:
-                transaction_record = SubscriptionTransaction.objects.select_related(
-                    'subscription', 'subscription__plan', 'subscription__user'
-                ).get(checkout_request_id=checkout_id)
-            except SubscriptionTransaction.DoesNotExist:
-                logger.warning(f"Callback for unknown CheckoutRequestID: {checkout_id}")
-                return HttpResponse('OK')   # Acknowledge so Daraja stops retrying
-
-            # --- Idempotency: already processed ---
-            if transaction_record.status == 'completed':
-                logger.info(f"Duplicate callback for completed transaction {checkout_id}")
-                return HttpResponse('OK')
-
-            subscription = transaction_record.subscription
-            user = subscription.user
-
-            # ----------------------------------------------------------------
-            # PAYMENT SUCCESS
-            # ----------------------------------------------------------------
-            if result_code == 0:
-                callback_metadata = result.get('CallbackMetadata', {}).get('Item', [])
-                receipt_number = None
-                trans_date = None
-
-                for item in callback_metadata:
-                    name = item.get('Name')
-                    value = item.get('Value')
-                    if name == 'MpesaReceiptNumber':
-                        receipt_number = str(value)
-                    elif name == 'TransactionDate':
-                        trans_date = str(value)
-
-                with transaction.atomic():
-                    # 1. Mark transaction as completed
-                    transaction_record.status = 'completed'
-                    transaction_record.mpesa_receipt_number = receipt_number or ''
-                    if trans_date:
-                        from datetime import datetime
-                        try:
-                            transaction_record.transaction_date = datetime.strptime(
-                                trans_date, '%Y%m%d%H%M%S'
-                            )
-                        except ValueError:
-                            transaction_record.transaction_date = timezone.now()
-                    else:
-                        transaction_record.transaction_date = timezone.now()
-                    transaction_record.save()
-
-                    # 2. Expire any OTHER active subscription for this user.
-                    #    This is the fix for the UniqueConstraint violation and ensures
-                    #    the user is seamlessly moved from their old plan to the new one.
-                    old_subs = UserSubscription.objects.filter(
-                        user=user,
-                        status='active',
-                    ).exclude(id=subscription.id)
-
-                    if old_subs.exists():
-                        logger.info(
-                            f"Expiring {old_subs.count()} old active subscription(s) "
-                            f"for user {user.email} before activating sub {subscription.id}"
-                        )
-                        old_subs.update(status='expired', updated_at=timezone.now())
-
-                    # 3. Activate the newly paid subscription
-                    now = timezone.now()
-                    subscription.status = 'active'
-                    subscription.start_date = now
-                    subscription.end_date = now + timedelta(days=subscription.plan.duration_days)
-                    # Reset grace_end_date so the model.save() recalculates it
-                    subscription.grace_end_date = None
-                    subscription.save()
-
-                    # 4. Generate PDF receipt (non-blocking: failure doesn't abort activation)
-                    try:
-                        pdf_buffer = generate_receipt_pdf(transaction_record)
-                        SubscriptionReceipt.objects.create(
-                            transaction=transaction_record,
-                            pdf_file=pdf_buffer,
-                        )
-                    except Exception as e:
-                        logger.error(
-                            f"Failed to generate receipt for transaction {transaction_record.id}: {e}"
-                        )
-
-                    # 5. Welcome email on first paid purchase
-                    has_paid_before = UserSubscription.objects.filter(
-                        user=user,
-                        is_trial=False,
-                        status='active',
-                    ).exclude(id=subscription.id).exists()
-
-                    if not has_paid_before:
-                        try:
-                            send_welcome_aboard_email(user, subscription)
-                        except Exception as e:
-                            logger.warning(
-                                f"Failed to send welcome email to {user.email}: {e}"
-                            )
-
-                logger.info(
-                    f"Subscription {subscription.id} activated for user {user.email} "
-                    f"(plan: {subscription.plan.get_name_display()}, "
-                    f"expires: {subscription.end_date.date()})"
-                )
-                return HttpResponse('OK')
-
-            # ----------------------------------------------------------------
-            # PAYMENT FAILED
-            # ----------------------------------------------------------------
-            else:
-                result_desc = result.get('ResultDesc', 'Unknown error')
-                logger.warning(
-                    f"STK failed for subscription {checkout_id}: {result_desc}"
-                )
-
-                with transaction.atomic():
-                    transaction_record.status = 'failed'
-                    transaction_record.error_message = result_desc
-                    transaction_record.save()
-
-                    # Cancel the pending subscription so the user can try again cleanly
-                    if subscription.status == 'pending':
-                        subscription.status = 'cancelled'
-                        subscription.cancelled_at = timezone.now()
-                        subscription.save()
-
-                return HttpResponse('OK')
-
-        except IntegrityError as e:
-            logger.error(f"Database integrity error in callback: {str(e)}", exc_info=True)
-            return HttpResponse('ERROR', status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         except Exception as e:
             logger.error(f"Unexpected error in subscription callback: {str(e)}", exc_info=True)
             return HttpResponse('ERROR', status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -578,11 +443,7 @@ class ReceiptDownloadView(APIView):
             receipt = transaction_record.receipt
         except SubscriptionReceipt.DoesNotExist:
             try:
-                pdf_buffer = generate_receipt_pdf(transaction_record)
-                receipt = SubscriptionReceipt.objects.create(
-                    transaction=transaction_record,
-                    pdf_file=pdf_buffer,
-                )
+                receipt = create_receipt(transaction_record)
             except Exception as e:
                 logger.error(f"Failed to generate receipt on download: {e}")
                 return Response(
@@ -734,7 +595,7 @@ class CancelSubscriptionView(APIView):
         user = request.user
         immediate = request.data.get('immediate', False)
 
-        subscription = get_active_subscription(user)
+        subscription = get_active_subscription(user, use_cache=False)
         if not subscription:
             return Response(
                 {'error': 'No active subscription to cancel.'},
@@ -855,7 +716,7 @@ class AdminSubscriptionActionView(APIView):
                 }, status=status.HTTP_201_CREATED)
 
             elif action == 'extend':
-                subscription = get_active_subscription(target_user)
+                subscription = get_active_subscription(target_user, use_cache=False)
                 if not subscription:
                     return Response(
                         {'error': 'No active subscription to extend'},
@@ -872,7 +733,7 @@ class AdminSubscriptionActionView(APIView):
                 }, status=status.HTTP_200_OK)
 
             elif action == 'revoke':
-                subscription = get_active_subscription(target_user)
+                subscription = get_active_subscription(target_user, use_cache=False)
                 if not subscription:
                     return Response(
                         {'error': 'No active subscription to revoke'},
@@ -3,6 +3,7 @@ from django.db import transaction
 from django.utils.html import format_html
 from django.urls import reverse
 from .models import SurveyCategory, SurveyQuestion, UserSurveySubmission, SurveyAnswer
+from .services import bulk_review_submissions
 
 
 # ========================
@@ -84,7 +85,7 @@ class UserSurveySubmissionAdmin(admin.ModelAdmin):
     )
     list_filter = ('status', 'category__tier_level', 'submitted_at')
     search_fields = ('user__email', 'category__name')
-    readonly_fields = ('user', 'category', 'status', 'submitted_at', 'reviewed_at', 'reviewed_by', 'created_at', 'updated_at')
+    readonly_fields = ('user', 'category', 'status', 'submitted_at', 'reviewed_at', 'reviewed_by', 'claimed_by', 'claim_expires_at', 'created_at', 'updated_at')
     inlines = [SurveyAnswerInline]
     date_hierarchy = 'submitted_at'
     actions = ['approve_selected', 'reject_selected', 'reset_for_redo_selected']
@@ -92,6 +93,7 @@ class UserSurveySubmissionAdmin(admin.ModelAdmin):
     fieldsets = (
         ('Submission Details', {'fields': ('user', 'category', 'status')}),
         ('Review Information', {'fields': ('submitted_at', 'reviewed_at', 'reviewed_by', 'rejection_reason')}),
+        ('Review Queue', {'fields': ('claimed_by', 'claim_expires_at'), 'classes': ('collapse',)}),
         ('Timestamps', {'fields': ('created_at', 'updated_at'), 'classes': ('collapse',)}),
     )
 
@@ -144,25 +146,21 @@ class UserSurveySubmissionAdmin(admin.ModelAdmin):
 
     @admin.action(description="✅ Approve selected submissions (Credit Wallet)")
     def approve_selected(self, request, queryset):
-        count = 0
-        with transaction.atomic():
-            for sub in queryset.filter(status='pending_review'):
-                sub.mark_approved(reviewed_by_user=request.user)
-                # Wallet crediting is handled automatically by signals
-                count += 1
+        # One conditional UPDATE per chunk and one batched wallet credit (see surveys/services.py)
+        outcomes = bulk_review_submissions(queryset.values_list('id', flat=True), 'approve', request.user)
+        count = sum(1 for o in outcomes.values() if o == 'approved')
+        failed = sum(1 for o in outcomes.values() if o == 'failed')
         if count:
-            self.message_user(request, f'Successfully approved {count} submission(s). Wallets will be credited automatically.', messages.SUCCESS)
-        else:
+            self.message_user(request, f'Successfully approved {count} submission(s). Wallets credited.', messages.SUCCESS)
+        if failed:
+            self.message_user(request, f'{failed} submission(s) could not be approved; see logs.', messages.ERROR)
+        if not count and not failed:
             self.message_user(request, 'No pending submissions selected.', messages.WARNING)
 
     @admin.action(description="❌ Reject selected submissions")
     def reject_selected(self, request, queryset):
-        count = 0
-        default_reason = "Review rejected. Please review feedback and resubmit."
-        with transaction.atomic():
-            for sub in queryset.filter(status='pending_review'):
-                sub.mark_rejected(reviewed_by_user=request.user, reason=default_reason)
-                count += 1
+        outcomes = bulk_review_submissions(queryset.values_list('id', flat=True), 'reject', request.user)
+        count = sum(1 for o in outcomes.values() if o == 'rejected')
         if count:
             self.message_user(request, f'Rejected {count} submission(s). Users can view the reason and resubmit.', messages.WARNING)
         else:
@@ -0,0 +1,108 @@
+# surveys/catalogue.py
+"""
+Versioned cache of the active survey catalogue (categories + question definitions).
+
+Every SurveyCategory / SurveyQuestion save or delete bumps the version (see signals.py),
+so stale entries are simply never read again. Versions are random tokens, not a counter,
+so an evicted version key can never bring an old number (and its entries) back. The
+cache must be shared by all processes (settings.CACHES) for a bump to reach them.
+Each process also keeps the last decoded catalogue in memory and only re-reads the
+shared cache when the version moves.
+Returned dicts are shared: read them, never mutate them.
+"""
+import threading
+import uuid
+
+from django.core.cache import cache
+
+from .models import SurveyCategory
+
+VERSION_KEY = 'surveys:catalogue:version'
+CATALOGUE_TIMEOUT = 60 * 60  # Versioned keys are never stale; this only bounds memory
+
+_local = threading.local()
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def catalogue_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _new_version(), timeout=None)
+        version = cache.get(VERSION_KEY) or _new_version()
+    return version
+
+
+def bump_catalogue_version():
+    """Invalidate every cached catalogue (call after an admin edit is committed)."""
+    cache.set(VERSION_KEY, _new_version(), timeout=None)
+
+
+def _serialize_question(q):
+    return {
+        'id': q.id,
+        'text': q.text,
+        'type': q.question_type,
+        'required': q.is_required,
+        'order': q.order,
+        'options': q.options,
+    }
+
+
+def _build_catalogue():
+    categories = SurveyCategory.objects.filter(status='active').prefetch_related('questions')
+    return [
+        {
+            'id': cat.id,
+            'name': cat.name,
+            'description': cat.description,
+            'tier_level': cat.tier_level,
+            'amount_kes': str(cat.amount_kes),
+            # SurveyQuestion.Meta.ordering = ['order', 'id']
+            'questions': [_serialize_question(q) for q in cat.questions.all()],
+        }
+        for cat in categories
+    ]
+
+
+def _load(version, key_suffix, build):
+    """Process-local memo in front of the shared cache, both keyed by version."""
+    memo = getattr(_local, 'memo', None)
+    if memo is None or memo['version'] != version:
+        memo = _local.memo = {'version': version}
+    if key_suffix not in memo:
+        key = f'surveys:catalogue:v{version}:{key_suffix}'
+        data = cache.get(key)
+        if data is None:
+            data = build()
+            cache.set(key, data, timeout=CATALOGUE_TIMEOUT)
+        memo[key_suffix] = data
+    return memo[key_suffix]
+
+
+def get_catalogue():
+    """All active categories (with questions), in SurveyCategory's default order."""
+    return _load(catalogue_version(), 'all', _build_catalogue)
+
+
+def get_categories_for_tier(max_tier_level):
+    """Active categories a user with this tier level may open."""
+    version = catalogue_version()
+    return _load(
+        version,
+        f'tier{max_tier_level}',
+        lambda: [c for c in _load(version, 'all', _build_catalogue) if c['tier_level'] <= max_tier_level]
+    )
+
+
+def get_category(category_id):
+    """One active category dict by id, or None."""
+    try:
+        category_id = int(category_id)
+    except (TypeError, ValueError):
+        return None
+    version = catalogue_version()
+    by_id = _load(version, 'by_id', lambda: {c['id']: c for c in _load(version, 'all', _build_catalogue)})
+    return by_id.get(category_id)
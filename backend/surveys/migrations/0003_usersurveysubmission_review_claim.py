@@ -0,0 +1,26 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersurveysubmission',
+            name='claim_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='usersurveysubmission',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, help_text='Reviewer currently holding this submission in the review queue', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='claimed_survey_submissions', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
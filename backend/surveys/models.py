@@ -162,6 +162,17 @@ class UserSurveySubmission(models.Model):
         related_name='reviewed_survey_submissions',
         help_text="Admin who reviewed this submission"
     )
+
+    # Review queue lease: a claimed submission is hidden from other reviewers until it expires
+    claimed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='claimed_survey_submissions',
+        help_text="Reviewer currently holding this submission in the review queue"
+    )
+    claim_expires_at = models.DateTimeField(null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -191,10 +202,12 @@ class UserSurveySubmission(models.Model):
         return self.status == 'active'
 
     def mark_pending_review(self):
-        """Transition to pending_review status."""
+        """Transition to pending_review status (back of the review queue, unclaimed)."""
         self.status = 'pending_review'
         self.submitted_at = timezone.now()
-        self.save(update_fields=['status', 'submitted_at', 'updated_at'])
+        self.claimed_by = None
+        self.claim_expires_at = None
+        self.save(update_fields=['status', 'submitted_at', 'claimed_by', 'claim_expires_at', 'updated_at'])
 
     def mark_approved(self, reviewed_by_user):
         """Approve submission and credit wallet (handled by signal/utility)."""
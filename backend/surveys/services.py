@@ -0,0 +1,177 @@
+# surveys/services.py
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import UserSurveySubmission
+from .signals import survey_earning_entry
+
+logger = logging.getLogger('surveys')
+
+BULK_REVIEW_CHUNK_SIZE = 1000
+DEFAULT_REJECTION_REASON = "Review rejected. Please review feedback and resubmit."
+MAX_CLAIM_BATCH = 100
+
+# Review queue orderings; 'oldest' walks the (status, submitted_at) index
+QUEUE_ORDERINGS = {
+    'oldest': ('submitted_at', 'id'),
+    'value': ('-category__amount_kes', 'submitted_at', 'id'),
+}
+
+
+def review_lease_seconds():
+    return int(getattr(settings, 'SURVEY_REVIEW_LEASE_SECONDS', 600))
+
+
+def _reviewable_by(reviewer, now):
+    """Unclaimed, lease expired, or already held by this reviewer."""
+    return Q(claim_expires_at__isnull=True) | Q(claim_expires_at__lte=now) | Q(claimed_by=reviewer)
+
+
+# ========================
+# REVIEW QUEUE
+# ========================
+
+def claim_review_batch(reviewer, size=20, order='oldest'):
+    """
+    Lease up to `size` pending submissions to `reviewer`.
+
+    Rows are picked with FOR UPDATE SKIP LOCKED, so reviewers claiming at the same
+    moment get disjoint batches instead of waiting on each other. A claim lasts
+    SURVEY_REVIEW_LEASE_SECONDS (default 600); unreviewed items return to the queue
+    when it expires. Returns the claimed submissions in queue order.
+    """
+    if order not in QUEUE_ORDERINGS:
+        raise ValueError(f"order must be one of {', '.join(QUEUE_ORDERINGS)}")
+    size = max(1, min(int(size), MAX_CLAIM_BATCH))
+
+    with transaction.atomic():
+        now = timezone.now()
+        claimed = list(
+            UserSurveySubmission.objects
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('user', 'category')
+            .filter(status='pending_review')
+            .filter(Q(claim_expires_at__isnull=True) | Q(claim_expires_at__lte=now))
+            .order_by(*QUEUE_ORDERINGS[order])[:size]
+        )
+        if not claimed:
+            return []
+
+        expires_at = now + timedelta(seconds=review_lease_seconds())
+        UserSurveySubmission.objects.filter(id__in=[s.id for s in claimed]).update(
+            claimed_by=reviewer, claim_expires_at=expires_at
+        )
+        for submission in claimed:
+            submission.claimed_by = reviewer
+            submission.claim_expires_at = expires_at
+
+    logger.info(f"Staff {reviewer.email} claimed {len(claimed)} submission(s) for review")
+    return claimed
+
+
+def active_claims(reviewer):
+    """Pending submissions this reviewer still holds a live lease on."""
+    return (
+        UserSurveySubmission.objects
+        .select_related('user', 'category')
+        .filter(status='pending_review', claimed_by=reviewer, claim_expires_at__gt=timezone.now())
+        .order_by('submitted_at', 'id')
+    )
+
+
+def release_claims(reviewer, submission_ids=None):
+    """Hand this reviewer's claims (all, or just `submission_ids`) back to the queue."""
+    claims = UserSurveySubmission.objects.filter(claimed_by=reviewer, status='pending_review')
+    if submission_ids is not None:
+        claims = claims.filter(id__in=submission_ids)
+    return claims.update(claimed_by=None, claim_expires_at=None)
+
+
+# ========================
+# BULK REVIEW
+# ========================
+
+def bulk_review_submissions(submission_ids, action, reviewed_by_user, reason=""):
+    """
+    Approve or reject many submissions at once.
+
+    Each chunk runs in one DB transaction: the pending rows are locked, moved with a
+    single conditional UPDATE (only rows still in pending_review), and for approvals
+    every wallet credit is posted as one batch through wallets.services.post_entries.
+    Bypasses post_save on purpose: the per-row signal credit is what this replaces,
+    and the credits are keyed on the submission id, so neither path can pay twice.
+
+    Submissions leased to another reviewer (see claim_review_batch) are left alone.
+
+    Returns {submission_id: outcome} with outcome one of 'approved', 'rejected',
+    'not_found', 'not_pending', 'claimed' or 'failed'.
+    """
+    from wallets.services import post_entries
+
+    if action not in ('approve', 'reject'):
+        raise ValueError("action must be 'approve' or 'reject'")
+
+    new_status = 'approved' if action == 'approve' else 'rejected'
+    ids = list(dict.fromkeys(int(i) for i in submission_ids))
+    outcomes = {}
+
+    for start in range(0, len(ids), BULK_REVIEW_CHUNK_SIZE):
+        chunk = ids[start:start + BULK_REVIEW_CHUNK_SIZE]
+        try:
+            with transaction.atomic():
+                now = timezone.now()
+                pending = list(
+                    UserSurveySubmission.objects
+                    .select_for_update(of=('self',))
+                    .select_related('user', 'category')
+                    .filter(id__in=chunk, status='pending_review')
+                    .filter(_reviewable_by(reviewed_by_user, now))
+                    .order_by('id')
+                )
+                pending_ids = [s.id for s in pending]
+
+                if pending_ids:
+                    fields = {
+                        'status': new_status,
+                        'reviewed_at': now,
+                        'reviewed_by': reviewed_by_user,
+                        'claimed_by': None,
+                        'claim_expires_at': None,
+                        'updated_at': now,
+                    }
+                    if action == 'reject':
+                        fields['rejection_reason'] = reason or DEFAULT_REJECTION_REASON
+                    UserSurveySubmission.objects.filter(
+                        id__in=pending_ids, status='pending_review'
+                    ).update(**fields)
+
+                    if action == 'approve':
+                        post_entries(survey_earning_entry(s) for s in pending)
+
+            for submission_id in pending_ids:
+                outcomes[submission_id] = new_status
+        except Exception as e:
+            logger.error(f"❌ Bulk {action} failed for {len(chunk)} submission(s) starting at id {chunk[0]}: {e}", exc_info=True)
+            for submission_id in chunk:
+                outcomes[submission_id] = 'failed'
+            continue
+
+        # Explain the ids that were skipped (one read, outside the lock)
+        skipped = [i for i in chunk if i not in outcomes]
+        existing = dict(UserSurveySubmission.objects.filter(id__in=skipped).values_list('id', 'status')) if skipped else {}
+        for submission_id in skipped:
+            if submission_id not in existing:
+                outcomes[submission_id] = 'not_found'
+            elif existing[submission_id] == 'pending_review':
+                outcomes[submission_id] = 'claimed'
+            else:
+                outcomes[submission_id] = 'not_pending'
+
+    reviewed = sum(1 for o in outcomes.values() if o == new_status)
+    logger.info(f"Staff {reviewed_by_user.email} bulk-{action}d {reviewed} of {len(ids)} submission(s)")
+    return outcomes
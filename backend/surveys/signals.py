@@ -1,17 +1,33 @@
 import logging
 from django.db import transaction
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import UserSurveySubmission
+from .catalogue import bump_catalogue_version
+from .models import SurveyCategory, SurveyQuestion, UserSurveySubmission
 
 logger = logging.getLogger('surveys')
 
 
+def survey_earning_entry(submission):
+    """Unsaved wallet credit for an approved submission (post with wallets.services.post_entries)."""
+    from wallets.models import WalletTransaction
+    from wallets.services import ledger_key
+
+    return WalletTransaction(
+        user=submission.user,
+        wallet_type='main',
+        transaction_type='survey_earning',
+        amount=submission.category.amount_kes,
+        description=f"Payment for approved survey: {submission.category.name} (Submission ID: {submission.id})",
+        idempotency_key=ledger_key('survey_earning', submission.id)
+    )
+
+
 @receiver(post_save, sender=UserSurveySubmission)
 def credit_wallet_on_approval(sender, instance, created, update_fields=None, **kwargs):
     """
     Automatically credits the user's main wallet when a survey submission is approved.
-    Idempotent: checks for existing transactions to prevent duplicate payments.
+    Idempotent: keyed on the submission id, so re-saving never pays twice.
     """
     # Skip on initial creation or if status wasn't touched
     if created:
@@ -23,33 +39,26 @@ def credit_wallet_on_approval(sender, instance, created, update_fields=None, **k
     if instance.status == 'approved':
         # Lazy import to avoid circular dependencies with wallets app
         try:
-            from wallets.models import WalletTransaction
+            from wallets.services import post_entries
         except ImportError:
-            logger.error("WalletTransaction model not found. Skipping wallet credit.")
+            logger.error("Wallet services not found. Skipping wallet credit.")
             return
 
         try:
-            with transaction.atomic():
-                # Idempotency check: ensure we haven't already credited this submission
-                if WalletTransaction.objects.filter(
-                    user=instance.user,
-                    transaction_type='survey_earning',
-                    description__contains=f"Submission ID: {instance.id}"
-                ).exists():
-                    return
-
-                # Create wallet transaction
-                # This automatically triggers your existing running_balance update logic
-                WalletTransaction.objects.create(
-                    user=instance.user,
-                    wallet_type='main',
-                    transaction_type='survey_earning',
-                    amount=instance.category.amount_kes,
-                    description=f"Payment for approved survey: {instance.category.name} (Submission ID: {instance.id})"
-                )
-                
+            # Idempotent: the ledger's unique idempotency_key rejects a second credit
+            created_txs = post_entries([survey_earning_entry(instance)])
+            if created_txs:
                 logger.info(f"✅ Credited {instance.category.amount_kes} KES to {instance.user.email} for survey submission {instance.id}")
-                
+
         except Exception as e:
             logger.error(f"❌ Failed to credit wallet for submission {instance.id}: {str(e)}", exc_info=True)
-            # Note: Approval status is preserved. Admin can manually retry via Django shell if needed.
\ No newline at end of file
+            # Note: Approval status is preserved. Admin can manually retry via Django shell if needed.
+
+
+@receiver(post_save, sender=SurveyCategory)
+@receiver(post_delete, sender=SurveyCategory)
+@receiver(post_save, sender=SurveyQuestion)
+@receiver(post_delete, sender=SurveyQuestion)
+def invalidate_survey_catalogue(sender, **kwargs):
+    """Admin edited a category or question: drop cached catalogues once the change is committed."""
+    transaction.on_commit(bump_catalogue_version)
@@ -1,3 +1,114 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from users.models import User
+
+from . import catalogue
+from .models import SurveyCategory, SurveyQuestion, UserSurveySubmission
+from .views import SurveyCategoryListView
+
+
+class SurveyCategoryListQueryCountTests(TestCase):
+    """The category list costs the same number of queries however many categories exist."""
+
+    def setUp(self):
+        cache.clear()
+        catalogue._local.__dict__.clear()
+        self.factory = APIRequestFactory()
+
+    def _make_user_with_categories(self, count, prefix):
+        user = User.objects.create_user(email=f'{prefix}@example.com', referral_code=prefix.upper()[:8])
+        statuses = ['rejected', 'active', 'approved', 'pending_review']
+        for i in range(count):
+            category = SurveyCategory.objects.create(
+                name=f'{prefix}-{i}', tier_level=0, amount_kes=Decimal('10.00'), status='active'
+            )
+            for order in range(3):
+                SurveyQuestion.objects.create(category=category, text=f'Q{order}', question_type='text', order=order)
+            UserSurveySubmission.objects.create(
+                user=user, category=category, status=statuses[i % len(statuses)], rejection_reason='Too short'
+            )
+        return user
+
+    def _get(self, user):
+        request = self.factory.get('/api/surveys/categories/')
+        force_authenticate(request, user)
+        return SurveyCategoryListView.as_view()(request)
+
+    def _cold_query_count(self, user):
+        cache.clear()
+        catalogue._local.__dict__.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self._get(user)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries)
+
+    def test_cold_cache_query_count_does_not_grow_with_categories(self):
+        small = self._make_user_with_categories(1, 'one')
+        baseline = self._cold_query_count(small)
+
+        large = self._make_user_with_categories(20, 'twenty')
+        cache.clear()
+        catalogue._local.__dict__.clear()
+        with self.assertNumQueries(baseline):
+            response = self._get(large)
+
+        # Approved and pending-review categories are hidden; the 'one' category is visible too
+        self.assertEqual(len(response.data['categories']), 10 + 1)
+
+    def test_warm_cache_reads_only_the_users_submissions(self):
+        counts = []
+        for count, prefix in ((1, 'warm1'), (20, 'warm20')):
+            user = self._make_user_with_categories(count, prefix)
+            self._get(user)  # warms the catalogue and subscription caches
+            with CaptureQueriesContext(connection) as queries:
+                self._get(user)
+            # Cache lookups hit the shared cache table; everything else is the submissions read
+            app_queries = [q['sql'] for q in queries.captured_queries if 'django_cache' not in q['sql']]
+            self.assertEqual(len(app_queries), 1)
+            self.assertIn('surveys_usersurveysubmission', app_queries[0])
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_statuses_come_from_the_users_submissions(self):
+        user = self._make_user_with_categories(4, 'status')
+        categories = {c['name']: c for c in self._get(user).data['categories']}
+
+        self.assertEqual(set(categories), {'status-0', 'status-1'})
+        self.assertEqual(categories['status-0']['status'], 'rejected')
+        self.assertEqual(categories['status-0']['rejection_reason'], 'Too short')
+        self.assertEqual(categories['status-1']['status'], 'active')
+        self.assertIsNone(categories['status-1']['rejection_reason'])
+        self.assertEqual(categories['status-0']['question_count'], 3)
+
+
+class CatalogueVersionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        catalogue._local.__dict__.clear()
+
+    def test_bump_changes_the_version(self):
+        before = catalogue.catalogue_version()
+        catalogue.bump_catalogue_version()
+        self.assertNotEqual(catalogue.catalogue_version(), before)
+
+    def test_evicted_version_is_never_reused(self):
+        SurveyCategory.objects.create(name='Old', tier_level=0, amount_kes=Decimal('5.00'), status='active')
+        cache.clear()
+        catalogue._local.__dict__.clear()
+        old_version = catalogue.catalogue_version()
+        self.assertEqual([c['name'] for c in catalogue.get_catalogue()], ['Old'])
+
+        # The version key is evicted, but the catalogue built under it is still cached
+        cache.delete(catalogue.VERSION_KEY)
+        catalogue._local.__dict__.clear()
+        SurveyCategory.objects.filter(name='Old').update(name='Renamed')
 
-# Create your tests here.
+        self.assertNotEqual(catalogue.catalogue_version(), old_version)
+        self.assertEqual([c['name'] for c in catalogue.get_catalogue()], ['Renamed'])
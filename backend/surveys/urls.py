@@ -9,4 +9,7 @@ urlpatterns = [
     path('submissions/', views.SurveySubmissionListView.as_view(), name='submission-list'),
     path('submit/', views.SurveySubmissionView.as_view(), name='submit-survey'),
     path('admin/review/', views.AdminSurveyReviewView.as_view(), name='admin-review'),
+    path('admin/review/bulk/', views.AdminSurveyBulkReviewView.as_view(), name='admin-bulk-review'),
+    path('admin/review/queue/', views.AdminReviewQueueView.as_view(), name='admin-review-queue'),
+    path('admin/review/queue/release/', views.AdminReviewQueueReleaseView.as_view(), name='admin-review-queue-release'),
 ]
\ No newline at end of file
@@ -5,62 +5,97 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from django.db import transaction
-from django.shortcuts import get_object_or_404
+from django.http import Http404
 from django.utils import timezone
-from .models import SurveyCategory, SurveyQuestion, UserSurveySubmission, SurveyAnswer
-from subscriptions.utils import can_access_tier
+from .catalogue import get_categories_for_tier, get_category
+from .models import UserSurveySubmission, SurveyAnswer
+from .services import (
+    QUEUE_ORDERINGS, MAX_CLAIM_BATCH, active_claims, bulk_review_submissions,
+    claim_review_batch, release_claims,
+)
+from subscriptions.utils import get_user_tier_level
 
 logger = logging.getLogger('surveys')
 
 
+def _get_category_or_404(category_id):
+    category = get_category(category_id)
+    if category is None:
+        raise Http404('No SurveyCategory matches the given query.')
+    return category
+
+
 def _validate_survey_answers(category, answers_dict):
     """
-    Validate user answers against category questions.
+    Validate user answers against the cached category questions (see catalogue.py).
     Returns a list of error strings. Empty list = valid.
     """
     errors = []
-    questions = list(category.questions.all())
-    question_map = {q.id: q for q in questions}
-    submitted_ids = []
+    questions = category['questions']
+    question_ids = {q['id'] for q in questions}
 
     # Parse & validate IDs
     for k in answers_dict.keys():
         try:
-            submitted_ids.append(int(k))
+            q_id = int(k)
         except ValueError:
             errors.append(f"Invalid question ID: {k}")
             continue
+        if q_id not in question_ids:
+            errors.append(f"Question ID {k} does not belong to this category.")
 
     # Check required fields & type validation
     for q in questions:
-        ans = answers_dict.get(str(q.id))
+        ans = answers_dict.get(str(q['id']))
 
         # Handle missing/empty required fields
-        if q.is_required and (ans is None or str(ans).strip() == ''):
-            errors.append(f"Required question '{q.text[:30]}...' is missing or empty.")
+        if q['required'] and (ans is None or str(ans).strip() == ''):
+            errors.append(f"Required question '{q['text'][:30]}...' is missing or empty.")
             continue
 
         if ans is None or str(ans).strip() == '':
             continue  # Skip validation for non-required empty answers
 
         # Type-specific validation
-        if q.question_type == 'multiple_choice':
-            if ans not in q.options:
-                errors.append(f"Question '{q.text[:30]}...': '{ans}' is not a valid option. Choose from {q.options}")
-        elif q.question_type == 'text':
+        if q['type'] == 'multiple_choice':
+            if ans not in q['options']:
+                errors.append(f"Question '{q['text'][:30]}...': '{ans}' is not a valid option. Choose from {q['options']}")
+        elif q['type'] == 'text':
             if not isinstance(ans, str) or len(ans.strip()) < 1:
-                errors.append(f"Question '{q.text[:30]}...': requires valid text input.")
-        elif q.question_type == 'rating_1_to_5':
+                errors.append(f"Question '{q['text'][:30]}...': requires valid text input.")
+        elif q['type'] == 'rating_1_to_5':
             try:
                 rating = int(ans)
                 if not (1 <= rating <= 5):
-                    errors.append(f"Question '{q.text[:30]}...': rating must be between 1 and 5.")
+                    errors.append(f"Question '{q['text'][:30]}...': rating must be between 1 and 5.")
             except (ValueError, TypeError):
-                errors.append(f"Question '{q.text[:30]}...': requires a numeric rating (1-5).")
+                errors.append(f"Question '{q['text'][:30]}...': requires a numeric rating (1-5).")
 
     return errors
 
 
+def _build_answers(submission, category, answers_dict):
+    """
+    Unsaved SurveyAnswer rows for a validated submission, one per non-empty answer.
+    Question types come from the same cached definitions the validator used.
+    """
+    rows = []
+    for q in category['questions']:
+        ans = answers_dict.get(str(q['id']))
+        if ans is None or str(ans).strip() == '':
+            continue
+
+        answer_obj = SurveyAnswer(submission=submission, question_id=q['id'])
+        if q['type'] == 'multiple_choice':
+            answer_obj.answer_option = str(ans)
+        elif q['type'] == 'rating_1_to_5':
+            answer_obj.answer_rating = int(ans)
+        else:
+            answer_obj.answer_text = str(ans)
+        rows.append(answer_obj)
+    return rows
+
+
 class SurveyCategoryListView(APIView):
     """
     GET /api/surveys/categories/
@@ -71,28 +106,33 @@ class SurveyCategoryListView(APIView):
 
     def get(self, request):
         user = request.user
-        active_categories = SurveyCategory.objects.filter(status='active')
+
+        # Categories and question counts come from the catalogue cache; the only
+        # per-request query is this user's submissions (at most one per category).
+        submissions = {
+            category_id: (submission_status, rejection_reason)
+            for category_id, submission_status, rejection_reason in UserSurveySubmission.objects
+            .filter(user=user)
+            .values_list('category_id', 'status', 'rejection_reason')
+        }
+
         accessible = []
+        for cat in get_categories_for_tier(get_user_tier_level(user)):
+            submission_status, rejection_reason = submissions.get(cat['id'], (None, None))
 
-        for cat in active_categories:
-            # Tier check
-            if not can_access_tier(user, cat.tier_level):
+            # Hide completed or pending-review categories
+            if submission_status in ('approved', 'pending_review'):
                 continue
 
-            # Check submission state
-            submission = UserSurveySubmission.objects.filter(user=user, category=cat).first()
-            if submission and submission.status in ('approved', 'pending_review'):
-                continue  # Hide completed or pending-review categories
-
             accessible.append({
-                'id': cat.id,
-                'name': cat.name,
-                'description': cat.description,
-                'tier_level': cat.tier_level,
-                'amount_kes': str(cat.amount_kes),
-                'question_count': cat.questions.count(),
-                'status': submission.status if submission else 'not_started',
-                'rejection_reason': submission.rejection_reason if submission and submission.status == 'rejected' else None,
+                'id': cat['id'],
+                'name': cat['name'],
+                'description': cat['description'],
+                'tier_level': cat['tier_level'],
+                'amount_kes': cat['amount_kes'],
+                'question_count': len(cat['questions']),
+                'status': submission_status or 'not_started',
+                'rejection_reason': rejection_reason if submission_status == 'rejected' else None,
             })
 
         return Response({'categories': accessible}, status=status.HTTP_200_OK)
@@ -108,13 +148,13 @@ class SurveyCategoryDetailView(APIView):
 
     def get(self, request, category_id):
         user = request.user
-        category = get_object_or_404(SurveyCategory, id=category_id, status='active')
+        category = _get_category_or_404(category_id)
 
-        if not can_access_tier(user, category.tier_level):
+        if category['tier_level'] > get_user_tier_level(user):
             return Response({'error': 'Subscription tier does not grant access to this category'}, status=status.HTTP_403_FORBIDDEN)
 
         submission, created = UserSurveySubmission.objects.get_or_create(
-            user=user, category=category, defaults={'status': 'active'}
+            user=user, category_id=category['id'], defaults={'status': 'active'}
         )
 
         if submission.status == 'approved':
@@ -123,26 +163,26 @@ class SurveyCategoryDetailView(APIView):
         if submission.status == 'pending_review':
             return Response({'error': 'This category is currently pending admin review.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Return questions
+        # Return questions (from the catalogue cache, already in display order)
         questions = []
-        for q in category.questions.all():
+        for q in category['questions']:
             q_data = {
-                'id': q.id,
-                'text': q.text,
-                'type': q.question_type,
-                'required': q.is_required,
-                'order': q.order,
+                'id': q['id'],
+                'text': q['text'],
+                'type': q['type'],
+                'required': q['required'],
+                'order': q['order'],
             }
-            if q.question_type == 'multiple_choice':
-                q_data['options'] = q.options
+            if q['type'] == 'multiple_choice':
+                q_data['options'] = q['options']
             questions.append(q_data)
 
         return Response({
             'category': {
-                'id': category.id,
-                'name': category.name,
-                'description': category.description,
-                'amount_kes': str(category.amount_kes),
+                'id': category['id'],
+                'name': category['name'],
+                'description': category['description'],
+                'amount_kes': category['amount_kes'],
                 'submission_id': submission.id,
                 'current_status': submission.status,
             },
@@ -194,13 +234,13 @@ class SurveySubmissionView(APIView):
         if not category_id:
             return Response({'error': 'category_id is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        category = get_object_or_404(SurveyCategory, id=category_id, status='active')
+        category = _get_category_or_404(category_id)
 
-        if not can_access_tier(user, category.tier_level):
+        if category['tier_level'] > get_user_tier_level(user):
             return Response({'error': 'Subscription tier does not grant access'}, status=status.HTTP_403_FORBIDDEN)
 
         try:
-            submission = UserSurveySubmission.objects.get(user=user, category=category)
+            submission = UserSurveySubmission.objects.get(user=user, category_id=category['id'])
         except UserSurveySubmission.DoesNotExist:
             return Response({'error': 'No active submission found for this category. Refresh and try again.'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -213,32 +253,14 @@ class SurveySubmissionView(APIView):
             return Response({'error': 'Validation failed', 'details': validation_errors}, status=status.HTTP_400_BAD_REQUEST)
 
         with transaction.atomic():
-            # Clear previous answers (for resubmissions after rejection)
+            # Replace previous answers (resubmissions after rejection): one DELETE, one INSERT
             submission.answers.all().delete()
-
-            # Create new answers
-            for q_id, ans in answers.items():
-                if ans is None or str(ans).strip() == '':
-                    continue
-                question = get_object_or_404(SurveyQuestion, id=q_id, category=category)
-                
-                answer_obj = SurveyAnswer(
-                    submission=submission,
-                    question=question,
-                )
-                
-                if question.question_type == 'multiple_choice':
-                    answer_obj.answer_option = str(ans)
-                elif question.question_type == 'rating_1_to_5':
-                    answer_obj.answer_rating = int(ans)
-                else:
-                    answer_obj.answer_text = str(ans)
-                answer_obj.save()
+            SurveyAnswer.objects.bulk_create(_build_answers(submission, category, answers))
 
             # Transition status
             submission.mark_pending_review()
 
-        logger.info(f"User {user.email} submitted survey category {category.name} (ID: {category.id})")
+        logger.info(f"User {user.email} submitted survey category {category['name']} (ID: {category['id']})")
         return Response({
             'message': 'Survey submitted successfully. Awaiting admin review.',
             'submission_id': submission.id,
@@ -272,6 +294,10 @@ class AdminSurveyReviewView(APIView):
         if submission.status != 'pending_review':
             return Response({'error': f'Submission status is {submission.get_status_display()}, not pending_review'}, status=status.HTTP_400_BAD_REQUEST)
 
+        if (submission.claimed_by_id and submission.claimed_by_id != request.user.id
+                and submission.claim_expires_at and submission.claim_expires_at > timezone.now()):
+            return Response({'error': 'Submission is claimed by another reviewer'}, status=status.HTTP_409_CONFLICT)
+
         if action == 'reject' and not reason:
             return Response({'error': 'A rejection reason is required'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -292,4 +318,121 @@ class AdminSurveyReviewView(APIView):
                     'message': 'Submission rejected. User can resubmit after reviewing feedback.',
                     'status': submission.status,
                     'rejection_reason': submission.rejection_reason
-                }, status=status.HTTP_200_OK)
\ No newline at end of file
+                }, status=status.HTTP_200_OK)
+
+class AdminSurveyBulkReviewView(APIView):
+    """
+    POST /api/surveys/admin/review/bulk/
+    Staff-only endpoint to approve or reject many pending submissions in one call.
+    Body: {"submission_ids": [...], "action": "approve"|"reject", "reason": "..."}
+    """
+    permission_classes = [IsAuthenticated]
+    MAX_IDS = 10000
+
+    def post(self, request):
+        if not request.user.is_staff:
+            raise PermissionDenied('Staff access required.')
+
+        submission_ids = request.data.get('submission_ids')
+        action = request.data.get('action')
+        reason = (request.data.get('reason') or '').strip()
+
+        if not isinstance(submission_ids, list) or not submission_ids or action not in ('approve', 'reject'):
+            return Response({'error': 'submission_ids (non-empty list) and action (approve/reject) are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(submission_ids) > self.MAX_IDS:
+            return Response({'error': f'At most {self.MAX_IDS} submissions per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            submission_ids = [int(i) for i in submission_ids]
+        except (TypeError, ValueError):
+            return Response({'error': 'submission_ids must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if action == 'reject' and not reason:
+            return Response({'error': 'A rejection reason is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        outcomes = bulk_review_submissions(submission_ids, action, request.user, reason=reason)
+
+        summary = {}
+        for outcome in outcomes.values():
+            summary[outcome] = summary.get(outcome, 0) + 1
+
+        return Response({
+            'summary': summary,
+            'results': [{'submission_id': i, 'outcome': o} for i, o in outcomes.items()],
+        }, status=status.HTTP_200_OK)
+
+
+def _queue_item(submission):
+    return {
+        'submission_id': submission.id,
+        'user_email': submission.user.email,
+        'category_id': submission.category_id,
+        'category_name': submission.category.name,
+        'amount_kes': str(submission.category.amount_kes),
+        'submitted_at': submission.submitted_at.isoformat() if submission.submitted_at else None,
+        'claim_expires_at': submission.claim_expires_at.isoformat() if submission.claim_expires_at else None,
+    }
+
+
+class AdminReviewQueueView(APIView):
+    """
+    GET  /api/surveys/admin/review/queue/
+        Queue depth plus the submissions the current reviewer still holds.
+    POST /api/surveys/admin/review/queue/
+        Claim the next batch. Body: {"size": 20, "order": "oldest"|"value"}
+        Claimed items are leased to this reviewer and hidden from everyone else until
+        they are reviewed, released, or the lease expires.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if not request.user.is_staff:
+            raise PermissionDenied('Staff access required.')
+
+        now = timezone.now()
+        pending = UserSurveySubmission.objects.filter(status='pending_review')
+        return Response({
+            'pending': pending.count(),
+            'claimed': pending.filter(claim_expires_at__gt=now).count(),
+            'my_claims': [_queue_item(s) for s in active_claims(request.user)],
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        if not request.user.is_staff:
+            raise PermissionDenied('Staff access required.')
+
+        order = request.data.get('order', 'oldest')
+        if order not in QUEUE_ORDERINGS:
+            return Response({'error': f"order must be one of: {', '.join(QUEUE_ORDERINGS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            size = int(request.data.get('size', 20))
+        except (TypeError, ValueError):
+            return Response({'error': 'size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= size <= MAX_CLAIM_BATCH:
+            return Response({'error': f'size must be between 1 and {MAX_CLAIM_BATCH}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        claimed = claim_review_batch(request.user, size=size, order=order)
+        return Response({
+            'claimed': [_queue_item(s) for s in claimed],
+        }, status=status.HTTP_200_OK)
+
+
+class AdminReviewQueueReleaseView(APIView):
+    """
+    POST /api/surveys/admin/review/queue/release/
+    Return claimed submissions to the queue. Body: {"submission_ids": [...]} (omit to release all).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if not request.user.is_staff:
+            raise PermissionDenied('Staff access required.')
+
+        submission_ids = request.data.get('submission_ids')
+        if submission_ids is not None and not isinstance(submission_ids, list):
+            return Response({'error': 'submission_ids must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+
+        released = release_claims(request.user, submission_ids)
+        return Response({'released': released}, status=status.HTTP_200_OK)
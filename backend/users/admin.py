@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import User
+from django.utils import timezone
+from .models import User, OutboundEmail
 
 @admin.register(User)
 class CustomUserAdmin(admin.ModelAdmin):
@@ -53,4 +54,26 @@ class CustomUserAdmin(admin.ModelAdmin):
         for user in queryset:
             user.close_account()
         self.message_user(request, f"{queryset.count()} account(s) closed (soft delete).")
-    close_accounts.short_description = "🗑️ Close selected accounts"
\ No newline at end of file
+    close_accounts.short_description = "🗑️ Close selected accounts"
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'to_email', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'kind']
+    search_fields = ['to_email', '=kind']
+    readonly_fields = [f.name for f in OutboundEmail._meta.fields]
+    actions = ['retry_now']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def retry_now(self, request, queryset):
+        updated = queryset.filter(status__in=['queued', 'failed']).update(
+            status='queued', attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{updated} email(s) queued for immediate delivery.")
+    retry_now.short_description = "🔁 Retry selected emails now"
@@ -7,6 +7,8 @@ from django.contrib.auth import get_user_model
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 import requests
+from .firebase_keys import key_store
+from .token_cache import TTLCache, token_digest
 
 User = get_user_model()
 
@@ -24,6 +26,13 @@ def generate_unique_referral_code(max_attempts=10):
     return fallback
 
 
+# Verified tokens live until their own `exp`; name claims are remembered per uid so the
+# name-sync write only happens when Google reports a different display name.
+verified_tokens = TTLCache(maxsize=getattr(settings, 'FIREBASE_TOKEN_CACHE_SIZE', 10000))
+synced_names = TTLCache(maxsize=getattr(settings, 'FIREBASE_TOKEN_CACHE_SIZE', 10000))
+SYNCED_NAMES_TTL = 24 * 3600
+
+
 class FirebaseAuthentication(BaseAuthentication):
     def authenticate(self, request):
         auth_header = request.META.get('HTTP_AUTHORIZATION')
@@ -31,21 +40,24 @@ class FirebaseAuthentication(BaseAuthentication):
             return None
 
         token = auth_header.split(' ')[1]
-        try:
-            resp = requests.get(
-                'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com',
-                timeout=10
-            )
-            resp.raise_for_status()
-            keys = resp.json()
 
+        # Fast path: token already verified by this process
+        digest = token_digest(token)
+        cached = verified_tokens.get(digest)
+        if cached is not None:
+            _claims, user_id = cached
+            try:
+                return (User.objects.get(pk=user_id), None)
+            except User.DoesNotExist:
+                verified_tokens.pop(digest)
+
+        try:
             header = jwt.get_unverified_header(token)
             kid = header.get('kid')
-            if not kid or kid not in keys:
+            public_key = key_store.get_key(kid) if kid else None
+            if not public_key:
                 raise AuthenticationFailed('Invalid token key ID')
 
-            public_key = keys[kid]
-
             decoded_token = jwt.decode(
                 token,
                 public_key,
@@ -83,16 +95,19 @@ class FirebaseAuthentication(BaseAuthentication):
             if not created:
                 if user.firebase_uid != uid:
                     raise AuthenticationFailed('Firebase UID mismatch')
-                updated = False
-                if first_name and user.first_name != first_name:
-                    user.first_name = first_name
-                    updated = True
-                if last_name and user.last_name != last_name:
-                    user.last_name = last_name
-                    updated = True
-                if updated:
-                    user.save(update_fields=['first_name', 'last_name'])
-
+                if synced_names.get(uid) != (first_name, last_name):
+                    updated = False
+                    if first_name and user.first_name != first_name:
+                        user.first_name = first_name
+                        updated = True
+                    if last_name and user.last_name != last_name:
+                        user.last_name = last_name
+                        updated = True
+                    if updated:
+                        user.save(update_fields=['first_name', 'last_name'])
+            synced_names.set(uid, (first_name, last_name), time.time() + SYNCED_NAMES_TTL)
+
+            verified_tokens.set(digest, (decoded_token, user.pk), decoded_token['exp'])
             return (user, None)
 
         except (JWTError, KeyError, ValueError) as e:
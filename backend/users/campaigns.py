@@ -0,0 +1,118 @@
+# users/campaigns.py
+"""
+Bulk campaign sender (announcements, promotions, task digests).
+
+The audience is selected in SQL: active, open accounts that have opted in to the
+campaign's email type. It is read in id-ordered chunks (keyset, never OFFSET); for each
+chunk, missing preference tokens are generated and saved with one bulk UPDATE, bodies are
+rendered with `render_email_batch`, and the emails are bulk-inserted into the outbox.
+Nothing is sent here: `process_email_outbox` delivers them.
+
+Run with: python manage.py send_campaign --name ... --subject ... --headline ... --body ...
+"""
+import logging
+import secrets
+
+from django.db import transaction
+
+from .emails import preferences_url_for_token, render_email_batch
+from .models import OutboundEmail, User
+from .outbox import enqueue_emails
+
+logger = logging.getLogger(__name__)
+
+# Audience -> opt-in flag
+AUDIENCE_FLAGS = {
+    'promotional': 'receive_promotional_emails',
+    'task': 'receive_task_notifications',
+}
+
+# Audience -> ?auto_unsubscribe= key understood by the frontend EmailPreferencesPage
+UNSUBSCRIBE_KEYS = {
+    'promotional': 'promotional',
+    'task': 'task_notifications',
+}
+
+DEFAULT_TEMPLATE = 'emails/campaign.html'
+
+
+def campaign_recipients(audience):
+    """Users who may receive an `audience` campaign, filtered entirely in the database."""
+    if audience not in AUDIENCE_FLAGS:
+        raise ValueError(f"Unknown campaign audience '{audience}'. Use one of: {', '.join(AUDIENCE_FLAGS)}")
+    return (
+        User.objects
+        .filter(is_active=True, is_closed=False, **{AUDIENCE_FLAGS[audience]: True})
+        .exclude(email='')
+    )
+
+
+def assign_missing_tokens(users):
+    """
+    Give every user in `users` (a list) a preference token, saving the new ones with a
+    single bulk UPDATE instead of generate_email_token()'s save() per user.
+    """
+    missing = [u for u in users if not u.email_preferences_token]
+    for user in missing:
+        user.email_preferences_token = secrets.token_urlsafe(32)
+    if missing:
+        User.objects.bulk_update(missing, ['email_preferences_token'], batch_size=500)
+    return len(missing)
+
+
+def _chunks(queryset, after_id, chunk_size):
+    queryset = queryset.only('id', 'email', 'first_name', 'email_preferences_token').order_by('id')
+    while True:
+        chunk = list(queryset.filter(id__gt=after_id)[:chunk_size])
+        if not chunk:
+            return
+        after_id = chunk[-1].id
+        yield chunk
+
+
+def send_campaign(name, subject, audience, context=None, template_name=DEFAULT_TEMPLATE,
+                  chunk_size=1000, after_id=0, dry_run=False, log=None):
+    """
+    Queue one campaign email per eligible user. Returns a summary dict.
+
+    `context` is shared by every recipient; each recipient also gets first_name, email,
+    preferences_url and unsubscribe_url. Chunks commit independently; pass the last
+    reported id as `after_id` to continue an interrupted send.
+    """
+    log = log or (lambda message: None)
+    recipients = campaign_recipients(audience)
+    summary = {'queued': 0, 'tokens_created': 0, 'last_id': after_id}
+
+    if dry_run:
+        summary['queued'] = recipients.filter(id__gt=after_id).count()
+        return summary
+
+    kind = f'campaign:{name}'[:50]
+    unsubscribe_key = UNSUBSCRIBE_KEYS[audience]
+
+    for chunk in _chunks(recipients, after_id, chunk_size):
+        with transaction.atomic():
+            summary['tokens_created'] += assign_missing_tokens(chunk)
+
+            contexts = []
+            for user in chunk:
+                preferences_url = preferences_url_for_token(user.email_preferences_token)
+                contexts.append({
+                    'first_name': user.first_name.title() or 'there',
+                    'email': user.email,
+                    'preferences_url': preferences_url,
+                    'unsubscribe_url': f"{preferences_url}?auto_unsubscribe={unsubscribe_key}",
+                })
+
+            rendered = render_email_batch(template_name, contexts, shared=context)
+            enqueue_emails([
+                OutboundEmail(kind=kind, to_email=user.email, subject=subject, text_body=text, html_body=html)
+                for user, (html, text) in zip(chunk, rendered)
+            ])
+
+        summary['queued'] += len(chunk)
+        summary['last_id'] = chunk[-1].id
+        log(f'  ✅ Queued {summary["queued"]} so far (through user id {chunk[-1].id})')
+
+    logger.info(f"Campaign '{name}' ({audience}) queued: {summary}")
+    return summary
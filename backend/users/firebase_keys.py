@@ -0,0 +1,143 @@
+# users/firebase_keys.py
+import logging
+import re
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+
+# Used when Google omits Cache-Control (it normally sends max-age of a few hours)
+DEFAULT_MAX_AGE = 3600
+# Start a background refresh this many seconds before the keys expire
+REFRESH_MARGIN = 300
+# After a failed refresh, wait this long before trying again
+RETRY_AFTER = 30
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+def fetch_google_certs(url=GOOGLE_CERTS_URL, timeout=10):
+    """
+    Default fetcher: download the x509 bundle and read max-age from Cache-Control.
+    Returns (keys_dict, max_age_seconds).
+    """
+    resp = requests.get(url, timeout=timeout)
+    resp.raise_for_status()
+    match = _MAX_AGE_RE.search(resp.headers.get('Cache-Control', ''))
+    max_age = int(match.group(1)) if match else DEFAULT_MAX_AGE
+    return resp.json(), max_age
+
+
+class SigningKeyStore:
+    """
+    Process-wide cache of Google's Firebase signing certificates.
+
+    - Honours the max-age returned with the bundle.
+    - Refreshes in a background thread shortly before expiry, so requests never wait.
+    - Keeps serving the last good keys if a refresh fails.
+    - `fetcher` is any callable returning (keys_dict, max_age_seconds); swap it for tests.
+    """
+
+    def __init__(self, fetcher=None, refresh_margin=REFRESH_MARGIN, retry_after=RETRY_AFTER):
+        self.fetcher = fetcher or fetch_google_certs
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+
+        self._keys = {}
+        self._expires_at = 0.0
+        self._next_attempt_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+        self.hits = 0
+        self.misses = 0
+
+    def set_fetcher(self, fetcher):
+        """Replace the fetcher and drop cached keys (used by tests)."""
+        with self._lock:
+            self.fetcher = fetcher or fetch_google_certs
+            self._keys = {}
+            self._expires_at = 0.0
+            self._next_attempt_at = 0.0
+            self.hits = 0
+            self.misses = 0
+
+    def get_keys(self):
+        """Return the current {kid: certificate} mapping, fetching synchronously only on a cold start."""
+        now = time.monotonic()
+        with self._lock:
+            keys = self._keys
+            expires_at = self._expires_at
+
+        if keys:
+            self.hits += 1
+            if now >= expires_at - self.refresh_margin:
+                self._refresh_in_background()
+            return keys
+
+        self.misses += 1
+        return self._refresh()
+
+    def get_key(self, kid):
+        """
+        Return the certificate for `kid`, or None if unknown.
+        An unknown kid usually means Google rotated keys early, so one forced
+        refresh is attempted (throttled by retry_after).
+        """
+        keys = self.get_keys()
+        if kid in keys:
+            return keys[kid]
+
+        if time.monotonic() < self._next_attempt_at:
+            return None
+        try:
+            keys = self._refresh()
+        except Exception as e:
+            logger.warning(f"Signing key refresh for unknown kid failed: {e}")
+            return None
+        return keys.get(kid)
+
+    def _refresh(self):
+        """Fetch keys now. On failure, fall back to the last good keys if we have any."""
+        try:
+            keys, max_age = self.fetcher()
+        except Exception:
+            with self._lock:
+                self._next_attempt_at = time.monotonic() + self.retry_after
+                if self._keys:
+                    # Push expiry out a little so we don't hammer Google while it is failing
+                    self._expires_at = self._next_attempt_at + self.refresh_margin
+                    logger.warning("Signing key refresh failed; serving last good keys", exc_info=True)
+                    return self._keys
+            raise
+
+        with self._lock:
+            self._keys = keys
+            self._expires_at = time.monotonic() + max(int(max_age), 0)
+            self._next_attempt_at = time.monotonic() + self.retry_after
+        return keys
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or time.monotonic() < self._next_attempt_at:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._refresh()
+            except Exception:
+                pass  # _refresh already logged and kept the old keys
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name='firebase-key-refresh', daemon=True).start()
+
+
+# Shared by FirebaseAuthentication, onboarding and the websocket middleware
+key_store = SigningKeyStore()
@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from users.emails import clear_template_cache, render_email, render_email_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures email rendering throughput: the old render_to_string + strip_tags path '
+        'against the compiled single and batched renderers in users/emails.py. No DB access.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=2000, help='Emails rendered per strategy (default: 2000).')
+        parser.add_argument(
+            '--template',
+            default='emails/subscription_expiry_reminder.html',
+            help='Template to render (default: emails/subscription_expiry_reminder.html).'
+        )
+
+    def handle(self, *args, **options):
+        count = options['recipients']
+        template_name = options['template']
+        shared = {
+            'plan_name': 'Premium',
+            'end_date': '21 Oct 2026',
+            'days_remaining': 3,
+            'grace_end_date': '23 Oct 2026',
+        }
+        contexts = [
+            {
+                'first_name': f'User{i}',
+                'email': f'user{i}@example.com',
+                'preferences_url': f'https://qezzykenya.company/email-preferences/token{i}/',
+                'unsubscribe_url': f'https://qezzykenya.company/email-preferences/token{i}/?auto_unsubscribe=renewal',
+            }
+            for i in range(count)
+        ]
+
+        clear_template_cache()
+        render_email(template_name, {**shared, **contexts[0]})  # Warm both caches before timing
+        render_to_string(template_name, {**shared, **contexts[0]})
+
+        self.stdout.write(f'🧪 Rendering {count} × {template_name}\n')
+        results = []
+
+        def legacy():
+            for ctx in contexts:
+                html_content = render_to_string(template_name, {**shared, **ctx})
+                strip_tags(html_content)
+
+        def single():
+            for ctx in contexts:
+                render_email(template_name, {**shared, **ctx})
+
+        def batch():
+            for _ in render_email_batch(template_name, contexts, shared=shared):
+                pass
+
+        for name, fn in (('render_to_string + strip_tags', legacy), ('render_email', single), ('render_email_batch', batch)):
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            results.append((name, elapsed))
+            self.stdout.write(f'  ▶ {name:<30} {elapsed * 1000 / count:7.3f} ms/email  {count / elapsed:9.0f} emails/s')
+
+        baseline = results[0][1]
+        self.stdout.write()
+        self.stdout.write('📊 SUMMARY:')
+        for name, elapsed in results[1:]:
+            self.stdout.write(f'  ⚡ {name}: {baseline / elapsed:.1f}x the legacy throughput')
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.outbox import claim_batch, deliver_batch
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued emails from the outbox, one SMTP connection per batch. Runs forever unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the due emails and exit instead of polling.')
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails claimed and sent per SMTP connection (default: 100).')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when nothing is due (default: 2).')
+
+    def handle(self, *args, **options):
+        once = options['once']
+        batch_size = max(options['batch_size'], 1)
+        poll_interval = options['poll_interval']
+
+        self.stdout.write('📨 Email outbox worker started...')
+        sent = retried = failed = 0
+
+        try:
+            while True:
+                close_old_connections()
+                batch = claim_batch(batch_size)
+                if not batch:
+                    if once:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                s, r, f = deliver_batch(batch)
+                sent, retried, failed = sent + s, retried + r, failed + f
+                self.stdout.write(f'  ✅ Batch of {len(batch)}: {s} sent, {r} to retry, {f} failed')
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('⚠️  Interrupted.'))
+
+        self.stdout.write()
+        self.stdout.write('📊 SUMMARY:')
+        self.stdout.write(f'  📨 Sent: {sent}')
+        self.stdout.write(f'  🔁 Scheduled for retry: {retried}')
+        self.stdout.write(f'  ❌ Failed permanently: {failed}')
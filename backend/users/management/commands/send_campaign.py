@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.campaigns import AUDIENCE_FLAGS, DEFAULT_TEMPLATE, send_campaign
+
+
+class Command(BaseCommand):
+    help = (
+        'Queues a campaign email to every active, open account opted in to the audience. '
+        'Recipients are filtered and streamed in chunks; delivery is done by process_email_outbox.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', required=True, help='Short campaign name, stored as the outbox kind (campaign:<name>).')
+        parser.add_argument('--subject', required=True, help='Email subject line.')
+        parser.add_argument('--audience', default='promotional', choices=sorted(AUDIENCE_FLAGS), help='Opt-in flag to honour (default: promotional).')
+        parser.add_argument('--headline', default='', help='Heading shown in the email.')
+        parser.add_argument('--body', default='', help='Email body; blank lines separate paragraphs.')
+        parser.add_argument('--cta-url', default='', help='Optional call-to-action link.')
+        parser.add_argument('--cta-label', default='', help='Optional call-to-action button text.')
+        parser.add_argument('--template', default=DEFAULT_TEMPLATE, help=f'Template to render (default: {DEFAULT_TEMPLATE}).')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Recipients rendered and queued per transaction (default: 1000).')
+        parser.add_argument('--after-id', type=int, default=0, help='Continue an interrupted send after this user id.')
+        parser.add_argument('--dry-run', action='store_true', help='Count recipients without queuing anything.')
+
+    def handle(self, *args, **options):
+        if options['template'] == DEFAULT_TEMPLATE and not options['body']:
+            raise CommandError('--body is required with the default campaign template.')
+
+        context = {
+            'headline': options['headline'] or options['subject'],
+            'body': options['body'],
+            'cta_url': options['cta_url'],
+            'cta_label': options['cta_label'],
+        }
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('⚠️  DRY RUN MODE: No emails will be queued.'))
+
+        self.stdout.write(f"📣 Queuing campaign '{options['name']}' for audience '{options['audience']}'...")
+        summary = send_campaign(
+            name=options['name'],
+            subject=options['subject'],
+            audience=options['audience'],
+            context=context,
+            template_name=options['template'],
+            chunk_size=max(options['chunk_size'], 1),
+            after_id=options['after_id'],
+            dry_run=options['dry_run'],
+            log=self.stdout.write if options.get('verbosity', 1) > 1 else None,
+        )
+
+        self.stdout.write()
+        self.stdout.write('📊 SUMMARY:')
+        self.stdout.write(f"  {'👥 Eligible' if options['dry_run'] else '📨 Queued'}: {summary['queued']}")
+        self.stdout.write(f"  🔑 Preference tokens created: {summary['tokens_created']}")
+        self.stdout.write(f"  ↪️  Last user id: {summary['last_id']}")
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('✅ Campaign queued. Delivery runs through process_email_outbox.'))
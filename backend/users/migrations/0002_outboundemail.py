@@ -0,0 +1,43 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:06
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0006_remove_subscriptionemaillog_no_duplicate_email_within_hour_and_more'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(help_text='What the email is, e.g. welcome, subscription:expired_notice', max_length=50)),
+                ('to_email', models.EmailField(max_length=254)),
+                ('from_email', models.CharField(max_length=255)),
+                ('subject', models.CharField(max_length=255)),
+                ('text_body', models.TextField()),
+                ('html_body', models.TextField(blank=True)),
+                ('attachment', models.FileField(blank=True, upload_to='outbox/%Y/%m/')),
+                ('attachment_name', models.CharField(blank=True, max_length=255)),
+                ('attachment_mimetype', models.CharField(blank=True, max_length=100)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('subscription_log', models.ForeignKey(blank=True, help_text='Delivery result is copied here when the email is sent or gives up', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='outbox_emails', to='subscriptions.subscriptionemaillog')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='outbox_queue_idx')],
+            },
+        ),
+    ]
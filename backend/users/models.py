@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from .managers import UserManager
 import secrets  # 🆕 Added for secure token generation
@@ -70,4 +71,53 @@ class User(AbstractBaseUser, PermissionsMixin):
         token = self.generate_email_token()
         # Uses FRONTEND_URL from settings, falls back to your production domain
         domain = getattr(settings, 'FRONTEND_URL', 'https://qezzykenya.company')
-        return f"{domain}/email-preferences/{token}/"
\ No newline at end of file
+        return f"{domain}/email-preferences/{token}/"
+
+class OutboundEmail(models.Model):
+    """
+    Transactional outbox: every email is written here (in the caller's DB transaction)
+    and delivered later by `python manage.py process_email_outbox`, which reuses one
+    SMTP connection per batch and retries failures with backoff.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50, help_text="What the email is, e.g. welcome, subscription:expired_notice")
+    to_email = models.EmailField()
+    from_email = models.CharField(max_length=255)
+    subject = models.CharField(max_length=255)
+    text_body = models.TextField()
+    html_body = models.TextField(blank=True)
+    attachment = models.FileField(upload_to='outbox/%Y/%m/', blank=True)
+    attachment_name = models.CharField(max_length=255, blank=True)
+    attachment_mimetype = models.CharField(max_length=100, blank=True)
+    subscription_log = models.ForeignKey(
+        'subscriptions.SubscriptionEmailLog',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='outbox_emails',
+        help_text="Delivery result is copied here when the email is sent or gives up"
+    )
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Worker claim: WHERE status = 'queued' AND next_attempt_at <= now ORDER BY next_attempt_at
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} to {self.to_email} ({self.status})"
@@ -0,0 +1,199 @@
+# users/outbox.py
+"""
+Email outbox.
+
+Call sites render their email and `enqueue_email(...)` it; nothing talks to SMTP inside
+a request or signal handler. `python manage.py process_email_outbox` claims batches,
+sends each batch over one SMTP connection and retries failures with exponential backoff.
+
+Settings (all optional):
+    EMAIL_OUTBOX_MAX_ATTEMPTS   sends tried before an email is marked failed (default 5)
+    EMAIL_OUTBOX_RETRY_BASE     seconds before the first retry; doubles each time (default 60)
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+# A batch still 'sending' after this long is assumed to belong to a dead worker
+STALE_AFTER = timedelta(minutes=10)
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+
+def _max_attempts():
+    return int(getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+
+
+def _retry_delay(attempts):
+    base = int(getattr(settings, 'EMAIL_OUTBOX_RETRY_BASE', 60))
+    return min(timedelta(seconds=base * 2 ** max(attempts - 1, 0)), MAX_RETRY_DELAY)
+
+
+def enqueue_email(to_email, subject, text_body, html_body='', kind='', attachment=None, subscription_log=None):
+    """
+    Queue one email for delivery and return the OutboundEmail.
+    `attachment` is an optional (filename, bytes, mimetype) tuple.
+    Runs inside the caller's transaction, so a rolled-back action never sends its email.
+    """
+    email = OutboundEmail(
+        kind=kind,
+        to_email=to_email,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        subject=subject,
+        text_body=text_body,
+        html_body=html_body or '',
+        subscription_log=subscription_log,
+    )
+    if attachment:
+        filename, content, mimetype = attachment
+        email.attachment_name = filename
+        email.attachment_mimetype = mimetype
+        email.attachment.save(filename, ContentFile(content), save=False)
+    email.save()
+    return email
+
+
+def enqueue_emails(emails, batch_size=1000):
+    """
+    Queue many unsaved OutboundEmail rows (no attachments) with bulk INSERTs.
+    Used by campaigns, where one row per save() would dominate the send.
+    """
+    now = timezone.now()
+    for email in emails:
+        email.from_email = email.from_email or settings.DEFAULT_FROM_EMAIL
+        email.next_attempt_at = now
+    return OutboundEmail.objects.bulk_create(emails, batch_size=batch_size)
+
+
+def claim_batch(size=100):
+    """Lock and mark up to `size` due emails as sending. Safe with several workers."""
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status='queued', next_attempt_at__lte=now)
+                | Q(status='sending', locked_at__lt=now - STALE_AFTER)
+            )
+            .order_by('next_attempt_at', 'id')[:size]
+        )
+        if batch:
+            OutboundEmail.objects.filter(id__in=[e.id for e in batch]).update(status='sending', locked_at=now)
+            for email in batch:
+                email.status = 'sending'
+                email.locked_at = now
+    return batch
+
+
+def _build_message(email, connection):
+    msg = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.text_body,
+        from_email=email.from_email,
+        to=[email.to_email],
+        connection=connection
+    )
+    if email.html_body:
+        msg.attach_alternative(email.html_body, "text/html")
+    if email.attachment:
+        with email.attachment.open('rb') as f:
+            msg.attach(email.attachment_name, f.read(), email.attachment_mimetype or None)
+    return msg
+
+
+def _record_failure(email, error, max_attempts):
+    """Count a failed attempt: back to the queue with backoff, or 'failed' once attempts run out."""
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= max_attempts:
+        email.status = 'failed'
+        logger.error(f"❌ Email {email.id} ({email.kind}) to {email.to_email} failed after {email.attempts} attempts: {error}")
+    else:
+        email.status = 'queued'
+        email.next_attempt_at = timezone.now() + _retry_delay(email.attempts)
+        logger.warning(f"⚠️ Email {email.id} ({email.kind}) to {email.to_email} will be retried: {error}")
+
+
+def _open(connection):
+    """Open the SMTP connection; returns the error instead of raising it."""
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error(f"Could not open SMTP connection: {e}")
+        return e
+    return None
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception as e:
+        logger.warning(f"Error closing SMTP connection: {e}")
+
+
+def deliver_batch(batch):
+    """
+    Send a claimed batch over a single SMTP connection. Returns (sent, retried, failed).
+    A broken connection is reopened once per failing message; the message itself is retried later.
+    If the connection cannot be opened, the remaining emails count the attempt and back off,
+    so a worker never dies or spins against a mail server that is down.
+    """
+    from subscriptions.models import SubscriptionEmailLog
+
+    if not batch:
+        return 0, 0, 0
+
+    max_attempts = _max_attempts()
+    connection = get_connection(fail_silently=False)
+    logs = []
+
+    try:
+        connection_error = _open(connection)
+        for email in batch:
+            if connection_error:
+                _record_failure(email, connection_error, max_attempts)
+            else:
+                try:
+                    _build_message(email, connection).send()
+                except Exception as e:
+                    _record_failure(email, e, max_attempts)
+                    # The server may have dropped us; start the next message on a fresh connection
+                    _close(connection)
+                    connection_error = _open(connection)
+                else:
+                    email.attempts += 1
+                    email.status = 'sent'
+                    email.sent_at = timezone.now()
+                    email.last_error = ''
+
+            if email.subscription_log_id and email.status in ('sent', 'failed'):
+                logs.append(SubscriptionEmailLog(
+                    id=email.subscription_log_id,
+                    delivered=email.status == 'sent',
+                    error_message=email.last_error
+                ))
+    finally:
+        _close(connection)
+        # Interrupted part-way (e.g. the worker is stopped): untried emails go straight back
+        for email in batch:
+            if email.status == 'sending':
+                email.status = 'queued'
+        OutboundEmail.objects.bulk_update(
+            batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'], batch_size=500
+        )
+        if logs:
+            SubscriptionEmailLog.objects.bulk_update(logs, ['delivered', 'error_message'], batch_size=500)
+
+    sent = sum(1 for email in batch if email.status == 'sent')
+    failed = sum(1 for email in batch if email.status == 'failed')
+    return sent, len(batch) - sent - failed, failed
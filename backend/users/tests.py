@@ -1,3 +1,235 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from decimal import Decimal
+from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from subscriptions.models import SubscriptionEmailLog, SubscriptionPlan, UserSubscription
+
+from . import outbox
+from .campaigns import send_campaign
+from .firebase_keys import SigningKeyStore
+from .models import OutboundEmail, User
+
+
+class BouncingBackend(LocmemBackend):
+    """locmem, except that messages to bounce@... are refused."""
+
+    def send_messages(self, messages):
+        for message in messages:
+            if any(address.startswith('bounce@') for address in message.to):
+                raise SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+class UnreachableBackend(LocmemBackend):
+    """A mail server that is down: the connection never opens."""
+
+    def open(self):
+        raise SMTPServerDisconnected('Connection refused')
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    EMAIL_OUTBOX_MAX_ATTEMPTS=3,
+    EMAIL_OUTBOX_RETRY_BASE=60,
+)
+class EmailOutboxTests(TestCase):
+
+    def _enqueue(self, to_email, **kwargs):
+        return outbox.enqueue_email(to_email=to_email, subject='Hello', text_body='Body', kind='test', **kwargs)
+
+    def _subscription_log(self):
+        user = User.objects.create_user(email='subscriber@example.com', referral_code='SUBLOG01')
+        plan = SubscriptionPlan.objects.create(name='basic', price_kes=Decimal('100.00'), tier_level=1)
+        now = timezone.now()
+        subscription = UserSubscription.objects.create(
+            user=user, plan=plan, status='active', start_date=now, end_date=now + timedelta(days=30)
+        )
+        return SubscriptionEmailLog.objects.create(
+            subscription=subscription, email_type='expired_notice', recipient_email=user.email
+        )
+
+    def test_claim_marks_due_rows_sending_and_skips_future_ones(self):
+        due = self._enqueue('a@example.com')
+        later = self._enqueue('b@example.com')
+        OutboundEmail.objects.filter(id=later.id).update(next_attempt_at=timezone.now() + timedelta(minutes=5))
+
+        batch = outbox.claim_batch(10)
+
+        self.assertEqual([e.id for e in batch], [due.id])
+        self.assertEqual(batch[0].status, 'sending')
+        self.assertEqual(OutboundEmail.objects.get(id=due.id).status, 'sending')
+        self.assertEqual(outbox.claim_batch(10), [])
+
+    def test_batch_is_sent_over_one_connection(self):
+        for i in range(3):
+            self._enqueue(f'user{i}@example.com')
+
+        with mock.patch.object(outbox, 'get_connection', wraps=outbox.get_connection) as get_connection:
+            result = outbox.deliver_batch(outbox.claim_batch(10))
+
+        self.assertEqual(result, (3, 0, 0))
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['user0@example.com', 'user1@example.com', 'user2@example.com'])
+        self.assertFalse(OutboundEmail.objects.exclude(status='sent').exists())
+        self.assertFalse(OutboundEmail.objects.filter(sent_at__isnull=True).exists())
+
+    @override_settings(EMAIL_BACKEND='users.tests.BouncingBackend')
+    def test_failed_send_is_requeued_with_backoff(self):
+        ok = self._enqueue('ok@example.com')
+        bounce = self._enqueue('bounce@example.com')
+
+        before = timezone.now()
+        result = outbox.deliver_batch(outbox.claim_batch(10))
+
+        self.assertEqual(result, (1, 1, 0))
+        self.assertEqual(OutboundEmail.objects.get(id=ok.id).status, 'sent')
+        bounce.refresh_from_db()
+        self.assertEqual(bounce.status, 'queued')
+        self.assertEqual(bounce.attempts, 1)
+        self.assertIn('No such user', bounce.last_error)
+        self.assertGreaterEqual(bounce.next_attempt_at, before + timedelta(seconds=60))
+        # Not due yet, so the next claim leaves it alone
+        self.assertEqual(outbox.claim_batch(10), [])
+
+    @override_settings(EMAIL_BACKEND='users.tests.BouncingBackend')
+    def test_email_fails_after_max_attempts_and_updates_its_log(self):
+        log = self._subscription_log()
+        email = self._enqueue('bounce@example.com', subscription_log=log)
+        OutboundEmail.objects.filter(id=email.id).update(attempts=2)
+
+        result = outbox.deliver_batch(outbox.claim_batch(10))
+
+        self.assertEqual(result, (0, 0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'failed')
+        self.assertEqual(email.attempts, 3)
+        log.refresh_from_db()
+        self.assertFalse(log.delivered)
+        self.assertIn('No such user', log.error_message)
+
+    def test_sent_email_marks_its_log_delivered(self):
+        log = self._subscription_log()
+        self._enqueue('subscriber@example.com', subscription_log=log)
+
+        outbox.deliver_batch(outbox.claim_batch(10))
+
+        log.refresh_from_db()
+        self.assertTrue(log.delivered)
+        self.assertEqual(log.error_message, '')
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(EMAIL_BACKEND='users.tests.UnreachableBackend')
+    def test_unreachable_server_backs_off_instead_of_raising(self):
+        emails = [self._enqueue(f'user{i}@example.com') for i in range(2)]
+
+        before = timezone.now()
+        result = outbox.deliver_batch(outbox.claim_batch(10))
+
+        self.assertEqual(result, (0, 2, 0))
+        for email in emails:
+            email.refresh_from_db()
+            self.assertEqual(email.status, 'queued')
+            self.assertEqual(email.attempts, 1)
+            self.assertIn('Connection refused', email.last_error)
+            self.assertGreaterEqual(email.next_attempt_at, before + timedelta(seconds=60))
+        self.assertEqual(outbox.claim_batch(10), [])
+
+
+class CampaignTests(TestCase):
+
+    def test_unsubscribe_links_use_the_frontend_keys(self):
+        User.objects.create_user(email='reader@example.com', referral_code='CAMP0001')
+        for audience, key in (('task', 'task_notifications'), ('promotional', 'promotional')):
+            send_campaign(name=audience, subject='News', audience=audience, context={'headline': 'Hi', 'body': 'Text'})
+            email = OutboundEmail.objects.get(kind=f'campaign:{audience}')
+            self.assertIn(f'?auto_unsubscribe={key}', email.html_body)
+
+    def test_opted_out_users_are_not_queued(self):
+        User.objects.create_user(email='in@example.com', referral_code='CAMP0002')
+        User.objects.create_user(email='out@example.com', referral_code='CAMP0003', receive_task_notifications=False)
+
+        summary = send_campaign(name='tasks', subject='New tasks', audience='task', context={'headline': 'Hi', 'body': 'Text'})
+
+        self.assertEqual(summary['queued'], 1)
+        self.assertEqual(list(OutboundEmail.objects.values_list('to_email', flat=True)), ['in@example.com'])
+
+
+class FakeFetcher:
+    """Returns the queued (keys, max_age) results in order; an Exception instance is raised."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class SigningKeyStoreTests(SimpleTestCase):
+
+    def _wait_for_background_refresh(self, store):
+        for _ in range(200):
+            if not store._refreshing:
+                return
+            time.sleep(0.01)
+        self.fail('background refresh did not finish')
+
+    def test_cached_keys_are_reused_until_expiry(self):
+        fetcher = FakeFetcher(({'kid1': 'cert1'}, 3600))
+        store = SigningKeyStore(fetcher=fetcher)
+
+        for _ in range(5):
+            self.assertEqual(store.get_key('kid1'), 'cert1')
+
+        self.assertEqual(fetcher.calls, 1)
+        self.assertEqual((store.misses, store.hits), (1, 4))
+
+    def test_unknown_kid_forces_one_refresh(self):
+        fetcher = FakeFetcher(({'old': 'cert-old'}, 3600), ({'new': 'cert-new'}, 3600))
+        store = SigningKeyStore(fetcher=fetcher, retry_after=0)
+
+        self.assertEqual(store.get_key('old'), 'cert-old')
+        self.assertEqual(store.get_key('new'), 'cert-new')
+        self.assertEqual(fetcher.calls, 2)
+
+    def test_unknown_kid_refresh_is_throttled(self):
+        fetcher = FakeFetcher(({'kid1': 'cert1'}, 3600))
+        store = SigningKeyStore(fetcher=fetcher, retry_after=60)
+
+        store.get_keys()
+        for _ in range(3):
+            self.assertIsNone(store.get_key('forged'))
+        self.assertEqual(fetcher.calls, 1)
+
+    def test_failed_refresh_keeps_serving_last_good_keys(self):
+        # max_age 0: every read is past expiry and starts a background refresh, which fails
+        fetcher = FakeFetcher(({'kid1': 'cert1'}, 0), requests.exceptions.ConnectionError('Google down'))
+        store = SigningKeyStore(fetcher=fetcher, retry_after=0)
+
+        self.assertEqual(store.get_key('kid1'), 'cert1')  # cold start: synchronous fetch
+        self.assertEqual(store.get_key('kid1'), 'cert1')  # expired: served, refreshed in background
+        self._wait_for_background_refresh(store)
+        self.assertEqual(fetcher.calls, 2)
+
+        self.assertEqual(store.get_keys(), {'kid1': 'cert1'})
+        self.assertEqual(store.get_key('kid1'), 'cert1')
+        # A forced refresh for an unknown kid fails too, without losing the cached keys
+        self.assertIsNone(store.get_key('kid2'))
+        self.assertEqual(store.get_keys(), {'kid1': 'cert1'})
+
+    def test_cold_start_failure_raises(self):
+        store = SigningKeyStore(fetcher=FakeFetcher(requests.exceptions.ConnectionError('Google down')))
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            store.get_keys()
@@ -0,0 +1,62 @@
+# users/token_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache where every entry carries its own expiry (epoch seconds).
+    Used to remember verified Firebase tokens so repeat requests skip RS256 and the user upsert.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at):
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+def token_digest(token):
+    """Cache key for a raw ID token (never keep the bearer token itself in memory as a key)."""
+    return hashlib.sha256(token.encode()).hexdigest()
@@ -1,9 +1,7 @@
 # users/utils.py
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
-from django.conf import settings
 from datetime import datetime
+from .emails import preferences_url_for, render_email
+from .outbox import enqueue_email
 
 
 def send_welcome_email(user):
@@ -20,24 +18,15 @@ def send_welcome_email(user):
     context = {
         'first_name': user.first_name.title(),
         # ✅ Add preferences link for future management
-        'preferences_url': user.get_preferences_url() if hasattr(user, 'get_preferences_url') else None,
+        'preferences_url': preferences_url_for(user),
     }
     
-    html_content = render_to_string('emails/welcome_email.html', context)
-    text_content = strip_tags(html_content)
+    html_content, text_content = render_email('emails/welcome_email.html', context)
 
-    msg = EmailMultiAlternatives(
-        subject=subject,
-        body=text_content,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[user.email]
-    )
-    msg.attach_alternative(html_content, "text/html")
-    
     try:
-        msg.send()
+        enqueue_email(user.email, subject, text_content, html_content, kind='welcome')
     except Exception as e:
-        print(f"Failed to send activation prompt email to {user.email}: {e}")
+        print(f"Failed to queue activation prompt email to {user.email}: {e}")
 
 
 def send_welcome_aboard_email(user):
@@ -52,24 +41,15 @@ def send_welcome_aboard_email(user):
     subject = "Welcome Aboard! Your Qezzy Account Is Active"
     context = {
         'first_name': user.first_name.title(),
-        'preferences_url': user.get_preferences_url() if hasattr(user, 'get_preferences_url') else None,
+        'preferences_url': preferences_url_for(user),
     }
     
-    html_content = render_to_string('emails/welcome_aboard.html', context)
-    text_content = strip_tags(html_content)
+    html_content, text_content = render_email('emails/welcome_aboard.html', context)
 
-    msg = EmailMultiAlternatives(
-        subject=subject,
-        body=text_content,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[user.email]
-    )
-    msg.attach_alternative(html_content, "text/html")
-    
     try:
-        msg.send()
+        enqueue_email(user.email, subject, text_content, html_content, kind='welcome_aboard')
     except Exception as e:
-        print(f"Failed to send welcome aboard email to {user.email}: {e}")
+        print(f"Failed to queue welcome aboard email to {user.email}: {e}")
 
 
 def send_withdrawal_completed_email(
@@ -106,31 +86,24 @@ def send_withdrawal_completed_email(
         'reference_code': reference_code,
         'recipient_name': recipient_name or "your account",
         # ✅ Add preferences link (users can still manage other email types)
-        'preferences_url': user.get_preferences_url() if hasattr(user, 'get_preferences_url') else None,
+        'preferences_url': preferences_url_for(user),
     }
 
-    html_content = render_to_string('emails/withdrawal_completed.html', context)
-    text_content = strip_tags(html_content)
-
-    msg = EmailMultiAlternatives(
-        subject=subject,
-        body=text_content,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[user.email]
-    )
-    msg.attach_alternative(html_content, "text/html")
+    html_content, text_content = render_email('emails/withdrawal_completed.html', context)
 
     try:
-        msg.send()
+        enqueue_email(user.email, subject, text_content, html_content, kind='withdrawal_completed')
     except Exception as e:
-        print(f"Failed to send withdrawal email to {user.email}: {e}")
+        print(f"Failed to queue withdrawal email to {user.email}: {e}")
 
 
-def send_statement_email(user, wallet_type='main', start_date=None, end_date=None):
-    from wallets.utils import generate_statement_pdf
+def send_statement_email(user, wallet_type='main', start_date=None, end_date=None, pdf_bytes=None):
+    from wallets.utils import generate_statement_pdf, encrypt_pdf
     """
     Generate a password-protected PDF statement and email it as an attachment.
     The password is NOT included in the email — only the logic to derive it.
+    Pass pdf_bytes (an already rendered statement) to skip rendering.
+    Returns True when queued, False on failure, None when the user opted out.
     
     ✅ Respects user.receive_statement_emails preference.
     """
@@ -156,14 +129,17 @@ def send_statement_email(user, wallet_type='main', start_date=None, end_date=Non
         phone_part = digits_only[-4:]
         password = f"{last_name_part}{phone_part}"
 
-        # Generate encrypted PDF
-        pdf_buffer = generate_statement_pdf(
-            user=user,
-            wallet_type=wallet_type,
-            start_date=start_date,
-            end_date=end_date,
-            password=password
-        )
+        # Generate encrypted PDF (reuse the rendered statement when we have one)
+        if pdf_bytes is not None:
+            pdf_buffer = encrypt_pdf(pdf_bytes, password)
+        else:
+            pdf_buffer = generate_statement_pdf(
+                user=user,
+                wallet_type=wallet_type,
+                start_date=start_date,
+                end_date=end_date,
+                password=password
+            )
 
         # Filename
         date_str = datetime.now().strftime("%Y%m%d")
@@ -173,69 +149,27 @@ def send_statement_email(user, wallet_type='main', start_date=None, end_date=Non
         subject = f"Your Qezzy {wallet_type.title()} Wallet Statement"
         
         # ✅ Add preferences URL to context
-        preferences_url = user.get_preferences_url() if hasattr(user, 'get_preferences_url') else None
-
-        plain_body = (
-            f"Hi {user.first_name.title()},\n\n"
-            "Your account statement is attached as a password-protected PDF for security.\n\n"
-            "To open it, use a password formed from:\n"
-            "- The first two letters of your last name (in uppercase), and\n"
-            "- The last four digits of your registered phone number.\n\n"
-            "Example: If your name is Agnes Muma and phone is 0712345678, your password is MU5678.\n\n"
-            "Thank you for using Qezzy!\n\n"
-            "— The Qezzy Team"
-            + (f"\n\nManage email preferences: {preferences_url}" if preferences_url else "")
+        preferences_url = preferences_url_for(user)
+
+        context = {
+            'first_name': user.first_name.title(),
+            'wallet_type': wallet_type,
+            'preferences_url': preferences_url,
+        }
+        html_body, _ = render_email('emails/statement.html', context)
+        plain_body, _ = render_email('emails/statement.txt', context)
+
+        # Queue email with attachment (the encrypted PDF is stored with the outbox row)
+        enqueue_email(
+            user.email, subject, plain_body.strip(), html_body,
+            kind='statement',
+            attachment=(filename, pdf_buffer.getvalue(), 'application/pdf')
         )
-
-        html_body = f"""
-        <div style="font-family: Helvetica, Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; background-color: #f9f9f9;">
-          <div style="background: white; padding: 30px; border-radius: 8px; box-shadow: 0 2px 6px rgba(0,0,0,0.1); border-top: 4px solid #d4a017;">
-            <div style="text-align: center; margin-bottom: 24px;">
-              <div style="font-weight: bold; font-size: 28px; color: #8B5E00; letter-spacing: -0.5px;">Qezzy Kenya</div>
-              <h1 style="color: #8B5E00; font-size: 22px;">Your Account Statement</h1>
-            </div>
-            
-            <p>Hi {user.first_name.title()},</p>
-            
-            <p>Your {wallet_type} wallet statement is attached as a <strong>password-protected PDF</strong> for your security.</p>
-
-            <div style="background-color: #fdf9f0; border: 1px solid #f0e0c0; border-radius: 6px; padding: 16px; margin: 20px 0;">
-              <p><strong>How to open the PDF:</strong></p>
-              <p>Your password is a combination of:</p>
-              <ul style="margin: 12px 0 12px 20px; padding-left: 0;">
-                <li>The <strong>first two letters of your last name</strong> (in uppercase)</li>
-                <li>The <strong>last four digits of your registered phone number</strong></li>
-              </ul>
-              <p style="font-style: italic; color: #666; margin-top: 12px;">
-                Example: If your name is <em>Agnes Muma</em> and phone is <em>0712345678</em>, your password is <strong>MU5678</strong>.
-              </p>
-            </div>
-
-            <p>Only you can access this document — keep it secure.</p>
-            
-            {f'<p style="margin-top:20px;font-size:12px;"><a href="{preferences_url}" style="color:#d4a017;">Manage email preferences</a></p>' if preferences_url else ''}
-
-            <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #eee; text-align: center; color: #666; font-size: 14px;">
-              © {datetime.now().year} Qezzy Kenya. All rights reserved.<br>
-              Nairobi, Kenya | www.qezzykenya.company
-            </div>
-          </div>
-        </div>
-        """
-
-        # Create and send email with attachment
-        msg = EmailMultiAlternatives(
-            subject=subject,
-            body=plain_body,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[user.email]
-        )
-        msg.attach_alternative(html_body, "text/html")
-        msg.attach(filename, pdf_buffer.getvalue(), 'application/pdf')
-        msg.send()
+        return True
 
     except Exception as e:
-        print(f"Failed to send statement email to {user.email}: {e}")
+        print(f"Failed to queue statement email to {user.email}: {e}")
+        return False
 
 
 def send_task_assigned_email(user, task_title, reward, deadline):
@@ -255,7 +189,7 @@ def send_task_assigned_email(user, task_title, reward, deadline):
     subject = f"New Task: {task_title} – Qezzy Kenya"
     
     # ✅ Add preferences and unsubscribe URLs to context
-    preferences_url = user.get_preferences_url() if hasattr(user, 'get_preferences_url') else None
+    preferences_url = preferences_url_for(user)
     unsubscribe_url = f"{preferences_url}?auto_unsubscribe=task_notifications" if preferences_url else None
     
     context = {
@@ -267,19 +201,10 @@ def send_task_assigned_email(user, task_title, reward, deadline):
         'unsubscribe_url': unsubscribe_url,  # ← NEW
     }
 
-    html_content = render_to_string('emails/task_assigned.html', context)
-    text_content = strip_tags(html_content)
-
-    msg = EmailMultiAlternatives(
-        subject=subject,
-        body=text_content,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[user.email]
-    )
-    msg.attach_alternative(html_content, "text/html")
+    html_content, text_content = render_email('emails/task_assigned.html', context)
 
     try:
-        msg.send()
-        print(f"[DEBUG] Email sent successfully to {user.email}")
+        enqueue_email(user.email, subject, text_content, html_content, kind='task_assigned')
+        print(f"[DEBUG] Email queued successfully for {user.email}")
     except Exception as e:
-        print(f"Failed to send task email to {user.email}: {e}")
\ No newline at end of file
+        print(f"Failed to queue task email to {user.email}: {e}")
\ No newline at end of file
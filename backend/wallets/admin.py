@@ -1,7 +1,9 @@
 # wallets/admin.py
+import uuid
 from django.contrib import admin
 from django.core.exceptions import PermissionDenied
-from .models import WalletTransaction
+from .models import WalletTransaction, WalletBalance, StatementJob
+from .services import ledger_key
 
 
 @admin.register(WalletTransaction)
@@ -11,7 +13,7 @@ class WalletTransactionAdmin(admin.ModelAdmin):
         'amount', 'running_balance', 'created_at'
     ]
     list_filter = ['wallet_type', 'transaction_type', 'created_at']
-    search_fields = ['user__email']
+    search_fields = ['user__email', '=idempotency_key']
     ordering = ['-created_at']
     readonly_fields = [f.name for f in WalletTransaction._meta.fields]  # All fields readonly
 
@@ -36,10 +38,56 @@ class WalletTransactionAdmin(admin.ModelAdmin):
             raise PermissionDenied("Only 'Admin Adjustment' transactions can be created manually.")
 
         obj.source = 'admin'  # Enforce source
+        if not obj.idempotency_key:
+            obj.idempotency_key = ledger_key('admin_adjustment', uuid.uuid4().hex)
         obj.save()
 
     def user_email(self, obj):
         return obj.user.email
 
     user_email.short_description = 'User'
-    user_email.admin_order_field = 'user__email'
\ No newline at end of file
+    user_email.admin_order_field = 'user__email'
+
+
+@admin.register(WalletBalance)
+class WalletBalanceAdmin(admin.ModelAdmin):
+    list_display = ['user_email', 'wallet_type', 'balance', 'last_transaction', 'updated_at']
+    list_filter = ['wallet_type']
+    search_fields = ['user__email']
+    readonly_fields = [f.name for f in WalletBalance._meta.fields]
+
+    def has_add_permission(self, request):
+        # Balances are derived from the ledger only
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def user_email(self, obj):
+        return obj.user.email
+
+    user_email.short_description = 'User'
+    user_email.admin_order_field = 'user__email'
+
+
+@admin.register(StatementJob)
+class StatementJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user_email', 'wallet_type', 'delivery', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'delivery', 'wallet_type']
+    search_fields = ['user__email']
+    readonly_fields = [f.name for f in StatementJob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def user_email(self, obj):
+        return obj.user.email
+
+    user_email.short_description = 'User'
+    user_email.admin_order_field = 'user__email'
@@ -0,0 +1,163 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from users.models import User
+from wallets.models import WalletTransaction, WalletBalance
+
+BENCH_EMAIL_DOMAIN = 'bench.qezzy.local'
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a LOCAL Postgres with synthetic ledger rows and reports EXPLAIN plans '
+        'and p50/p99 latencies for every wallet query. Use it to catch index regressions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='Insert synthetic users and ledger rows first.')
+        parser.add_argument('--users', type=int, default=2000, help='Synthetic users to create when seeding (default: 2000).')
+        parser.add_argument('--rows', type=int, default=2_000_000, help='Total ledger rows to create when seeding (default: 2,000,000).')
+        parser.add_argument('--iterations', type=int, default=200, help='Timed runs per query (default: 200).')
+        parser.add_argument('--cleanup', action='store_true', help='Delete all synthetic benchmark data and exit.')
+        parser.add_argument('--force', action='store_true', help='Allow running with DEBUG=False (never point this at production).')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('This benchmark targets PostgreSQL only.')
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Refusing to run with DEBUG=False. Use a local database, or pass --force.')
+
+        if options['cleanup']:
+            self._cleanup()
+            return
+
+        if options['seed']:
+            self._seed(options['users'], options['rows'])
+
+        user_ids = list(
+            User.objects.filter(email__endswith=f'@{BENCH_EMAIL_DOMAIN}').values_list('id', flat=True)
+        )
+        if not user_ids:
+            raise CommandError('No benchmark users found. Run with --seed first.')
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {WalletTransaction._meta.db_table}')
+            cursor.execute(f'ANALYZE {WalletBalance._meta.db_table}')
+
+        total_rows = WalletTransaction.objects.filter(user_id__in=user_ids[:1]).count()
+        self.stdout.write(f'🧪 {len(user_ids)} benchmark users, ~{total_rows} ledger rows per user\n')
+
+        results = []
+        for name, build in self._queries():
+            plan_qs = build(random.choice(user_ids))
+            self.stdout.write(self.style.MIGRATE_HEADING(f'▶ {name}'))
+            self.stdout.write(plan_qs.explain(analyze=True, buffers=True))
+
+            timings = []
+            for _ in range(options['iterations']):
+                qs = build(random.choice(user_ids))
+                start = time.perf_counter()
+                list(qs)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            cuts = statistics.quantiles(timings, n=100)
+            results.append((name, cuts[49], cuts[98], max(timings)))
+            self.stdout.write()
+
+        self.stdout.write('📊 LATENCY (ms):')
+        self.stdout.write(f'  {"query":<28}{"p50":>10}{"p99":>10}{"max":>10}')
+        for name, p50, p99, worst in results:
+            self.stdout.write(f'  {name:<28}{p50:>10.2f}{p99:>10.2f}{worst:>10.2f}')
+
+    def _queries(self):
+        """Every query shape the wallets/withdrawals code runs against the ledger."""
+        today = timezone.now().date()
+
+        def wallet_qs(user_id):
+            return WalletTransaction.objects.filter(user_id=user_id, wallet_type='main')
+
+        return [
+            ('balance_lookup', lambda uid: WalletBalance.objects.filter(user_id=uid, wallet_type='main').values('balance')),
+            ('latest_transaction', lambda uid: wallet_qs(uid).order_by('-created_at', '-id')[:1]),
+            ('history_first_page', lambda uid: wallet_qs(uid).exclude(
+                transaction_type='withdrawal_pending').order_by('created_at', 'id')[:50]),
+            ('statement_30_days', lambda uid: wallet_qs(uid).filter(
+                created_at__date__gte=today - timedelta(days=30),
+                created_at__date__lte=today).order_by('created_at')),
+            ('opening_balance', lambda uid: wallet_qs(uid).filter(
+                created_at__lt=timezone.now() - timedelta(days=30)).order_by('-created_at', '-id')[:1]),
+            # Seeded rows have no linked withdrawals; the user id stands in for a withdrawal id
+            # so the plan still shows whether the partial (linked_withdrawal, type) index is used.
+            ('reversal_exists', lambda uid: WalletTransaction.objects.filter(
+                linked_withdrawal_id=uid, transaction_type='withdrawal_reversal').values('id')[:1]),
+        ]
+
+    def _seed(self, user_count, row_count):
+        rows_per_user = max(row_count // user_count, 1)
+        self.stdout.write(f'🌱 Seeding {user_count} users × {rows_per_user} ledger rows...')
+        started = time.perf_counter()
+
+        existing = User.objects.filter(email__endswith=f'@{BENCH_EMAIL_DOMAIN}').count()
+        users = [
+            User(
+                email=f'bench-{i}@{BENCH_EMAIL_DOMAIN}',
+                referral_code=f'Z{i:07d}'[-8:],
+                is_onboarded=True,
+            )
+            for i in range(existing, existing + user_count)
+        ]
+        User.objects.bulk_create(users, batch_size=5000)
+
+        tx_table = WalletTransaction._meta.db_table
+        balance_table = WalletBalance._meta.db_table
+        user_table = User._meta.db_table
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Every 5th row goes to the referral wallet; every 50th is a pending withdrawal.
+            cursor.execute(f"""
+                INSERT INTO {tx_table}
+                    (user_id, wallet_type, transaction_type, amount, running_balance,
+                     description, created_at, linked_withdrawal_id)
+                SELECT u.id,
+                       CASE WHEN g % 5 = 0 THEN 'referral' ELSE 'main' END,
+                       CASE WHEN g % 50 = 0 THEN 'withdrawal_pending' ELSE 'survey_earning' END,
+                       10.00,
+                       g * 10.00,
+                       'benchmark row',
+                       NOW() - ((%s - g) * INTERVAL '10 minutes'),
+                       NULL
+                FROM {user_table} u
+                CROSS JOIN generate_series(1, %s) AS g
+                WHERE u.email LIKE %s
+                  AND NOT EXISTS (SELECT 1 FROM {tx_table} t WHERE t.user_id = u.id)
+            """, [rows_per_user, rows_per_user, f'%@{BENCH_EMAIL_DOMAIN}'])
+
+            cursor.execute(f"""
+                INSERT INTO {balance_table} (user_id, wallet_type, balance, last_transaction_id, updated_at)
+                SELECT DISTINCT ON (user_id, wallet_type) user_id, wallet_type, running_balance, id, NOW()
+                FROM {tx_table}
+                WHERE user_id IN (SELECT id FROM {user_table} WHERE email LIKE %s)
+                ORDER BY user_id, wallet_type, created_at DESC, id DESC
+                ON CONFLICT (user_id, wallet_type) DO NOTHING
+            """, [f'%@{BENCH_EMAIL_DOMAIN}'])
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Seeded in {time.perf_counter() - started:.1f}s'))
+
+    def _cleanup(self):
+        pattern = f'%@{BENCH_EMAIL_DOMAIN}'
+        bench_users = f'SELECT id FROM {User._meta.db_table} WHERE email LIKE %s'
+        # Plain SQL deletes: the ORM cascade would load millions of ledger rows into memory
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {WalletBalance._meta.db_table} WHERE user_id IN ({bench_users})', [pattern])
+            cursor.execute(f'DELETE FROM {WalletTransaction._meta.db_table} WHERE user_id IN ({bench_users})', [pattern])
+            ledger_rows = cursor.rowcount
+            cursor.execute(f'DELETE FROM {User._meta.db_table} WHERE email LIKE %s', [pattern])
+            user_rows = cursor.rowcount
+        self.stdout.write(self.style.SUCCESS(f'🧹 Removed {user_rows} benchmark users and {ledger_rows} ledger rows.'))
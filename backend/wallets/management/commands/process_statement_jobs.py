@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from earn_backend.rendering import render_service
+from wallets.statements import claim_next_job, run_statement_job
+
+
+class Command(BaseCommand):
+    help = 'Renders queued wallet statements (downloads and emails). Runs forever unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit instead of polling.')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty (default: 2).')
+        parser.add_argument('--max-jobs', type=int, default=0, help='Exit after this many jobs (0 = no limit).')
+
+    def handle(self, *args, **options):
+        once = options['once']
+        poll_interval = options['poll_interval']
+        max_jobs = options['max_jobs']
+
+        self.stdout.write('📄 Statement worker started...')
+        done = failed = 0
+
+        try:
+            while not max_jobs or done + failed < max_jobs:
+                close_old_connections()
+                job = claim_next_job()
+                if job is None:
+                    if once:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                if run_statement_job(job):
+                    done += 1
+                    self.stdout.write(self.style.SUCCESS(f'  ✅ Job {job.id} ({job.delivery}) for {job.user.email}'))
+                else:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f'  ❌ Job {job.id} ({job.status}): {job.error}'))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('⚠️  Interrupted.'))
+        finally:
+            render_service.shutdown()
+
+        self.stdout.write()
+        self.stdout.write('📊 SUMMARY:')
+        self.stdout.write(f'  📄 Statements processed: {done}')
+        self.stdout.write(f'  ❌ Failed attempts: {failed}')
+        stats = render_service.stats()
+        self.stdout.write(f'  🖨️  Renderer: {stats["rendered"]} rendered, peak queue depth {stats["peak_queue_depth"]}')
@@ -0,0 +1,139 @@
+import logging
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, OuterRef, Subquery, Sum, When
+
+from wallets.models import WalletTransaction, WalletBalance
+
+logger = logging.getLogger('wallets.management')
+
+
+def ledger_summary():
+    """
+    One row per (user, wallet_type) found in the ledger with:
+      - latest running_balance and id (ordered by created_at, id)
+      - signed sum of all amounts (what the running balance *should* be)
+    """
+    latest = WalletTransaction.objects.filter(
+        user_id=OuterRef('user_id'),
+        wallet_type=OuterRef('wallet_type')
+    ).order_by('-created_at', '-id')
+
+    signed_amount = Case(
+        When(transaction_type__in=WalletTransaction.DEBIT_TYPES, then=-F('amount')),
+        default=F('amount'),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+
+    return (
+        WalletTransaction.objects
+        .order_by()
+        .values('user_id', 'wallet_type')
+        .annotate(
+            ledger_sum=Sum(signed_amount),
+            tx_count=Count('id'),
+            latest_balance=Subquery(latest.values('running_balance')[:1]),
+            latest_id=Subquery(latest.values('id')[:1]),
+        )
+    )
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the materialized WalletBalance table from the WalletTransaction ledger and verifies it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only compare WalletBalance with the ledger and report drift; do not write.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Number of wallets upserted per batch (default: 2000).'
+        )
+
+    def handle(self, *args, **options):
+        check_only = options['check']
+        batch_size = options['batch_size']
+
+        stored = {
+            (b['user_id'], b['wallet_type']): b['balance']
+            for b in WalletBalance.objects.values('user_id', 'wallet_type', 'balance').iterator(chunk_size=batch_size)
+        }
+
+        wallets = 0
+        drift = 0
+        chain_breaks = 0
+        batch = []
+
+        for row in ledger_summary().iterator(chunk_size=batch_size):
+            wallets += 1
+            key = (row['user_id'], row['wallet_type'])
+            latest_balance = row['latest_balance'] or Decimal('0.00')
+            ledger_sum = row['ledger_sum'] or Decimal('0.00')
+
+            # running_balance chain disagrees with the sum of the ledger itself
+            if latest_balance != ledger_sum:
+                chain_breaks += 1
+                self.stdout.write(self.style.WARNING(
+                    f'  ⚠️  Ledger chain mismatch user={key[0]} wallet={key[1]}: '
+                    f'latest running_balance={latest_balance}, sum of entries={ledger_sum}'
+                ))
+
+            current = stored.pop(key, None)
+            if current != latest_balance:
+                drift += 1
+                self.stdout.write(
+                    f'  🔧 Drift user={key[0]} wallet={key[1]}: stored={current} ledger={latest_balance}'
+                )
+
+            if not check_only:
+                batch.append(WalletBalance(
+                    user_id=key[0],
+                    wallet_type=key[1],
+                    balance=latest_balance,
+                    last_transaction_id=row['latest_id'],
+                ))
+                if len(batch) >= batch_size:
+                    self._upsert(batch)
+                    batch = []
+
+        if batch:
+            self._upsert(batch)
+
+        # Balance rows with no ledger behind them
+        orphans = [key for key, balance in stored.items() if balance != Decimal('0.00')]
+        for user_id, wallet_type in orphans:
+            drift += 1
+            self.stdout.write(f'  🔧 Balance without ledger rows user={user_id} wallet={wallet_type}')
+        if orphans and not check_only:
+            for user_id, wallet_type in orphans:
+                WalletBalance.objects.filter(user_id=user_id, wallet_type=wallet_type).update(
+                    balance=Decimal('0.00'), last_transaction=None
+                )
+
+        self.stdout.write()
+        self.stdout.write('📊 SUMMARY:')
+        self.stdout.write(f'  👛 Wallets in ledger: {wallets}')
+        self.stdout.write(f'  🔧 Balances out of sync: {drift}')
+        self.stdout.write(f'  ⚠️  Ledger chain mismatches: {chain_breaks}')
+
+        if check_only and (drift or chain_breaks):
+            raise CommandError('WalletBalance does not match the ledger. Run without --check to rebuild.')
+        if check_only:
+            self.stdout.write(self.style.SUCCESS('✅ WalletBalance matches the ledger.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ WalletBalance rebuilt from the ledger.'))
+
+    def _upsert(self, batch):
+        with transaction.atomic():
+            WalletBalance.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=['user', 'wallet_type'],
+                update_fields=['balance', 'last_transaction', 'updated_at'],
+            )
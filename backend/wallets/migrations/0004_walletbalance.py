@@ -0,0 +1,69 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:45
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_balances(apps, schema_editor):
+    """Seed one WalletBalance per wallet from the latest ledger row."""
+    WalletTransaction = apps.get_model('wallets', 'WalletTransaction')
+    WalletBalance = apps.get_model('wallets', 'WalletBalance')
+
+    latest = WalletTransaction.objects.filter(
+        user_id=OuterRef('user_id'),
+        wallet_type=OuterRef('wallet_type')
+    ).order_by('-created_at', '-id')
+
+    wallets = (
+        WalletTransaction.objects
+        .order_by()
+        .values('user_id', 'wallet_type')
+        .distinct()
+        .annotate(
+            latest_balance=Subquery(latest.values('running_balance')[:1]),
+            latest_id=Subquery(latest.values('id')[:1]),
+        )
+    )
+
+    batch = []
+    for row in wallets.iterator(chunk_size=2000):
+        batch.append(WalletBalance(
+            user_id=row['user_id'],
+            wallet_type=row['wallet_type'],
+            balance=row['latest_balance'],
+            last_transaction_id=row['latest_id'],
+        ))
+        if len(batch) >= 2000:
+            WalletBalance.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        WalletBalance.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0003_alter_wallettransaction_transaction_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wallet_type', models.CharField(choices=[('main', 'Main Wallet'), ('referral', 'Referral Wallet')], max_length=10)),
+                ('balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_transaction', models.ForeignKey(blank=True, help_text='Latest ledger row reflected in this balance', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wallets.wallettransaction')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wallet_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'wallet_type'), name='one_balance_per_wallet'), models.CheckConstraint(condition=models.Q(('balance__gte', 0)), name='non_negative_wallet_balance')],
+            },
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
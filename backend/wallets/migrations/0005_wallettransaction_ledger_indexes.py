@@ -0,0 +1,28 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:46
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; it avoids locking
+    # the ledger against writes while the indexes build on a large table.
+    atomic = False
+
+    dependencies = [
+        ('wallets', '0004_walletbalance'),
+        ('withdrawals', '0004_remove_withdrawalrequest_linked_transaction_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='wallettransaction',
+            index=models.Index(fields=['user', 'wallet_type', 'created_at', 'id'], name='wtx_wallet_history_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='wallettransaction',
+            index=models.Index(condition=models.Q(('linked_withdrawal__isnull', False)), fields=['linked_withdrawal', 'transaction_type'], name='wtx_withdrawal_type_idx'),
+        ),
+    ]
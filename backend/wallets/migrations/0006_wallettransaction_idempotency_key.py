@@ -0,0 +1,56 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:48
+
+import re
+
+from django.db import migrations, models
+
+SUBMISSION_ID_RE = re.compile(r'Submission ID: (\d+)')
+
+
+def backfill_survey_keys(apps, schema_editor):
+    """
+    Give existing survey credits the key the signal now uses, so re-approving an old
+    submission cannot pay it twice. If a submission was already paid twice, only the
+    first credit gets the key.
+    """
+    WalletTransaction = apps.get_model('wallets', 'WalletTransaction')
+
+    seen = set()
+    batch = []
+    credits = (
+        WalletTransaction.objects
+        .filter(transaction_type='survey_earning', description__contains='Submission ID:')
+        .order_by('id')
+        .only('id', 'description')
+    )
+    for tx in credits.iterator(chunk_size=2000):
+        match = SUBMISSION_ID_RE.search(tx.description)
+        if not match:
+            continue
+        key = f'survey_earning:{match.group(1)}'
+        if key in seen:
+            continue
+        seen.add(key)
+        tx.idempotency_key = key
+        batch.append(tx)
+        if len(batch) >= 2000:
+            WalletTransaction.objects.bulk_update(batch, ['idempotency_key'])
+            batch = []
+    if batch:
+        WalletTransaction.objects.bulk_update(batch, ['idempotency_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0005_wallettransaction_ledger_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallettransaction',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text="Producer-supplied key, e.g. 'survey_earning:123'. A second post with the same key is rejected.", max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_survey_keys, migrations.RunPython.noop),
+    ]
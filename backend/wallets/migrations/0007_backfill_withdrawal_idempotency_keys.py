@@ -0,0 +1,50 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:50
+
+from django.db import migrations
+
+WITHDRAWAL_TYPES = ['withdrawal_pending', 'withdrawal', 'withdrawal_reversal']
+
+
+def backfill_withdrawal_keys(apps, schema_editor):
+    """
+    Key existing withdrawal rows as '<transaction_type>:<withdrawal id>', the same keys
+    the withdrawal views, admin and reversal services now post with. Duplicates that
+    slipped in before the unique key existed keep a NULL key (oldest row wins).
+    """
+    WalletTransaction = apps.get_model('wallets', 'WalletTransaction')
+
+    seen = set()
+    batch = []
+    rows = (
+        WalletTransaction.objects
+        .filter(
+            transaction_type__in=WITHDRAWAL_TYPES,
+            linked_withdrawal__isnull=False,
+            idempotency_key__isnull=True
+        )
+        .order_by('id')
+        .only('id', 'transaction_type', 'linked_withdrawal_id')
+    )
+    for tx in rows.iterator(chunk_size=2000):
+        key = f'{tx.transaction_type}:{tx.linked_withdrawal_id}'
+        if key in seen:
+            continue
+        seen.add(key)
+        tx.idempotency_key = key
+        batch.append(tx)
+        if len(batch) >= 2000:
+            WalletTransaction.objects.bulk_update(batch, ['idempotency_key'])
+            batch = []
+    if batch:
+        WalletTransaction.objects.bulk_update(batch, ['idempotency_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0006_wallettransaction_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_withdrawal_keys, migrations.RunPython.noop),
+    ]
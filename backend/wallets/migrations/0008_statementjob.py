@@ -0,0 +1,39 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0007_backfill_withdrawal_idempotency_keys'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wallet_type', models.CharField(choices=[('main', 'Main Wallet'), ('referral', 'Referral Wallet')], max_length=10)),
+                ('start_date', models.DateField(blank=True, null=True)),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('ledger_high_water_mark', models.PositiveBigIntegerField(default=0, help_text='WalletBalance.last_transaction id when requested; a new ledger row means a new statement')),
+                ('delivery', models.CharField(choices=[('download', 'Download'), ('email', 'Email')], default='download', max_length=10)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('pdf', models.FileField(blank=True, upload_to='statements/%Y/%m/')),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statement_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='stmt_job_queue_idx'), models.Index(fields=['user', 'wallet_type', 'ledger_high_water_mark', 'start_date', 'end_date'], name='stmt_job_cache_idx')],
+            },
+        ),
+    ]
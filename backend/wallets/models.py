@@ -1,5 +1,5 @@
 # wallets/models.py
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
 from django.db.models import CheckConstraint, Q
 from decimal import Decimal
@@ -20,6 +20,8 @@ class WalletTransaction(models.Model):
         ('main', 'Main Wallet'),
         ('referral', 'Referral Wallet'),
     ]
+    # Transaction types that reduce the wallet balance
+    DEBIT_TYPES = ['withdrawal', 'withdrawal_pending']
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wallet_transactions')
     wallet_type = models.CharField(max_length=10, choices=WALLET_TYPES)
@@ -34,10 +36,27 @@ class WalletTransaction(models.Model):
         on_delete=models.SET_NULL,
         help_text="Reference to withdrawal this transaction relates to"
     )
+    idempotency_key = models.CharField(
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+        help_text="Producer-supplied key, e.g. 'survey_earning:123'. A second post with the same key is rejected."
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Balance, history and statement queries: WHERE user, wallet_type ORDER BY created_at, id
+            models.Index(fields=['user', 'wallet_type', 'created_at', 'id'], name='wtx_wallet_history_idx'),
+            # Reversal / settlement checks: WHERE linked_withdrawal = ? AND transaction_type = ?
+            models.Index(
+                fields=['linked_withdrawal', 'transaction_type'],
+                name='wtx_withdrawal_type_idx',
+                condition=Q(linked_withdrawal__isnull=False),
+            ),
+        ]
         constraints = [
             CheckConstraint(
                 condition=Q(running_balance__gte=0),
@@ -47,7 +66,7 @@ class WalletTransaction(models.Model):
 
     def _get_balance_impact(self):
         """Return net effect on balance: positive = credit, negative = debit."""
-        if self.transaction_type in ['withdrawal', 'withdrawal_pending']:  # ← UPDATED
+        if self.transaction_type in self.DEBIT_TYPES:
             return -self.amount
         else:
             # Includes: survey_earning, referral_bonus, activation_payment,
@@ -58,21 +77,130 @@ class WalletTransaction(models.Model):
         if self.pk is not None:
             raise ValidationError("WalletTransaction is immutable after creation.")
 
-        # Compute current balance from last completed transaction (all are completed by design)
-        last_tx = WalletTransaction.objects.filter(
-            user=self.user,
-            wallet_type=self.wallet_type
-        ).order_by('-created_at', '-id').first()
+        # The WalletBalance row is the lock target: concurrent posts to the same
+        # wallet serialize here instead of racing on "latest transaction" reads.
+        with transaction.atomic():
+            wallet = WalletBalance.objects.lock(self.user, self.wallet_type)
+            new_balance = wallet.balance + self._get_balance_impact()
+
+            if new_balance < 0:
+                raise ValidationError("Insufficient balance for this transaction.")
+
+            self.running_balance = new_balance
+            super().save(*args, **kwargs)
+
+            wallet.balance = new_balance
+            wallet.last_transaction = self
+            wallet.save(update_fields=['balance', 'last_transaction', 'updated_at'])
+
+    def __str__(self):
+        return f"{self.user.email} - {self.wallet_type} - {self.transaction_type} - {self.amount}"
 
-        current_balance = last_tx.running_balance if last_tx else Decimal('0.00')
-        impact = self._get_balance_impact()
-        new_balance = current_balance + impact
 
-        if new_balance < 0:
-            raise ValidationError("Insufficient balance for this transaction.")
+class WalletBalanceManager(models.Manager):
+    def lock(self, user, wallet_type):
+        """
+        Return the balance row for (user, wallet_type) locked FOR UPDATE.
+        Must be called inside transaction.atomic(). A missing row is created,
+        seeded from the ledger so wallets that predate this table stay correct.
+        """
+        def ledger_balance():
+            last_tx = WalletTransaction.objects.filter(
+                user=user,
+                wallet_type=wallet_type
+            ).order_by('-created_at', '-id').first()
+            return last_tx.running_balance if last_tx else Decimal('0.00')
+
+        wallet, _ = self.select_for_update().get_or_create(
+            user=user,
+            wallet_type=wallet_type,
+            defaults={'balance': ledger_balance}
+        )
+        return wallet
+
+    def balances_for(self, user):
+        """Return {wallet_type: balance} for every wallet, defaulting to 0.00."""
+        balances = {wallet_type: Decimal('0.00') for wallet_type, _ in WalletTransaction.WALLET_TYPES}
+        balances.update(self.filter(user=user).values_list('wallet_type', 'balance'))
+        return balances
+
+
+class WalletBalance(models.Model):
+    """
+    Materialized current balance per (user, wallet_type).
+    Updated in the same DB transaction as every WalletTransaction insert, so it always
+    equals the running_balance of the wallet's latest ledger row.
+    Rebuild/verify with: python manage.py rebuild_wallet_balances [--check]
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wallet_balances')
+    wallet_type = models.CharField(max_length=10, choices=WalletTransaction.WALLET_TYPES)
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    last_transaction = models.ForeignKey(
+        WalletTransaction,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        help_text="Latest ledger row reflected in this balance"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
 
-        self.running_balance = new_balance
-        super().save(*args, **kwargs)
+    objects = WalletBalanceManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'wallet_type'], name='one_balance_per_wallet'),
+            CheckConstraint(condition=Q(balance__gte=0), name='non_negative_wallet_balance'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.wallet_type}: {self.balance}"
+
+class StatementJob(models.Model):
+    """
+    A queued statement render. The PDF is cached on the job and reused for any later
+    request with the same (user, wallet, date range, ledger high-water mark).
+    Processed by: python manage.py process_statement_jobs
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    DELIVERY_CHOICES = [
+        ('download', 'Download'),
+        ('email', 'Email'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='statement_jobs')
+    wallet_type = models.CharField(max_length=10, choices=WalletTransaction.WALLET_TYPES)
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    ledger_high_water_mark = models.PositiveBigIntegerField(
+        default=0,
+        help_text="WalletBalance.last_transaction id when requested; a new ledger row means a new statement"
+    )
+    delivery = models.CharField(max_length=10, choices=DELIVERY_CHOICES, default='download')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    pdf = models.FileField(upload_to='statements/%Y/%m/', blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Worker claim: WHERE status IN (...) ORDER BY created_at
+            models.Index(fields=['status', 'created_at'], name='stmt_job_queue_idx'),
+            # Cache lookup
+            models.Index(
+                fields=['user', 'wallet_type', 'ledger_high_water_mark', 'start_date', 'end_date'],
+                name='stmt_job_cache_idx'
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.user.email} - {self.wallet_type} - {self.transaction_type} - {self.amount}"
\ No newline at end of file
+        return f"{self.user.email} - {self.wallet_type} statement ({self.status})"
@@ -1,8 +1,132 @@
 # wallets/services.py
+from decimal import Decimal
+
 from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from django.core.exceptions import ValidationError
-from .models import WalletTransaction
-from withdrawals.models import WithdrawalRequest
+from django.utils import timezone
+from .models import WalletTransaction, WalletBalance
+
+
+def ledger_key(transaction_type, reference):
+    """
+    Idempotency key for the ledger row a producer posts about `reference`
+    (submission id, withdrawal id, ...). One key = at most one row, ever.
+    """
+    return f"{transaction_type}:{reference}"
+
+
+def _ledger_balances(user_ids):
+    """{(user_id, wallet_type): running_balance of the wallet's latest ledger row}"""
+    latest = WalletTransaction.objects.filter(
+        user_id=OuterRef('user_id'),
+        wallet_type=OuterRef('wallet_type')
+    ).order_by('-created_at', '-id').values('running_balance')[:1]
+    rows = (
+        WalletTransaction.objects
+        .filter(user_id__in=user_ids)
+        .order_by()
+        .values('user_id', 'wallet_type')
+        .annotate(balance=Subquery(latest))
+        .distinct()
+    )
+    return {(r['user_id'], r['wallet_type']): r['balance'] for r in rows}
+
+
+def post_entries(entries):
+    """
+    Post many unsaved WalletTransaction instances in one DB transaction.
+
+    - Each affected WalletBalance row is locked once (in a fixed order, so concurrent
+      batches cannot deadlock), running balances are computed in memory and the rows
+      are written with a single bulk_create.
+    - Entries whose idempotency_key is already in the ledger (or repeated within the
+      batch) are skipped. The unique index on idempotency_key backs this up.
+    - Any entry that would take a wallet below zero aborts the whole batch.
+
+    Returns the list of transactions actually created, in input order.
+    """
+    entries = list(entries)
+    if not entries:
+        return []
+
+    with transaction.atomic():
+        wallet_keys = sorted({(e.user_id, e.wallet_type) for e in entries})
+
+        # Wallets without a balance row yet (first ever post) get one seeded from the ledger,
+        # all in one INSERT; a row created concurrently wins and is simply locked below
+        user_ids = {e.user_id for e in entries}
+        existing = set(
+            WalletBalance.objects
+            .filter(user_id__in=user_ids)
+            .values_list('user_id', 'wallet_type')
+        )
+        missing = [key for key in wallet_keys if key not in existing]
+        if missing:
+            seeded = _ledger_balances({user_id for user_id, _ in missing})
+            WalletBalance.objects.bulk_create(
+                [
+                    WalletBalance(user_id=user_id, wallet_type=wallet_type,
+                                  balance=seeded.get((user_id, wallet_type), Decimal('0.00')))
+                    for user_id, wallet_type in missing
+                ],
+                batch_size=1000,
+                ignore_conflicts=True
+            )
+
+        wallets = {
+            (w.user_id, w.wallet_type): w
+            for w in WalletBalance.objects.select_for_update()
+            .filter(user_id__in=user_ids)
+            .order_by('user_id', 'wallet_type')
+        }
+
+        # Checked under the wallet locks: a key always belongs to one wallet, so no
+        # competing producer can insert it between this read and our insert.
+        keys = [e.idempotency_key for e in entries if e.idempotency_key]
+        seen = set(
+            WalletTransaction.objects
+            .filter(idempotency_key__in=keys)
+            .values_list('idempotency_key', flat=True)
+        ) if keys else set()
+
+        to_create = []
+        touched = {}
+        for entry in entries:
+            if entry.pk is not None:
+                raise ValidationError("WalletTransaction is immutable after creation.")
+            if entry.idempotency_key:
+                if entry.idempotency_key in seen:
+                    continue
+                seen.add(entry.idempotency_key)
+
+            wallet = wallets[(entry.user_id, entry.wallet_type)]
+            new_balance = wallet.balance + entry._get_balance_impact()
+            if new_balance < 0:
+                raise ValidationError(
+                    f"Insufficient balance for {entry.transaction_type} on user {entry.user_id} {entry.wallet_type} wallet."
+                )
+            wallet.balance = new_balance
+            entry.running_balance = new_balance
+            to_create.append(entry)
+            touched[(entry.user_id, entry.wallet_type)] = entry
+
+        if not to_create:
+            return []
+
+        WalletTransaction.objects.bulk_create(to_create, batch_size=1000)
+
+        now = timezone.now()
+        for key, last_entry in touched.items():
+            wallets[key].last_transaction = last_entry
+            wallets[key].updated_at = now
+        WalletBalance.objects.bulk_update(
+            [wallets[key] for key in touched],
+            ['balance', 'last_transaction', 'updated_at'],
+            batch_size=1000
+        )
+
+        return to_create
 
 
 def reverse_completed_withdrawal(withdrawal_request, reversed_by_user, reason=""):
@@ -12,56 +136,47 @@ def reverse_completed_withdrawal(withdrawal_request, reversed_by_user, reason=""
     if withdrawal_request.status != 'completed':
         raise ValidationError("Only completed withdrawals can be reversed.")
 
-    # Prevent double-reversal
-    if WalletTransaction.objects.filter(
+    # Prevent double-reversal: the reversal key can only be posted once
+    created = post_entries([WalletTransaction(
+        user=withdrawal_request.user,
+        wallet_type=withdrawal_request.wallet_type,
+        transaction_type='withdrawal_reversal',
+        amount=withdrawal_request.amount,
+        description=(
+            f"Reversal of withdrawal {withdrawal_request.reference_code}. "
+            f"Reason: {reason or 'Admin request'}. "
+            f"Reversed by: {reversed_by_user.email}"
+        ),
         linked_withdrawal=withdrawal_request,
-        transaction_type='withdrawal_reversal'
-    ).exists():
+        idempotency_key=ledger_key('withdrawal_reversal', withdrawal_request.id)
+    )])
+    if not created:
         raise ValidationError("This withdrawal has already been reversed.")
-
-    with transaction.atomic():
-        reversal_tx = WalletTransaction.objects.create(
-            user=withdrawal_request.user,
-            wallet_type=withdrawal_request.wallet_type,
-            transaction_type='withdrawal_reversal',
-            amount=withdrawal_request.amount,
-            description=(
-                f"Reversal of withdrawal {withdrawal_request.reference_code}. "
-                f"Reason: {reason or 'Admin request'}. "
-                f"Reversed by: {reversed_by_user.email}"
-            ),
-            linked_withdrawal=withdrawal_request
-        )
-        return reversal_tx
+    return created[0]
 
 
 def reverse_pending_withdrawal(withdrawal_request, reason=""):
     """
-    Reverses a pending (or needs_review) withdrawal by crediting the wallet.
+    Fails a pending (or needs_review) withdrawal and credits the wallet back, atomically.
     Used when Daraja fails, times out, or ops cancel a pending request.
+    The status move is a conditional UPDATE, so of two concurrent callers only one reverses.
     """
-    if withdrawal_request.status not in ['pending', 'needs_review']:
-        raise ValidationError("Only pending or needs_review withdrawals can be reversed.")
+    from withdrawals.models import WithdrawalRequest
 
-    # Find the pending transaction
-    try:
-        pending_tx = WalletTransaction.objects.get(
-            linked_withdrawal=withdrawal_request,
-            transaction_type='withdrawal_pending'
-        )
-    except WalletTransaction.DoesNotExist:
-        raise ValidationError("No pending transaction found to reverse.")
-
-    # Check if already reversed (idempotency)
-    if WalletTransaction.objects.filter(
-        linked_withdrawal=withdrawal_request,
-        transaction_type='withdrawal_reversal'
+    # Make sure there is a pending debit to give back
+    if not WalletTransaction.objects.filter(
+        idempotency_key=ledger_key('withdrawal_pending', withdrawal_request.id)
     ).exists():
-        raise ValidationError("This withdrawal has already been reversed.")
+        raise ValidationError("No pending transaction found to reverse.")
 
     with transaction.atomic():
-        # Create reversal transaction
-        reversal_tx = WalletTransaction.objects.create(
+        if not WithdrawalRequest.transition(withdrawal_request.id, ['pending', 'needs_review'], 'failed'):
+            raise ValidationError("Only pending or needs_review withdrawals can be reversed.")
+        withdrawal_request.status = 'failed'
+        withdrawal_request.processed_at = None
+
+        # Idempotency: a second reversal of the same withdrawal is skipped by post_entries
+        created = post_entries([WalletTransaction(
             user=withdrawal_request.user,
             wallet_type=withdrawal_request.wallet_type,
             transaction_type='withdrawal_reversal',
@@ -70,11 +185,10 @@ def reverse_pending_withdrawal(withdrawal_request, reason=""):
                 f"Reversal of failed/timeout withdrawal {withdrawal_request.reference_code}. "
                 f"Reason: {reason or 'Daraja failure'}"
             ),
-            linked_withdrawal=withdrawal_request
-        )
-
-        # Optionally update withdrawal status to 'reversed' (optional — current status is fine)
-        # withdrawal_request.status = 'reversed'
-        # withdrawal_request.save(update_fields=['status'])
+            linked_withdrawal=withdrawal_request,
+            idempotency_key=ledger_key('withdrawal_reversal', withdrawal_request.id)
+        )])
+        if not created:
+            raise ValidationError("This withdrawal has already been reversed.")
 
-        return reversal_tx
\ No newline at end of file
+    return created[0]
@@ -0,0 +1,122 @@
+# wallets/statements.py
+import logging
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import StatementJob, WalletBalance
+
+logger = logging.getLogger(__name__)
+
+# A job still 'running' after this long is assumed to belong to a dead worker
+STALE_AFTER = timedelta(minutes=10)
+MAX_ATTEMPTS = 3
+
+
+def ledger_high_water_mark(user, wallet_type):
+    """Id of the newest ledger row in the wallet (0 for an empty wallet)."""
+    return WalletBalance.objects.filter(
+        user=user,
+        wallet_type=wallet_type
+    ).values_list('last_transaction_id', flat=True).first() or 0
+
+
+def request_statement(user, wallet_type='main', start_date=None, end_date=None, delivery='download'):
+    """
+    Return a StatementJob for this statement, queuing one only when needed.
+
+    - download: a finished PDF for the same period and ledger state is returned as-is;
+      an identical job already in the queue is reused.
+    - email: always a new job (each request sends an email), but it points at the
+      cached PDF when there is one so the worker only has to encrypt and send.
+    """
+    key = {
+        'user': user,
+        'wallet_type': wallet_type,
+        'start_date': start_date,
+        'end_date': end_date,
+        'ledger_high_water_mark': ledger_high_water_mark(user, wallet_type),
+    }
+
+    cached = StatementJob.objects.filter(
+        status='done', **key
+    ).exclude(pdf='').order_by('-finished_at').first()
+
+    if delivery == 'email':
+        return StatementJob.objects.create(delivery='email', pdf=cached.pdf.name if cached else '', **key)
+
+    if cached:
+        return cached
+
+    in_flight = StatementJob.objects.filter(
+        delivery='download',
+        status__in=['queued', 'running'],
+        **key
+    ).first()
+    return in_flight or StatementJob.objects.create(delivery='download', **key)
+
+
+def claim_next_job():
+    """Lock and mark the oldest runnable job as running. Safe with several workers."""
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            StatementJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(Q(status='queued') | Q(status='running', started_at__lt=now - STALE_AFTER))
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.started_at = now
+        job.attempts += 1
+        job.save(update_fields=['status', 'started_at', 'attempts'])
+        return job
+
+
+def run_statement_job(job):
+    """Render (unless cached) and deliver one claimed job. Failures are retried up to MAX_ATTEMPTS."""
+    try:
+        if not job.pdf:
+            # Lazy import: WeasyPrint is only needed in the worker process
+            from .utils import render_statement_pdf
+
+            pdf_bytes = render_statement_pdf(job.user, job.wallet_type, job.start_date, job.end_date)
+            job.pdf.save(f"{job.user_id}_{job.wallet_type}_{job.id}.pdf", ContentFile(pdf_bytes), save=False)
+        else:
+            with job.pdf.open('rb') as f:
+                pdf_bytes = f.read()
+
+        if job.delivery == 'email':
+            from users.utils import send_statement_email
+
+            sent = send_statement_email(
+                user=job.user,
+                wallet_type=job.wallet_type,
+                start_date=job.start_date,
+                end_date=job.end_date,
+                pdf_bytes=pdf_bytes
+            )
+            if sent is False:
+                raise RuntimeError("Statement email could not be sent")
+
+        job.status = 'done'
+        job.error = ''
+        job.finished_at = timezone.now()
+        job.save(update_fields=['pdf', 'status', 'error', 'finished_at'])
+        logger.info(f"✅ Statement job {job.id} done ({job.delivery}) for {job.user.email}")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Statement job {job.id} failed (attempt {job.attempts}): {e}", exc_info=True)
+        job.status = 'failed' if job.attempts >= MAX_ATTEMPTS else 'queued'
+        job.error = str(e)
+        job.finished_at = timezone.now() if job.status == 'failed' else None
+        job.save(update_fields=['pdf', 'status', 'error', 'finished_at'])
+        return False
@@ -1,3 +1,43 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import CommandError, call_command
 from django.test import TestCase
 
-# Create your tests here.
+from users.models import User
+
+from .models import WalletBalance, WalletTransaction
+from .services import post_entries
+
+
+class RebuildWalletBalancesTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='wallet@example.com', referral_code='WALLET01')
+        post_entries([
+            WalletTransaction(user=self.user, wallet_type='main', transaction_type='survey_earning', amount=Decimal('50.00')),
+            WalletTransaction(user=self.user, wallet_type='main', transaction_type='survey_earning', amount=Decimal('25.00')),
+        ])
+
+    def _balance(self):
+        return WalletBalance.objects.get(user=self.user, wallet_type='main').balance
+
+    def test_check_passes_when_balances_match(self):
+        out = StringIO()
+        call_command('rebuild_wallet_balances', '--check', stdout=out)
+        self.assertIn('matches the ledger', out.getvalue())
+
+    def test_check_reports_drift_as_a_command_error(self):
+        WalletBalance.objects.filter(user=self.user).update(balance=Decimal('999.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_wallet_balances', '--check', stdout=StringIO())
+        self.assertEqual(self._balance(), Decimal('999.00'))  # --check never writes
+
+    def test_rebuild_repairs_drift(self):
+        WalletBalance.objects.filter(user=self.user).update(balance=Decimal('999.00'))
+
+        call_command('rebuild_wallet_balances', stdout=StringIO())
+
+        self.assertEqual(self._balance(), Decimal('75.00'))
+        call_command('rebuild_wallet_balances', '--check', stdout=StringIO())
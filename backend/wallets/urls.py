@@ -6,4 +6,6 @@ urlpatterns = [
     path('transactions/', views.WalletTransactionsView.as_view(), name='wallet-transactions'),
     path('statement/', views.WalletStatementPDFView.as_view(), name='wallet-statement-pdf'),
     path('statement/email/', views.EmailStatementView.as_view(), name='wallet-statement-email'),
+    path('statement/jobs/<int:job_id>/', views.StatementJobView.as_view(), name='wallet-statement-job'),
+    path('statement/jobs/<int:job_id>/download/', views.StatementDownloadView.as_view(), name='wallet-statement-download'),
 ]
\ No newline at end of file
@@ -3,15 +3,14 @@ from decimal import Decimal
 from datetime import datetime, timezone
 from django.db import transaction as db_transaction
 from django.template.loader import render_to_string
-from weasyprint import HTML
-from weasyprint.text.fonts import FontConfiguration
 from io import BytesIO
-from .models import WalletTransaction
+from earn_backend.rendering import render_service, html_to_pdf
+from .models import WalletTransaction, WalletBalance
 
 
-def create_transaction(user, wallet_type, transaction_type, amount, description='', source='system', status='pending'):
+def create_transaction(user, wallet_type, transaction_type, amount, description='', linked_withdrawal=None):
     """
-    Create a wallet transaction (pending or completed).
+    Post a wallet transaction.
     For debits (withdrawal, activation), ensures sufficient balance.
     """
     amount = Decimal(str(amount))
@@ -19,47 +18,32 @@ def create_transaction(user, wallet_type, transaction_type, amount, description=
         raise ValueError("Amount must be a positive number.")
 
     with db_transaction.atomic():
-        # Lock the latest completed transaction to prevent race conditions
-        last_tx = WalletTransaction.objects.filter(
-            user=user,
-            wallet_type=wallet_type,
-            status='completed'
-        ).select_for_update().order_by('-created_at', '-id').first()
-
-        current_balance = last_tx.running_balance if last_tx else Decimal('0.00')
+        # Lock the wallet's balance row to prevent race conditions
+        wallet = WalletBalance.objects.lock(user, wallet_type)
 
         # Enforce balance check for debit transactions
         if transaction_type in ['withdrawal', 'activation_payment']:
-            if amount > current_balance:
+            if amount > wallet.balance:
                 raise ValueError("Insufficient balance.")
 
-        # For pending transactions, running_balance remains unchanged
-        running_balance = current_balance
-
         return WalletTransaction.objects.create(
             user=user,
             wallet_type=wallet_type,
             transaction_type=transaction_type,
-            source=source,
             amount=amount,
-            running_balance=running_balance,
-            status=status,
-            description=description
+            description=description,
+            linked_withdrawal=linked_withdrawal
         )
 
 
 # wallets/utils.py — UPDATED generate_statement_pdf
 
-def generate_statement_pdf(user, wallet_type='main', start_date=None, end_date=None, password=None):
+def render_statement_pdf(user, wallet_type='main', start_date=None, end_date=None):
     """
-    Generate a branded PDF account statement.
-    If password is provided, the PDF will be encrypted.
+    Render a branded PDF account statement and return the raw PDF bytes.
+    Layout runs on the shared render pool; call it from the statement worker, not a request.
     """
     from django.utils.dateparse import parse_date
-    from weasyprint import HTML
-    from weasyprint.text.fonts import FontConfiguration
-    from io import BytesIO
-    from pypdf import PdfWriter, PdfReader
 
     # Handle date parsing
     if isinstance(start_date, str):
@@ -70,23 +54,25 @@ def generate_statement_pdf(user, wallet_type='main', start_date=None, end_date=N
     # Fetch transactions...
     transactions_qs = WalletTransaction.objects.filter(
         user=user,
-        wallet_type=wallet_type,
-        status='completed'
-    ).order_by('created_at')
+        wallet_type=wallet_type
+    ).order_by('created_at', 'id')
 
     if start_date:
         transactions_qs = transactions_qs.filter(created_at__date__gte=start_date)
     if end_date:
         transactions_qs = transactions_qs.filter(created_at__date__lte=end_date)
 
-    transactions = list(transactions_qs)
+    transactions = []
+    for tx in transactions_qs:
+        # Match model's _get_balance_impact(): only these reduce balance
+        tx.is_debit = tx.transaction_type in WalletTransaction.DEBIT_TYPES
+        transactions.append(tx)
 
     if transactions:
         first_tx = transactions[0]
         prior_tx = WalletTransaction.objects.filter(
             user=user,
             wallet_type=wallet_type,
-            status='completed',
             created_at__lt=first_tx.created_at
         ).order_by('-created_at', '-id').first()
         opening_balance = prior_tx.running_balance if prior_tx else Decimal('0.00')
@@ -119,31 +105,50 @@ def generate_statement_pdf(user, wallet_type='main', start_date=None, end_date=N
         'end_date_display': end_date_display,
     })
 
-    # Generate PDF bytes
-    font_config = FontConfiguration()
-    pdf_bytes = HTML(string=html_string).write_pdf(
-        font_config=font_config,
-        presentational_hints=True,
+    # Generate PDF bytes on a warm render worker (stylesheet is compiled once per worker)
+    return render_service.run(
+        html_to_pdf,
+        html_string,
+        stylesheet=render_to_string('wallet/statement.css'),
         metadata={
             'title': f'Qezzy {wallet_type.title()} Wallet Statement',
             'author': 'Qezzy Kenya',
+            'subject': f'Account statement for {user_full_name}',
+            'keywords': 'qezzy,kenya,statement,wallet,finance',
+            'creator': 'Qezzy Backend System',
+            'producer': 'WeasyPrint + Django',
         }
     )
 
-    # 🔒 Apply password protection if requested
-    if password:
-        reader = PdfReader(BytesIO(pdf_bytes))
-        writer = PdfWriter()
 
-        for page in reader.pages:
-            writer.add_page(page)
+def encrypt_pdf(pdf_bytes, password):
+    """🔒 Return a BytesIO holding a password-protected copy of pdf_bytes."""
+    from pypdf import PdfWriter, PdfReader
+
+    reader = PdfReader(BytesIO(pdf_bytes))
+    writer = PdfWriter()
 
-        writer.encrypt(password)
+    for page in reader.pages:
+        writer.add_page(page)
 
-        encrypted_buffer = BytesIO()
-        writer.write(encrypted_buffer)
-        encrypted_buffer.seek(0)
-        return encrypted_buffer
+    writer.encrypt(password)
+
+    encrypted_buffer = BytesIO()
+    writer.write(encrypted_buffer)
+    encrypted_buffer.seek(0)
+    return encrypted_buffer
+
+
+def generate_statement_pdf(user, wallet_type='main', start_date=None, end_date=None, password=None):
+    """
+    Generate a branded PDF account statement.
+    If password is provided, the PDF will be encrypted.
+    """
+    pdf_bytes = render_statement_pdf(user, wallet_type, start_date, end_date)
+
+    # 🔒 Apply password protection if requested
+    if password:
+        return encrypt_pdf(pdf_bytes, password)
 
     # Return unencrypted PDF
-    return BytesIO(pdf_bytes)
\ No newline at end of file
+    return BytesIO(pdf_bytes)
@@ -1,16 +1,19 @@
 # wallets/views.py
-from decimal import Decimal
-from datetime import datetime, timezone
-from django.http import HttpResponse
-from django.template.loader import render_to_string
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.utils.dateparse import parse_date
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from weasyprint import HTML
-from weasyprint.text.fonts import FontConfiguration
-from .models import WalletTransaction
-from users.utils import send_statement_email
+from .models import WalletTransaction, WalletBalance, StatementJob
+from .statements import request_statement
 
 
 class WalletOverviewView(APIView):
@@ -19,174 +22,273 @@ class WalletOverviewView(APIView):
     def get(self, request):
         user = request.user
 
-        # Get latest transaction for each wallet (all are valid)
-        main_tx = WalletTransaction.objects.filter(user=user, wallet_type='main').order_by('-created_at').first()
-        main_balance = main_tx.running_balance if main_tx else Decimal('0.00')
-
-        referral_tx = WalletTransaction.objects.filter(user=user, wallet_type='referral').order_by('-created_at').first()
-        referral_balance = referral_tx.running_balance if referral_tx else Decimal('0.00')
+        # Materialized balances: one indexed lookup regardless of ledger length
+        balances = WalletBalance.objects.balances_for(user)
 
         return Response({
-            'main_wallet_balance': float(main_balance),
-            'referral_wallet_balance': float(referral_balance),
+            'main_wallet_balance': float(balances['main']),
+            'referral_wallet_balance': float(balances['referral']),
         })
 
 
+# ========================
+# TRANSACTION HISTORY
+# ========================
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+EXPORT_CHUNK_SIZE = 2000
+HISTORY_FIELDS = [
+    'id', 'wallet_type', 'transaction_type', 'amount',
+    'running_balance', 'description', 'created_at'
+]
+
+
+def encode_cursor(created_at, tx_id):
+    """Opaque cursor pointing just past the row (created_at, id)."""
+    raw = f"{created_at.isoformat()}|{tx_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor. Raises ValueError on anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, tx_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(tx_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _history_queryset(user, wallet_type):
+    return WalletTransaction.objects.filter(
+        user=user,
+        wallet_type=wallet_type
+    ).exclude(
+        transaction_type='withdrawal_pending'
+    )
+
+
+def _after_cursor(qs, position, descending=False):
+    """Keyset filter on (created_at, id) — served by wtx_wallet_history_idx, no OFFSET scans."""
+    ordering = ('-created_at', '-id') if descending else ('created_at', 'id')
+    if position:
+        created_at, tx_id = position
+        if descending:
+            qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=tx_id))
+        else:
+            qs = qs.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=tx_id))
+    return qs.order_by(*ordering)
+
+
+def _serialize_tx(row):
+    # Debits: withdrawal, withdrawal_pending (reduce wallet balance), matching _get_balance_impact()
+    # Credits: everything else (survey_earning, referral_bonus, activation_payment, etc.)
+    return {
+        'id': row['id'],
+        'wallet_type': row['wallet_type'],
+        'transaction_type': row['transaction_type'],
+        'amount': float(row['amount']),
+        'running_balance': float(row['running_balance']),
+        'is_debit': row['transaction_type'] in WalletTransaction.DEBIT_TYPES,
+        'description': row['description'],
+        'created_at': row['created_at'].isoformat()
+    }
+
+
+def _fetch_chunk(qs, position):
+    return list(_after_cursor(qs, position).values(*HISTORY_FIELDS)[:EXPORT_CHUNK_SIZE])
+
+
+async def _stream_export(qs, export_format):
+    """
+    Yield the whole history as NDJSON or CSV, EXPORT_CHUNK_SIZE rows at a time.
+    Async so Daphne streams it instead of buffering the full body.
+    """
+    if export_format == 'csv':
+        yield 'id,created_at,transaction_type,is_debit,amount,running_balance,description\r\n'
+
+    position = None
+    while True:
+        rows = await sync_to_async(_fetch_chunk)(qs, position)
+
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow([
+                    row['id'],
+                    row['created_at'].isoformat(),
+                    row['transaction_type'],
+                    row['transaction_type'] in WalletTransaction.DEBIT_TYPES,
+                    row['amount'],
+                    row['running_balance'],
+                    row['description'],
+                ])
+            chunk = buffer.getvalue()
+        else:
+            chunk = ''.join(json.dumps(_serialize_tx(row)) + '\n' for row in rows)
+
+        if chunk:
+            yield chunk
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            break
+        position = (rows[-1]['created_at'], rows[-1]['id'])
+
+
 class WalletTransactionsView(APIView):
+    """
+    GET ?wallet=main|referral
+      - with ?limit= and/or ?cursor= (and optional ?order=desc): one keyset page,
+        {"results": [...], "next_cursor": "..."|null}
+      - with ?export=ndjson|csv: streams the full history as a download
+      - with neither: the full history as a plain list (kept for existing clients)
+    """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         user = request.user
-        wallet_type = request.query_params.get('wallet', 'main')
+        params = request.query_params
+        wallet_type = params.get('wallet', 'main')
 
         if wallet_type not in ['main', 'referral']:
             return Response({'error': 'Invalid wallet type'}, status=400)
 
         # ✅ NO MORE status filter — all transactions are valid facts
-        transactions = WalletTransaction.objects.filter(
-            user=user,
-            wallet_type=wallet_type
-        ).exclude(
-            transaction_type='withdrawal_pending'
-        ).order_by('created_at', 'id')
-
-        data = []
-        for tx in transactions:
-            # ✅ Add is_debit flag matching model's _get_balance_impact() logic
-            # Debits: withdrawal, withdrawal_pending (reduce wallet balance)
-            # Credits: everything else (task_earning, referral_bonus, activation_payment, etc.)
-            is_debit = tx.transaction_type in ['withdrawal', 'withdrawal_pending']
-            
-            data.append({
-                'id': tx.id,
-                'wallet_type': tx.wallet_type,
-                'transaction_type': tx.transaction_type,
-                'amount': float(tx.amount),
-                'running_balance': float(tx.running_balance),
-                'is_debit': is_debit,  # ← NEW: explicit debit/credit flag
-                'description': tx.description,
-                'created_at': tx.created_at.isoformat()
-            })
-
-        return Response(data)
+        transactions = _history_queryset(user, wallet_type)
+
+        export_format = params.get('export')
+        if export_format:
+            if export_format not in ['ndjson', 'csv']:
+                return Response({'error': 'Invalid export format. Use ndjson or csv.'}, status=400)
+            content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+            response = StreamingHttpResponse(_stream_export(transactions, export_format), content_type=content_type)
+            response['Content-Disposition'] = (
+                f'attachment; filename="Qezzy_{wallet_type}_transactions.{export_format}"'
+            )
+            return response
+
+        if 'cursor' not in params and 'limit' not in params:
+            rows = _after_cursor(transactions, None).values(*HISTORY_FIELDS)
+            return Response([_serialize_tx(row) for row in rows])
+
+        try:
+            limit = min(max(int(params.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=400)
+
+        position = None
+        if params.get('cursor'):
+            try:
+                position = decode_cursor(params['cursor'])
+            except ValueError:
+                return Response({'error': 'Invalid cursor'}, status=400)
+
+        descending = params.get('order') == 'desc'
+        rows = list(_after_cursor(transactions, position, descending).values(*HISTORY_FIELDS)[:limit + 1])
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+        return Response({
+            'results': [_serialize_tx(row) for row in rows],
+            'next_cursor': next_cursor,
+        })
+
+
+# ========================
+# STATEMENTS (rendered by: python manage.py process_statement_jobs)
+# ========================
+
+def _parse_statement_request(data):
+    """Return (wallet_type, start_date, end_date) or raise ValueError with a user-facing message."""
+    wallet_type = data.get('wallet', 'main')
+    if wallet_type not in ['main', 'referral']:
+        raise ValueError('Invalid wallet type')
+
+    start_date_str = data.get('start_date')
+    end_date_str = data.get('end_date')
+    start_date = parse_date(start_date_str) if start_date_str else None
+    end_date = parse_date(end_date_str) if end_date_str else None
+    if (start_date_str and not start_date) or (end_date_str and not end_date):
+        raise ValueError('Dates must be in YYYY-MM-DD format')
+    return wallet_type, start_date, end_date
+
+
+def _job_payload(job):
+    data = {
+        'job_id': job.id,
+        'status': job.status,
+        'delivery': job.delivery,
+        'status_url': reverse('wallet-statement-job', args=[job.id]),
+    }
+    if job.status == 'done' and job.delivery == 'download':
+        data['download_url'] = reverse('wallet-statement-download', args=[job.id])
+    if job.status == 'failed':
+        data['error'] = 'Failed to generate statement. Please try again.'
+    return data
+
+
+def _statement_file_response(job):
+    filename = f"Qezzy_{job.wallet_type}_statement_{job.created_at.strftime('%Y%m%d')}.pdf"
+    return FileResponse(job.pdf.open('rb'), as_attachment=True, filename=filename, content_type='application/pdf')
 
 
 class WalletStatementPDFView(APIView):
+    """
+    GET ?wallet=&start_date=&end_date=
+    Serves the PDF straight away when this statement is already cached, otherwise
+    queues it and answers 202 with a job to poll.
+    """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user = request.user
-        wallet_type = request.query_params.get('wallet', 'main')
-        if wallet_type not in ['main', 'referral']:
-            return Response({'error': 'Invalid wallet type'}, status=400)
+        try:
+            wallet_type, start_date, end_date = _parse_statement_request(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+        job = request_statement(request.user, wallet_type, start_date, end_date, delivery='download')
+        if job.status == 'done':
+            return _statement_file_response(job)
+        return Response(_job_payload(job), status=202)
 
-        start_date_str = request.query_params.get('start_date')
-        end_date_str = request.query_params.get('end_date')
-
-        # ✅ Remove status='completed' filter
-        transactions_qs = WalletTransaction.objects.filter(
-            user=user,
-            wallet_type=wallet_type
-        ).order_by('created_at')
-
-        start_date = parse_date(start_date_str) if start_date_str else None
-        end_date = parse_date(end_date_str) if end_date_str else None
-
-        if start_date:
-            transactions_qs = transactions_qs.filter(created_at__date__gte=start_date)
-        if end_date:
-            transactions_qs = transactions_qs.filter(created_at__date__lte=end_date)
-
-        # ✅ Build transactions list with is_debit flag for template
-        transactions = []
-        for tx in transactions_qs:
-            # Match model's _get_balance_impact(): only these reduce balance
-            tx.is_debit = tx.transaction_type in ['withdrawal', 'withdrawal_pending']
-            transactions.append(tx)
-
-        if transactions:
-            first_tx = transactions[0]
-            prior_tx = WalletTransaction.objects.filter(
-                user=user,
-                wallet_type=wallet_type,
-                created_at__lt=first_tx.created_at
-            ).order_by('-created_at', '-id').first()
-
-            opening_balance = prior_tx.running_balance if prior_tx else Decimal('0.00')
-            closing_balance = transactions[-1].running_balance
-        else:
-            opening_balance = Decimal('0.00')
-            closing_balance = Decimal('0.00')
-
-        # ... rest of PDF logic unchanged ...
-        first_name = getattr(user, 'first_name', '') or ''
-        last_name = getattr(user, 'last_name', '') or ''
-        user_full_name = f"{first_name} {last_name}".strip()
-        if not user_full_name:
-            user_full_name = user.email
-
-        now_utc = datetime.now(timezone.utc)
-        statement_date = now_utc.strftime("%d %b %Y")
-        start_date_display = start_date.strftime("%d %b %Y") if start_date else None
-        end_date_display = end_date.strftime("%d %b %Y") if end_date else None
-
-        html_string = render_to_string('wallet/statement.html', {
-            'user': user,
-            'user_full_name': user_full_name,
-            'wallet_type': wallet_type,
-            'opening_balance': opening_balance,
-            'closing_balance': closing_balance,
-            'transactions': transactions,  # ← Now includes is_debit attribute
-            'statement_date': statement_date,
-            'start_date_display': start_date_display,
-            'end_date_display': end_date_display,
-        })
 
-        font_config = FontConfiguration()
-        html = HTML(string=html_string)
-        pdf_file = html.write_pdf(
-            stylesheets=[],
-            font_config=font_config,
-            presentational_hints=True,
-            metadata={
-                'title': f'Qezzy {wallet_type.title()} Wallet Statement',
-                'author': 'Qezzy Kenya',
-                'subject': f'Account statement for {user_full_name}',
-                'keywords': 'qezzy,kenya,statement,wallet,finance',
-                'creator': 'Qezzy Backend System',
-                'producer': 'WeasyPrint + Django',
-            }
-        )
-
-        filename = f"Qezzy_{wallet_type}_statement_{now_utc.strftime('%Y%m%d')}.pdf"
-        response = HttpResponse(pdf_file, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
+class StatementJobView(APIView):
+    permission_classes = [IsAuthenticated]
 
+    def get(self, request, job_id):
+        job = StatementJob.objects.filter(id=job_id, user=request.user).first()
+        if not job:
+            return Response({'error': 'Statement job not found'}, status=404)
+        return Response(_job_payload(job))
 
-class EmailStatementView(APIView):
+
+class StatementDownloadView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def post(self, request):
-        user = request.user
-        wallet_type = request.data.get('wallet', 'main')
-        start_date_str = request.data.get('start_date')
-        end_date_str = request.data.get('end_date')
+    def get(self, request, job_id):
+        job = StatementJob.objects.filter(id=job_id, user=request.user, delivery='download').first()
+        if not job:
+            return Response({'error': 'Statement job not found'}, status=404)
+        if job.status != 'done' or not job.pdf:
+            return Response(_job_payload(job), status=409)
+        return _statement_file_response(job)
 
-        if wallet_type not in ['main', 'referral']:
-            return Response({'error': 'Invalid wallet type'}, status=400)
 
-        from django.utils.dateparse import parse_date
-        start_date = parse_date(start_date_str) if start_date_str else None
-        end_date = parse_date(end_date_str) if end_date_str else None
+class EmailStatementView(APIView):
+    permission_classes = [IsAuthenticated]
 
+    def post(self, request):
         try:
-            send_statement_email(
-                user=user,
-                wallet_type=wallet_type,
-                start_date=start_date,
-                end_date=end_date
-            )
-            return Response({'message': 'Statement emailed successfully.'})
-        except Exception as e:
-            return Response({'error': 'Failed to send statement. Please try again.'}, status=500)
\ No newline at end of file
+            wallet_type, start_date, end_date = _parse_statement_request(request.data)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+        job = request_statement(request.user, wallet_type, start_date, end_date, delivery='email')
+        return Response({
+            'message': 'Your statement is being prepared and will be emailed shortly.',
+            **_job_payload(job),
+        }, status=202)
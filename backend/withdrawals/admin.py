@@ -2,10 +2,9 @@
 from django.contrib import admin
 from django.db import transaction as db_transaction
 from django.contrib import messages
-from django.utils import timezone
 from django.core.exceptions import ValidationError
-from .models import WithdrawalRequest, SystemSetting
-from wallets.services import reverse_completed_withdrawal
+from .models import WithdrawalRequest, SystemSetting, ProcessedCallback, CallbackInbox
+from wallets.services import reverse_completed_withdrawal, ledger_key, post_entries
 from .utils import notify_user_withdrawal_completed
 import logging
 
@@ -41,34 +40,37 @@ class WithdrawalRequestAdmin(admin.ModelAdmin):
     search_fields = ['user__email', 'reference_code']
     list_editable = ['status']
     ordering = ['-created_at']
-    actions = ['reverse_withdrawal']
+    actions = ['reverse_withdrawal', 'requeue_payouts']
 
     def is_reversed(self, obj):
         from wallets.models import WalletTransaction
         return WalletTransaction.objects.filter(
-            linked_withdrawal=obj,
-            transaction_type='withdrawal_reversal'
+            idempotency_key=ledger_key('withdrawal_reversal', obj.id)
         ).exists()
     is_reversed.boolean = True
     is_reversed.short_description = 'Reversed?'
 
+    dispatch_fields = [
+        'next_dispatch_at', 'dispatch_attempts', 'dispatch_locked_at', 'dispatched_at', 'last_dispatch_error',
+        'daraja_conversation_id', 'originator_conversation_id',
+    ]
+
     def get_readonly_fields(self, request, obj=None):
         if obj and obj.status in ['completed', 'failed']:
-            return ['status']  # Lock status after finalization
-        return []
+            return ['status'] + self.dispatch_fields  # Lock status after finalization
+        return self.dispatch_fields
 
     def save_model(self, request, obj, form, change):
         if not change:
             super().save_model(request, obj, form, change)
             return
 
-        # Fetch original to check status transition
-        original = WithdrawalRequest.objects.get(pk=obj.pk)
-        old_status = original.status
+        # Status as loaded for this form (no second read)
+        old_status = getattr(obj, '_loaded_status', None) or obj.status
         new_status = obj.status
 
         if old_status == new_status:
-            super().save_model(request, obj, form, change)
+            self._save_edited_fields(obj, form)
             return
 
         # Enforce: only pending → completed/failed allowed
@@ -80,53 +82,48 @@ class WithdrawalRequestAdmin(admin.ModelAdmin):
             messages.error(request, "Invalid status transition.")
             return
 
-        # Save the updated status
-        super().save_model(request, obj, form, change)
-
-        # Auto-set processed_at on completion
-        if new_status == 'completed' and not obj.processed_at:
-            obj.processed_at = timezone.now()
-            obj.save(update_fields=['processed_at'])
+        # Claim the status change with one conditional UPDATE (also sets processed_at);
+        # a Daraja callback may have finalized the withdrawal since the page was loaded
+        if not WithdrawalRequest.transition(obj.pk, ['pending'], new_status):
+            messages.error(request, "This withdrawal was updated by another process. Reload and try again.")
+            return
+        obj.refresh_from_db(fields=['status', 'processed_at'])
+        self._save_edited_fields(obj, form)
 
         # 🔑 WALLET DEBIT LOGIC FOR COMPLETED WITHDRAWALS (BANK OR MPESA)
         if new_status == 'completed':
             from wallets.models import WalletTransaction
             
-            # IDEMPOTENCY CHECK: Prevent duplicate debits if admin clicks twice
-            existing_tx = WalletTransaction.objects.filter(
-                linked_withdrawal=obj,
-                transaction_type='withdrawal'
-            ).exists()
-            
-            if not existing_tx:
-                try:
-                    # ATTEMPT WALLET DEBIT
-                    WalletTransaction.objects.create(
-                        user=obj.user,
-                        wallet_type=obj.wallet_type,
-                        transaction_type='withdrawal',
-                        amount=obj.amount,
-                        description=f"Withdrawal approved via admin. Method: {obj.method}. Ref: {obj.reference_code or obj.id}",
-                        linked_withdrawal=obj
-                    )
+            try:
+                # ATTEMPT WALLET DEBIT (idempotent: skipped if admin clicks twice)
+                created = post_entries([WalletTransaction(
+                    user=obj.user,
+                    wallet_type=obj.wallet_type,
+                    transaction_type='withdrawal',
+                    amount=obj.amount,
+                    description=f"Withdrawal approved via admin. Method: {obj.method}. Ref: {obj.reference_code or obj.id}",
+                    linked_withdrawal=obj,
+                    idempotency_key=ledger_key('withdrawal', obj.id)
+                )])
+                if created:
                     logger.info(f"Wallet debited for withdrawal {obj.id} (admin approval)")
-                except Exception as e:
-                    # 🚨 CRITICAL ALERT: Admin approved but wallet not debited
-                    error_details = (
-                        f"User: {obj.user.email} | Withdrawal ID: {obj.id} | "
-                        f"Amount: {obj.amount} | Method: {obj.method} | "
-                        f"Error: {str(e)}"
-                    )
-                    logger.critical(
-                        f"🚨 ADMIN-APPROVED WITHDRAWAL WALLET DEBIT FAILED! {error_details} | "
-                        f"ACTION REQUIRED: Manually debit wallet immediately."
-                    )
-                    messages.error(
-                        request,
-                        f"⚠️ APPROVED BUT WALLET DEBIT FAILED! Contact tech team NOW. Details logged. {str(e)}"
-                    )
-            else:
-                logger.info(f"Wallet transaction already exists for withdrawal {obj.id} (idempotency)")
+                else:
+                    logger.info(f"Wallet transaction already exists for withdrawal {obj.id} (idempotency)")
+            except Exception as e:
+                # 🚨 CRITICAL ALERT: Admin approved but wallet not debited
+                error_details = (
+                    f"User: {obj.user.email} | Withdrawal ID: {obj.id} | "
+                    f"Amount: {obj.amount} | Method: {obj.method} | "
+                    f"Error: {str(e)}"
+                )
+                logger.critical(
+                    f"🚨 ADMIN-APPROVED WITHDRAWAL WALLET DEBIT FAILED! {error_details} | "
+                    f"ACTION REQUIRED: Manually debit wallet immediately."
+                )
+                messages.error(
+                    request,
+                    f"⚠️ APPROVED BUT WALLET DEBIT FAILED! Contact tech team NOW. Details logged. {str(e)}"
+                )
 
             # SEND NOTIFICATION AFTER WALLET ATTEMPT (user should know status regardless of debit success)
             try:
@@ -134,6 +131,15 @@ class WithdrawalRequestAdmin(admin.ModelAdmin):
             except Exception as e:
                 logger.warning(f"Failed to notify user for withdrawal {obj.id}: {e}")
 
+    def _save_edited_fields(self, obj, form):
+        """
+        Write only what the admin changed on the form. The page may be stale: the dispatcher
+        or a callback can have sent or settled the payout since it was loaded.
+        """
+        edited = [f for f in form.changed_data if f not in WithdrawalRequest.WORKER_FIELDS]
+        if edited:
+            obj.save(update_fields=edited + ['updated_at'])
+
     def reverse_withdrawal(self, request, queryset):
         """
         Admin action to reverse completed withdrawals.
@@ -165,8 +171,64 @@ class WithdrawalRequestAdmin(admin.ModelAdmin):
 
     reverse_withdrawal.short_description = "Reverse selected completed withdrawals"
 
+    def requeue_payouts(self, request, queryset):
+        """Send needs_review M-Pesa payouts that never reached Daraja back to the dispatcher."""
+        from .dispatcher import requeue_for_dispatch
+        requeued = requeue_for_dispatch(queryset)
+        skipped = queryset.count() - requeued
+        self.message_user(request, f"Requeued {requeued} payout(s) for dispatch.", level=messages.SUCCESS)
+        if skipped:
+            self.message_user(
+                request,
+                f"Skipped {skipped}: not in review, not mobile, or Daraja may already have the request.",
+                level=messages.WARNING
+            )
+
+    requeue_payouts.short_description = "Requeue selected undispatched payouts"
+
     def user_email(self, obj):
         return obj.user.email    
 
     user_email.short_description = 'User'
-    user_email.admin_order_field = 'user__email'
\ No newline at end of file
+    user_email.admin_order_field = 'user__email'
+
+
+@admin.register(ProcessedCallback)
+class ProcessedCallbackAdmin(admin.ModelAdmin):
+    list_display = ['callback_id', 'provider', 'withdrawal', 'created_at']
+    list_filter = ['provider', 'created_at']
+    search_fields = ['callback_id', 'withdrawal__reference_code']
+    readonly_fields = ['provider', 'callback_id', 'withdrawal', 'created_at']
+    ordering = ['-created_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(CallbackInbox)
+class CallbackInboxAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'serial_key', 'status', 'attempts', 'received_at', 'processed_at']
+    list_filter = ['kind', 'status', 'received_at']
+    search_fields = ['serial_key']
+    readonly_fields = [
+        'kind', 'serial_key', 'payload', 'remote_addr', 'received_at', 'status',
+        'attempts', 'next_attempt_at', 'locked_at', 'processed_at', 'last_error'
+    ]
+    ordering = ['-id']
+    actions = ['replay']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False  # Append-only: the raw payloads are the audit trail
+
+    def replay(self, request, queryset):
+        from .inbox import requeue
+        count = requeue(queryset)
+        self.message_user(request, f"Re-queued {count} callback(s).", level=messages.SUCCESS)
+
+    replay.short_description = "Re-queue selected callbacks"
@@ -0,0 +1,118 @@
+# withdrawals/callbacks.py
+"""
+Processing for Daraja B2C result and timeout callbacks. The webhooks only store the
+payload in the callback inbox; `process_callback_inbox` calls these with it.
+Errors propagate so the inbox can retry the row.
+"""
+import logging
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import WithdrawalRequest, ProcessedCallback
+from wallets.models import WalletTransaction
+from wallets.services import ledger_key, post_entries, reverse_pending_withdrawal
+from users.utils import send_withdrawal_completed_email
+
+logger = logging.getLogger(__name__)
+
+
+def b2c_result_serial_key(payload):
+    """Inbox ordering key: callbacks for one payout are applied one at a time, in order."""
+    result = payload.get('Result', {})
+    callback_id = result.get('OriginatorConversationID') or result.get('ConversationID')
+    return f"withdrawal:{callback_id}" if callback_id else None
+
+
+def b2c_timeout_serial_key(payload):
+    callback_id = payload.get('OriginatorConversationID') or payload.get('ConversationID')
+    return f"withdrawal:{callback_id}" if callback_id else None
+
+
+def apply_b2c_result(payload):
+    """Settle (ResultCode 0) or fail and reverse a withdrawal. Idempotent per callback id."""
+    result = payload.get('Result', {})
+    result_code = result.get('ResultCode')
+    originator_id = result.get('OriginatorConversationID')
+    conversation_id = result.get('ConversationID')
+    receipt = result.get('TransactionID', '')
+
+    callback_id = originator_id or conversation_id
+    if not callback_id:
+        logger.warning("B2C callback without a conversation id ignored")
+        return
+
+    withdrawal = WithdrawalRequest.find_for_callback(originator_id, conversation_id)
+
+    if not withdrawal:
+        return
+
+    with transaction.atomic():
+        # Duplicate deliveries stop here, on the unique (provider, callback_id) insert
+        if not ProcessedCallback.record('b2c_result', callback_id, withdrawal):
+            return
+
+        if result_code == 0:
+            # One conditional UPDATE decides the race with other callbacks and admin edits
+            if not WithdrawalRequest.transition(
+                withdrawal.id, ['pending', 'needs_review'], 'completed', mpesa_receipt_number=receipt
+            ):
+                logger.warning(f"Success callback for withdrawal {withdrawal.id} ignored: already final")
+                return
+            withdrawal.refresh_from_db(fields=['status', 'processed_at', 'mpesa_receipt_number'])
+
+            post_entries([WalletTransaction(
+                user=withdrawal.user,
+                wallet_type=withdrawal.wallet_type,
+                transaction_type='withdrawal',
+                amount=Decimal('0.00'),
+                linked_withdrawal=withdrawal,
+                description=f"M-Pesa withdrawal settled. Receipt {receipt}",
+                idempotency_key=ledger_key('withdrawal', withdrawal.id)
+            )])
+
+            try:
+                send_withdrawal_completed_email(
+                    user=withdrawal.user,
+                    amount=withdrawal.amount,
+                    method=withdrawal.method,
+                    destination=withdrawal.mobile_phone,
+                    processed_at=withdrawal.processed_at,
+                    receipt_number=receipt,
+                    reference_code=withdrawal.reference_code,
+                    recipient_name = f"{withdrawal.user.first_name} {withdrawal.user.last_name}".strip() or withdrawal.user.email
+                )
+            except Exception:
+                logger.warning(f"Email failed for withdrawal {withdrawal.id}")
+
+        else:
+            # Marks the withdrawal failed and credits the wallet back, once
+            try:
+                reverse_pending_withdrawal(
+                    withdrawal,
+                    reason=f"Daraja failure code {result_code}"
+                )
+            except ValidationError as e:
+                logger.warning(f"Failure callback for withdrawal {withdrawal.id} not applied: {e}")
+
+
+def apply_b2c_timeout(payload):
+    """Daraja gave up waiting on the payout: park the withdrawal for review."""
+    callback_id = payload.get('OriginatorConversationID') or payload.get('ConversationID')
+
+    if not callback_id:
+        logger.warning("B2C callback without a conversation id ignored")
+        return
+
+    withdrawal = WithdrawalRequest.find_for_callback(callback_id, callback_id)
+
+    if not withdrawal:
+        return
+
+    with transaction.atomic():
+        if not ProcessedCallback.record('b2c_timeout', callback_id, withdrawal):
+            return
+
+        if not WithdrawalRequest.transition(withdrawal.id, ['pending'], 'needs_review'):
+            logger.info(f"Timeout callback for withdrawal {withdrawal.id} ignored: no longer pending")
@@ -1,7 +1,9 @@
-import base64
 import requests
 from datetime import datetime
 from decouple import config
+from urllib3.exceptions import NewConnectionError
+
+from earn_backend.daraja import DarajaAuthError, get_client
 
 MPESA_B2C_CONSUMER_KEY = config('MPESA_B2C_CONSUMER_KEY')
 MPESA_B2C_CONSUMER_SECRET = config('MPESA_B2C_CONSUMER_SECRET')
@@ -12,24 +14,17 @@ MPESA_B2C_SHORTCODE = config('MPESA_B2C_SHORTCODE')
 MPESA_B2C_TIMEOUT_URL = config('MPESA_B2C_TIMEOUT_URL').strip()
 MPESA_B2C_RESULT_URL = config('MPESA_B2C_RESULT_URL').strip()
 
+# Point at a local Daraja stub for testing the payout dispatcher
+MPESA_B2C_BASE_URL = config('MPESA_B2C_BASE_URL', default='https://api.safaricom.co.ke').rstrip('/')
 
-def get_access_token():
-    url = "https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-    credentials = base64.b64encode(
-        f"{MPESA_B2C_CONSUMER_KEY}:{MPESA_B2C_CONSUMER_SECRET}".encode()
-    ).decode()
 
-    headers = {
-        "Authorization": f"Basic {credentials}"
-    }
+def _client():
+    return get_client(MPESA_B2C_CONSUMER_KEY, MPESA_B2C_CONSUMER_SECRET, MPESA_B2C_BASE_URL)
 
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        return response.json().get("access_token")
-    except requests.exceptions.RequestException as e:
-        print(f"Access token error: {e}")
-        return None
+
+def get_access_token():
+    """Cached B2C OAuth token (see earn_backend.daraja)."""
+    return _client().get_token()
 
 
 def normalize_phone_number(phone_number: str):
@@ -45,7 +40,30 @@ def normalize_phone_number(phone_number: str):
     return None
 
 
+# Daraja answered without processing anything: rate limited, or briefly unavailable.
+# Other 5xx (500/502/504) may come from a gateway after the payment was accepted.
+TRANSIENT_STATUS_CODES = (429, 503)
+
+
+def _never_sent(exc):
+    """True if the connection failed before any request bytes left this host."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    reason = exc.args[0] if exc.args else None
+    reason = getattr(reason, 'reason', reason)  # MaxRetryError wraps the socket error
+    return isinstance(reason, NewConnectionError)
+
+
 def send_b2c_payment(phone_number, amount, remarks="Withdrawal payout", originator_id=None):
+    """
+    Submit a B2C payment. Returns Daraja's JSON on acceptance, otherwise a dict with
+    "error" plus:
+      "transient": True  -> Daraja certainly did not take the payment; safe to retry later
+                            (no token, connection never opened, 429/503)
+      "ambiguous": True  -> the request may have reached Daraja (dropped connection, read
+                            timeout, gateway 5xx, unreadable 200); never resend blindly
+    Neither flag means Daraja rejected the request outright (e.g. 400).
+    """
     phone_number = normalize_phone_number(phone_number)
     if not phone_number:
         return {"error": "Invalid phone number format"}
@@ -62,17 +80,11 @@ def send_b2c_payment(phone_number, amount, remarks="Withdrawal payout", originat
         remarks = "Withdrawal payout"
     remarks = remarks[:100]
 
-    access_token = get_access_token()
-    if not access_token:
-        return {"error": "Failed to authenticate your request"}
-
     if originator_id:
         originator_id = str(originator_id)[:20]
     else:
         originator_id = f"B2C{int(datetime.now().timestamp())}"[:20]
 
-    url = "https://api.safaricom.co.ke/mpesa/b2c/v3/paymentrequest"
-
     payload = {
         "OriginatorConversationID": originator_id,
         "InitiatorName": MPESA_B2C_INITIATOR_NAME,
@@ -87,24 +99,37 @@ def send_b2c_payment(phone_number, amount, remarks="Withdrawal payout", originat
         "Occasion": remarks
     }
 
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.json()
+        response = _client().post("/mpesa/b2c/v3/paymentrequest", payload, timeout=30)
+    except DarajaAuthError:
+        return {"error": "Failed to authenticate your request", "transient": True}
+    except requests.exceptions.RequestException as e:
+        if _never_sent(e):
+            return {"error": "Could not connect to Daraja", "details": str(e), "transient": True}
+        # Sent (or possibly sent) and then the connection dropped or timed out reading
+        return {"error": "Request interrupted", "details": str(e), "ambiguous": True}
 
-    except requests.exceptions.HTTPError:
+    if response.status_code >= 400:
+        transient = response.status_code in TRANSIENT_STATUS_CODES
         return {
             "error": "B2C request failed",
             "status_code": response.status_code,
-            "response": response.text
+            "response": response.text,
+            "transient": transient,
+            "ambiguous": response.status_code >= 500 and not transient
         }
-    except requests.exceptions.RequestException as e:
+
+    try:
+        data = response.json()
+        if not isinstance(data, dict):
+            raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+        return data
+    except ValueError as e:
+        # Accepted at HTTP level but unreadable: Daraja may well have the payment
         return {
-            "error": "Request exception",
-            "details": str(e)
-        }
\ No newline at end of file
+            "error": "Unreadable B2C response",
+            "status_code": response.status_code,
+            "details": str(e),
+            "response": response.text[:500],
+            "ambiguous": True
+        }
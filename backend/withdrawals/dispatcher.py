@@ -0,0 +1,238 @@
+# withdrawals/dispatcher.py
+"""
+B2C payout dispatcher.
+
+WithdrawalRequestView only records a mobile withdrawal (status 'pending',
+next_dispatch_at = now) and answers 202. `python manage.py dispatch_payouts` claims due
+rows, sends them to Daraja from a bounded thread pool under a requests-per-second cap,
+and records the ConversationID. The result/timeout callbacks finish the job as before.
+
+Failure handling:
+  transient (no token, connection never opened, 429/503) -> retried with exponential backoff
+  attempts exhausted or outright rejection (4xx)         -> status 'needs_review'
+  ambiguous (dropped connection, read timeout, other 5xx, unreadable response, worker died
+      mid-send) -> status 'needs_review' with dispatched_at set, never resent (not even by
+      the admin requeue), because Daraja may already have accepted the payment
+
+Settings (all optional):
+    B2C_DISPATCH_WORKERS        payouts in flight at once (default 4)
+    B2C_DISPATCH_RATE           max B2C requests per second across all threads (default 5)
+    B2C_DISPATCH_MAX_ATTEMPTS   sends tried before a payout goes to review (default 5)
+    B2C_DISPATCH_RETRY_BASE     seconds before the first retry; doubles each time (default 30)
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .daraja_payout import send_b2c_payment
+from .models import WithdrawalRequest
+
+logger = logging.getLogger(__name__)
+
+# A claim older than this belongs to a dispatcher that died, possibly mid-request.
+# dispatch_one re-stamps the claim right before each send, so a live dispatcher only has
+# to finish one request (30s, plus a token fetch) inside this window, not a whole slice.
+STALE_AFTER = timedelta(minutes=5)
+MAX_RETRY_DELAY = timedelta(minutes=30)
+
+
+def _max_attempts():
+    return int(getattr(settings, 'B2C_DISPATCH_MAX_ATTEMPTS', 5))
+
+
+def _retry_delay(attempts):
+    base = int(getattr(settings, 'B2C_DISPATCH_RETRY_BASE', 30))
+    return min(timedelta(seconds=base * 2 ** max(attempts - 1, 0)), MAX_RETRY_DELAY)
+
+
+def originator_id_for(withdrawal_id):
+    return f"B2C_{withdrawal_id}"[:20]
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across threads. rate <= 0 disables it."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# ========================
+# CLAIMING
+# ========================
+
+def _due_filter(now):
+    return Q(status='pending', method='mobile', dispatched_at__isnull=True, next_dispatch_at__lte=now)
+
+
+def recover_stale_claims():
+    """
+    Claims left by a dispatcher that died may already have reached Daraja.
+    They are parked for review, marked dispatched so that requeue_for_dispatch refuses
+    them, instead of being sent a second time.
+    """
+    now = timezone.now()
+    return WithdrawalRequest.objects.filter(
+        _due_filter(now), dispatch_locked_at__lt=now - STALE_AFTER
+    ).update(
+        status='needs_review',
+        dispatched_at=now,
+        dispatch_locked_at=None,
+        last_dispatch_error='Dispatcher stopped while sending; check Daraja before retrying.',
+        updated_at=now
+    )
+
+
+def claim_batch(size=50):
+    """Lock and mark up to `size` due payouts as in flight. Safe with several dispatchers."""
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            WithdrawalRequest.objects
+            .select_for_update(skip_locked=True)
+            .filter(_due_filter(now), dispatch_locked_at__isnull=True)
+            .order_by('next_dispatch_at', 'id')[:size]
+        )
+        for withdrawal in batch:
+            # Set before sending so a fast result callback can already find the row
+            withdrawal.originator_conversation_id = originator_id_for(withdrawal.id)
+            WithdrawalRequest.objects.filter(id=withdrawal.id).update(
+                dispatch_locked_at=now,
+                originator_conversation_id=withdrawal.originator_conversation_id
+            )
+    return batch
+
+
+# ========================
+# SENDING
+# ========================
+
+def dispatch_one(withdrawal, limiter=None):
+    """
+    Send one claimed payout and record the outcome.
+    Returns 'sent', 'retry', 'needs_review', or 'skipped' if the claim was lost.
+    """
+    if limiter:
+        limiter.wait()
+
+    # The batch was claimed as a whole and this row may have waited behind slower sends.
+    # Re-check that it is still ours and unsent, and restart its stale clock, in one UPDATE.
+    still_claimed = WithdrawalRequest.objects.filter(
+        id=withdrawal.id,
+        status='pending',
+        dispatched_at__isnull=True,
+        daraja_conversation_id__isnull=True,
+        dispatch_locked_at__isnull=False,
+    ).update(dispatch_locked_at=timezone.now())
+    if not still_claimed:
+        logger.warning(f"Withdrawal {withdrawal.id} is no longer a pending claim; not sending it")
+        return 'skipped'
+
+    attempts = withdrawal.dispatch_attempts + 1
+    try:
+        resp = send_b2c_payment(
+            withdrawal.mobile_phone,
+            float(withdrawal.amount),
+            originator_id=withdrawal.originator_conversation_id
+        )
+    except Exception as e:
+        logger.error(f"Daraja send error for withdrawal {withdrawal.id}: {e}", exc_info=True)
+        resp = {"error": "Dispatcher exception", "details": str(e), "ambiguous": True}
+
+    now = timezone.now()
+    rows = WithdrawalRequest.objects.filter(id=withdrawal.id)
+    conversation_id = resp.get('ConversationID') or resp.get('Response', {}).get('ConversationID')
+
+    if not resp.get('error') and conversation_id and str(resp.get('ResponseCode', '0')) == '0':
+        rows.update(
+            daraja_conversation_id=conversation_id,
+            dispatched_at=now,
+            dispatch_attempts=attempts,
+            dispatch_locked_at=None,
+            last_dispatch_error='',
+            updated_at=now
+        )
+        logger.info(f"Withdrawal {withdrawal.id} sent to M-Pesa (ConversationID {conversation_id})")
+        return 'sent'
+
+    error = resp.get('error') or resp.get('ResponseDescription') or 'B2C request not accepted'
+    details = resp.get('details') or resp.get('response') or ''
+    error = f"{error}: {details}" if details else error
+
+    if resp.get('transient') and attempts < _max_attempts():
+        rows.filter(status='pending').update(
+            dispatch_attempts=attempts,
+            next_dispatch_at=now + _retry_delay(attempts),
+            dispatch_locked_at=None,
+            last_dispatch_error=error,
+            updated_at=now
+        )
+        logger.warning(f"⚠️ Withdrawal {withdrawal.id} payout will be retried (attempt {attempts}): {error}")
+        return 'retry'
+
+    # Exhausted, rejected outright, or possibly received: a human decides
+    WithdrawalRequest.transition(
+        withdrawal.id, ['pending'], 'needs_review',
+        dispatch_attempts=attempts,
+        dispatched_at=now if resp.get('ambiguous') else None,
+        dispatch_locked_at=None,
+        last_dispatch_error=error
+    )
+    logger.error(f"❌ Withdrawal {withdrawal.id} payout moved to review after {attempts} attempt(s): {error}")
+    return 'needs_review'
+
+
+def _dispatch_slice(withdrawals, limiter):
+    """Runs on a pool thread with its own DB connection."""
+    outcomes = []
+    try:
+        for withdrawal in withdrawals:
+            outcomes.append(dispatch_one(withdrawal, limiter))
+    finally:
+        connection.close()
+    return outcomes
+
+
+def dispatch_batch(batch, pool, workers, limiter):
+    """Send a claimed batch with at most `workers` requests in flight. Returns outcome counts."""
+    counts = {'sent': 0, 'retry': 0, 'needs_review': 0, 'skipped': 0}
+    slices = [batch[i::workers] for i in range(workers) if batch[i::workers]]
+    for outcomes in pool.map(lambda part: _dispatch_slice(part, limiter), slices):
+        for outcome in outcomes:
+            counts[outcome] += 1
+    return counts
+
+
+def requeue_for_dispatch(queryset):
+    """
+    Put needs_review payouts that never reached Daraja back in the queue.
+    Rows whose request may have been received (dispatched_at or a ConversationID set)
+    are left alone.
+    """
+    return queryset.filter(
+        status='needs_review', method='mobile', dispatched_at__isnull=True, daraja_conversation_id__isnull=True
+    ).update(
+        status='pending',
+        dispatch_attempts=0,
+        next_dispatch_at=timezone.now(),
+        dispatch_locked_at=None,
+        last_dispatch_error='',
+        updated_at=timezone.now()
+    )
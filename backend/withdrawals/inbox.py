@@ -0,0 +1,169 @@
+# withdrawals/inbox.py
+"""
+Daraja callback inbox.
+
+Webhooks call `receive(kind, payload, remote_addr)`: one INSERT, then 200 back to
+Safaricom. `python manage.py process_callback_inbox` claims due rows in id order and
+applies them with the handlers below. A row is only claimable when no earlier row with
+the same serial_key is still pending or processing, so the callbacks for one payout or
+checkout are applied strictly in arrival order, while different keys run in parallel.
+Failed rows are retried with backoff; `replay_callbacks` re-queues a time window.
+
+Settings (all optional):
+    CALLBACK_INBOX_MAX_ATTEMPTS   tries before a row is marked failed (default 5)
+    CALLBACK_INBOX_RETRY_BASE     seconds before the first retry; doubles each time (default 30)
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import CallbackInbox
+
+logger = logging.getLogger(__name__)
+
+# Imported lazily so subscriptions and withdrawals do not import each other at load time
+HANDLERS = {
+    'b2c_result': 'withdrawals.callbacks.apply_b2c_result',
+    'b2c_timeout': 'withdrawals.callbacks.apply_b2c_timeout',
+    'stk': 'subscriptions.callbacks.apply_stk_callback',
+}
+SERIAL_KEYS = {
+    'b2c_result': 'withdrawals.callbacks.b2c_result_serial_key',
+    'b2c_timeout': 'withdrawals.callbacks.b2c_timeout_serial_key',
+    'stk': 'subscriptions.callbacks.stk_serial_key',
+}
+
+# A row still 'processing' after this long belongs to a dead worker
+STALE_AFTER = timedelta(minutes=10)
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+
+def _max_attempts():
+    return int(getattr(settings, 'CALLBACK_INBOX_MAX_ATTEMPTS', 5))
+
+
+def _retry_delay(attempts):
+    base = int(getattr(settings, 'CALLBACK_INBOX_RETRY_BASE', 30))
+    return min(timedelta(seconds=base * 2 ** max(attempts - 1, 0)), MAX_RETRY_DELAY)
+
+
+def receive(kind, payload, remote_addr=None):
+    """
+    Store a webhook payload. Returns the row, or None if the payload has no usable id
+    (the caller answers 400, as the webhooks always have).
+    """
+    serial_key = import_string(SERIAL_KEYS[kind])(payload)
+    if not serial_key:
+        return None
+    return CallbackInbox.objects.create(kind=kind, serial_key=serial_key[:120], payload=payload, remote_addr=remote_addr)
+
+
+# ========================
+# WORKER
+# ========================
+
+def claim_batch(size=100):
+    """
+    Lock and mark up to `size` due rows as processing, oldest first, skipping any row
+    whose key has an earlier unfinished row. At most one row per key is ever in flight.
+    """
+    now = timezone.now()
+    earlier_unfinished = CallbackInbox.objects.filter(
+        serial_key=OuterRef('serial_key'),
+        id__lt=OuterRef('id'),
+        status__in=['pending', 'processing'],
+    )
+    with transaction.atomic():
+        batch = list(
+            CallbackInbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status='pending', next_attempt_at__lte=now)
+                | Q(status='processing', locked_at__lt=now - STALE_AFTER)
+            )
+            .exclude(Exists(earlier_unfinished))
+            .order_by('id')[:size]
+        )
+        if batch:
+            CallbackInbox.objects.filter(id__in=[row.id for row in batch]).update(status='processing', locked_at=now)
+    return batch
+
+
+def process_row(row):
+    """Apply one claimed row and record the outcome. Returns 'done', 'retry' or 'failed'."""
+    row.attempts += 1
+    try:
+        import_string(HANDLERS[row.kind])(row.payload)
+    except Exception as e:
+        now = timezone.now()
+        if row.attempts >= _max_attempts():
+            outcome = 'failed'
+            CallbackInbox.objects.filter(id=row.id).update(
+                status='failed', attempts=row.attempts, locked_at=None, last_error=str(e)
+            )
+            logger.error(f"❌ Callback {row.id} ({row.kind} {row.serial_key}) failed after {row.attempts} attempts: {e}", exc_info=True)
+        else:
+            outcome = 'retry'
+            CallbackInbox.objects.filter(id=row.id).update(
+                status='pending', attempts=row.attempts, locked_at=None, last_error=str(e),
+                next_attempt_at=now + _retry_delay(row.attempts)
+            )
+            logger.warning(f"⚠️ Callback {row.id} ({row.kind} {row.serial_key}) will be retried: {e}")
+        return outcome
+
+    CallbackInbox.objects.filter(id=row.id).update(
+        status='done', attempts=row.attempts, locked_at=None, last_error='', processed_at=timezone.now()
+    )
+    return 'done'
+
+
+def _process_slice(rows):
+    """Runs on a pool thread with its own DB connection."""
+    outcomes = []
+    try:
+        for row in rows:
+            outcomes.append(process_row(row))
+    finally:
+        connection.close()
+    return outcomes
+
+
+def process_batch(batch, pool=None, workers=1):
+    """Apply a claimed batch, spread over `workers` pool threads. Returns outcome counts."""
+    counts = {'done': 0, 'retry': 0, 'failed': 0}
+    if pool is None or workers <= 1:
+        results = [[process_row(row) for row in batch]]
+    else:
+        slices = [batch[i::workers] for i in range(workers) if batch[i::workers]]
+        results = pool.map(_process_slice, slices)
+    for outcomes in results:
+        for outcome in outcomes:
+            counts[outcome] += 1
+    return counts
+
+
+# ========================
+# REPLAY
+# ========================
+
+def replay_window(since, until, kind=None, statuses=('failed',)):
+    """
+    Re-queue rows received in [since, until) for processing. Returns the queryset that
+    was (or, for a dry run, would be) re-queued. Handlers are idempotent, so replaying a
+    row that already took effect is a no-op.
+    """
+    rows = CallbackInbox.objects.filter(received_at__gte=since, received_at__lt=until, status__in=statuses)
+    if kind:
+        rows = rows.filter(kind=kind)
+    return rows
+
+
+def requeue(rows):
+    return rows.exclude(status='processing').update(
+        status='pending', attempts=0, next_attempt_at=timezone.now(), locked_at=None, last_error=''
+    )
@@ -0,0 +1,76 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from withdrawals.dispatcher import RateLimiter, claim_batch, dispatch_batch, recover_stale_claims
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends pending M-Pesa withdrawals to Daraja B2C with bounded concurrency and a '
+        'requests-per-second cap. Runs forever unless --once is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Dispatch the due payouts and exit instead of polling.')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=getattr(settings, 'B2C_DISPATCH_WORKERS', 4),
+            help='Payout requests in flight at once (default: B2C_DISPATCH_WORKERS or 4).'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=getattr(settings, 'B2C_DISPATCH_RATE', 5),
+            help='Max B2C requests per second, 0 for no cap (default: B2C_DISPATCH_RATE or 5).'
+        )
+        parser.add_argument('--batch-size', type=int, default=50, help='Payouts claimed per round (default: 50).')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when nothing is due (default: 2).')
+
+    def handle(self, *args, **options):
+        once = options['once']
+        workers = max(options['workers'], 1)
+        batch_size = max(options['batch_size'], 1)
+        poll_interval = options['poll_interval']
+        limiter = RateLimiter(options['rate'])
+
+        self.stdout.write(f"💸 Payout dispatcher started ({workers} worker(s), {options['rate'] or 'no'} req/s cap)...")
+        totals = {'sent': 0, 'retry': 0, 'needs_review': 0, 'skipped': 0}
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                while True:
+                    close_old_connections()
+                    stale = recover_stale_claims()
+                    if stale:
+                        totals['needs_review'] += stale
+                        self.stdout.write(self.style.WARNING(f'  ⚠️  {stale} interrupted payout(s) moved to review'))
+
+                    batch = claim_batch(batch_size)
+                    if not batch:
+                        if once:
+                            break
+                        time.sleep(poll_interval)
+                        continue
+
+                    counts = dispatch_batch(batch, pool, workers, limiter)
+                    for key, value in counts.items():
+                        totals[key] += value
+                    self.stdout.write(
+                        f"  ✅ Batch of {len(batch)}: {counts['sent']} sent, "
+                        f"{counts['retry']} to retry, {counts['needs_review']} to review"
+                        + (f", {counts['skipped']} skipped (claim lost)" if counts['skipped'] else '')
+                    )
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('⚠️  Interrupted.'))
+
+        self.stdout.write()
+        self.stdout.write('📊 SUMMARY:')
+        self.stdout.write(f"  💸 Sent to M-Pesa: {totals['sent']}")
+        self.stdout.write(f"  🔁 Scheduled for retry: {totals['retry']}")
+        self.stdout.write(f"  🧐 Moved to needs_review: {totals['needs_review']}")
+        self.stdout.write(f"  ⏭️  Skipped (no longer pending): {totals['skipped']}")
@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from withdrawals.inbox import claim_batch, process_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Applies stored Daraja callbacks (B2C result/timeout, STK push) in arrival order, '
+        'one at a time per payout or checkout. Runs forever unless --once is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the due callbacks and exit instead of polling.')
+        parser.add_argument('--batch-size', type=int, default=100, help='Callbacks claimed per round (default: 100).')
+        parser.add_argument('--workers', type=int, default=4, help='Callbacks for different keys applied in parallel (default: 4).')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when nothing is due (default: 1).')
+
+    def handle(self, *args, **options):
+        once = options['once']
+        batch_size = max(options['batch_size'], 1)
+        workers = max(options['workers'], 1)
+        poll_interval = options['poll_interval']
+
+        self.stdout.write('📥 Callback inbox worker started...')
+        totals = {'done': 0, 'retry': 0, 'failed': 0}
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                while True:
+                    close_old_connections()
+                    batch = claim_batch(batch_size)
+                    if not batch:
+                        if once:
+                            break
+                        time.sleep(poll_interval)
+                        continue
+
+                    counts = process_batch(batch, pool, workers)
+                    for key, value in counts.items():
+                        totals[key] += value
+                    self.stdout.write(
+                        f"  ✅ Batch of {len(batch)}: {counts['done']} applied, "
+                        f"{counts['retry']} to retry, {counts['failed']} failed"
+                    )
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('⚠️  Interrupted.'))
+
+        self.stdout.write()
+        self.stdout.write('📊 SUMMARY:')
+        self.stdout.write(f"  📥 Applied: {totals['done']}")
+        self.stdout.write(f"  🔁 Scheduled for retry: {totals['retry']}")
+        self.stdout.write(f"  ❌ Failed permanently: {totals['failed']}")
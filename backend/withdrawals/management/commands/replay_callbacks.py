@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from withdrawals.inbox import replay_window, requeue
+from withdrawals.models import CallbackInbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-queues stored Daraja callbacks received in a time window, e.g. after an incident. '
+        'process_callback_inbox applies them again; handlers are idempotent.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', required=True, help='Start of the window (ISO 8601, e.g. 2026-10-18T09:00).')
+        parser.add_argument('--until', default=None, help='End of the window, exclusive (default: now).')
+        parser.add_argument('--kind', choices=[k for k, _ in CallbackInbox.KIND_CHOICES], help='Only this callback type.')
+        parser.add_argument(
+            '--status',
+            choices=['failed', 'done', 'all'],
+            default='failed',
+            help='Which rows to replay (default: failed).'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Show what would be replayed without changing anything.')
+
+    def _parse(self, value, name):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f'Invalid --{name}: {value}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def handle(self, *args, **options):
+        since = self._parse(options['since'], 'since')
+        until = self._parse(options['until'], 'until') if options['until'] else timezone.now()
+        if until <= since:
+            raise CommandError('--until must be after --since.')
+
+        statuses = ('failed', 'done') if options['status'] == 'all' else (options['status'],)
+        rows = replay_window(since, until, kind=options['kind'], statuses=statuses)
+
+        self.stdout.write(f'🔁 Replaying callbacks received {since:%Y-%m-%d %H:%M:%S} → {until:%Y-%m-%d %H:%M:%S}...')
+        for kind, count in sorted(
+            (k, rows.filter(kind=k).count()) for k, _ in CallbackInbox.KIND_CHOICES
+        ):
+            if count:
+                self.stdout.write(f'  • {kind}: {count}')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'⚠️  DRY RUN: {rows.count()} callback(s) would be re-queued.'))
+            return
+
+        requeued = requeue(rows)
+
+        self.stdout.write()
+        self.stdout.write('📊 SUMMARY:')
+        self.stdout.write(f'  🔁 Re-queued: {requeued}')
+        self.stdout.write(self.style.SUCCESS('✅ Run process_callback_inbox (or let it poll) to apply them.'))
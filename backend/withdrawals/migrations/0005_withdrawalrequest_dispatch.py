@@ -0,0 +1,44 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('withdrawals', '0004_remove_withdrawalrequest_linked_transaction_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='withdrawalrequest',
+            name='dispatch_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='withdrawalrequest',
+            name='dispatch_locked_at',
+            field=models.DateTimeField(blank=True, help_text='Set while a dispatcher is sending this payout', null=True),
+        ),
+        migrations.AddField(
+            model_name='withdrawalrequest',
+            name='dispatched_at',
+            field=models.DateTimeField(blank=True, help_text='When the B2C request reached (or may have reached) Daraja', null=True),
+        ),
+        migrations.AddField(
+            model_name='withdrawalrequest',
+            name='last_dispatch_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='withdrawalrequest',
+            name='next_dispatch_at',
+            field=models.DateTimeField(blank=True, help_text='When the dispatcher should (re)try sending this payout; empty for manual payouts', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawalrequest',
+            index=models.Index(fields=['status', 'next_dispatch_at'], name='withdrawal_dispatch_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_processed_callbacks(apps, schema_editor):
+    """
+    Move the old per-row JSON lists into ProcessedCallback. The list was shared by the
+    result and timeout callbacks, so each id is recorded for both to keep old deliveries
+    from being applied again.
+    """
+    WithdrawalRequest = apps.get_model('withdrawals', 'WithdrawalRequest')
+    ProcessedCallback = apps.get_model('withdrawals', 'ProcessedCallback')
+
+    rows = []
+    for withdrawal_id, callback_ids in (
+        WithdrawalRequest.objects.exclude(processed_callbacks=[]).values_list('id', 'processed_callbacks').iterator()
+    ):
+        for callback_id in set(callback_ids or []):
+            for provider in ('b2c_result', 'b2c_timeout'):
+                rows.append(ProcessedCallback(provider=provider, callback_id=callback_id, withdrawal_id=withdrawal_id))
+    ProcessedCallback.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('withdrawals', '0005_withdrawalrequest_dispatch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='withdrawalrequest',
+            name='daraja_conversation_id',
+            field=models.CharField(blank=True, db_index=True, max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='withdrawalrequest',
+            name='originator_conversation_id',
+            field=models.CharField(blank=True, db_index=True, max_length=20, null=True),
+        ),
+        migrations.CreateModel(
+            name='ProcessedCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(choices=[('b2c_result', 'B2C Result'), ('b2c_timeout', 'B2C Timeout')], max_length=20)),
+                ('callback_id', models.CharField(help_text='OriginatorConversationID or ConversationID', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('withdrawal', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='callback_records', to='withdrawals.withdrawalrequest')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('provider', 'callback_id'), name='unique_processed_callback')],
+            },
+        ),
+        migrations.RunPython(copy_processed_callbacks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='withdrawalrequest',
+            name='processed_callbacks',
+        ),
+    ]
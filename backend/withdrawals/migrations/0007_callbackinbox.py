@@ -0,0 +1,36 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('withdrawals', '0006_processedcallback'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallbackInbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('b2c_result', 'B2C Result'), ('b2c_timeout', 'B2C Timeout'), ('stk', 'STK Push')], max_length=20)),
+                ('serial_key', models.CharField(help_text='Rows with the same key are applied strictly in order', max_length=120)),
+                ('payload', models.JSONField()),
+                ('remote_addr', models.GenericIPAddressField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=12)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Callback inbox',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='callback_inbox_queue_idx'), models.Index(fields=['serial_key', 'status'], name='callback_inbox_key_idx')],
+            },
+        ),
+    ]
@@ -1,8 +1,9 @@
 # withdrawals/models.py
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.core.exceptions import ValidationError
 from users.models import User
 import uuid
+from django.utils import timezone
 
 
 class SystemSetting(models.Model):
@@ -31,6 +32,13 @@ class SystemSetting(models.Model):
         return setting.value
 
 
+# Legal status moves. 'completed' and 'failed' are final.
+ALLOWED_TRANSITIONS = {
+    'pending': {'completed', 'failed', 'needs_review'},
+    'needs_review': {'completed', 'failed', 'pending'},
+}
+
+
 class WithdrawalRequest(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -46,6 +54,12 @@ class WithdrawalRequest(models.Model):
         ('main', 'Main Wallet'),
         ('referral', 'Referral Wallet'),
     ]
+    # Written only by transition() and the dispatcher's conditional UPDATEs, never by save()
+    # on an existing row, so a stale copy cannot undo a payout's progress
+    WORKER_FIELDS = (
+        'status', 'processed_at', 'next_dispatch_at', 'dispatch_attempts', 'dispatch_locked_at',
+        'dispatched_at', 'last_dispatch_error', 'daraja_conversation_id', 'originator_conversation_id',
+    )
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='withdrawal_requests')
     wallet_type = models.CharField(max_length=10, choices=WALLET_CHOICES)
@@ -56,8 +70,8 @@ class WithdrawalRequest(models.Model):
     bank_branch = models.CharField(max_length=100, blank=True)
     account_number = models.CharField(max_length=50, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
-    originator_conversation_id = models.CharField(max_length=20, blank=True, null=True)
-    daraja_conversation_id = models.CharField(max_length=50, blank=True, null=True)
+    originator_conversation_id = models.CharField(max_length=20, blank=True, null=True, db_index=True)
+    daraja_conversation_id = models.CharField(max_length=50, blank=True, null=True, db_index=True)
     reference_code = models.CharField(max_length=20, unique=True, blank=True)
     mpesa_receipt_number = models.CharField(max_length=50, blank=True)
     request_date = models.DateField(auto_now_add=True)
@@ -65,12 +79,18 @@ class WithdrawalRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    # 🔑 For idempotent callback processing
-    processed_callbacks = models.JSONField(
-        default=list,
-        blank=True,
-        help_text="List of OriginatorConversationID or ConversationID already processed"
-    )
+    # 📤 B2C dispatch state (python manage.py dispatch_payouts)
+    next_dispatch_at = models.DateTimeField(null=True, blank=True, help_text="When the dispatcher should (re)try sending this payout; empty for manual payouts")
+    dispatch_attempts = models.PositiveSmallIntegerField(default=0)
+    dispatch_locked_at = models.DateTimeField(null=True, blank=True, help_text="Set while a dispatcher is sending this payout")
+    dispatched_at = models.DateTimeField(null=True, blank=True, help_text="When the B2C request reached (or may have reached) Daraja")
+    last_dispatch_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Dispatcher claim: WHERE status = 'pending' AND next_dispatch_at <= now ORDER BY next_dispatch_at
+            models.Index(fields=['status', 'next_dispatch_at'], name='withdrawal_dispatch_idx'),
+        ]
 
     def clean(self):
         if self.method == 'mobile' and not self.mobile_phone:
@@ -79,41 +99,166 @@ class WithdrawalRequest(models.Model):
             if not all([self.bank_name, self.bank_branch, self.account_number]):
                 raise ValidationError('Bank details incomplete')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded status so save() can check the transition without a re-read
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if fields is None or 'status' in fields:
+            self._loaded_status = self.status
+
     def save(self, *args, **kwargs):
         if not self.reference_code:
             self.reference_code = "WDR" + uuid.uuid4().hex[:6].upper()
 
-        # 🔑 CRITICAL FIX: Ensure processed_callbacks is a list before validation
-        if self.processed_callbacks is None:
-            self.processed_callbacks = []
-
-        self.full_clean()
+        # Partial saves come from code that already validated; skip full_clean's unique-check queries
+        if kwargs.get('update_fields') is None:
+            self.full_clean()
 
-        # Only allow status change from 'pending'/'needs_review' → final state
-        if self.pk:
-            original = WithdrawalRequest.objects.get(pk=self.pk)
-            if original.status not in ['pending', 'needs_review']:
-                if self.status != original.status:
-                    raise ValidationError("Status cannot be changed after completion or failure.")
+        if not self._state.adding:
+            # Status moves go through transition(), which checks and writes in one statement
+            loaded_status = getattr(self, '_loaded_status', None)
+            if loaded_status and self.status != loaded_status:
+                raise ValidationError("Change a withdrawal's status with WithdrawalRequest.transition().")
+            # A full save writes only the editable fields; the row may have moved on since it was loaded
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = [
+                    f.name for f in self._meta.concrete_fields
+                    if not f.primary_key and f.name not in self.WORKER_FIELDS
+                ]
 
         if self.status == 'completed' and self.processed_at is None:
-            from django.utils import timezone
             self.processed_at = timezone.now()
         elif self.status != 'completed':
             self.processed_at = None
 
         super().save(*args, **kwargs)
+        self._loaded_status = self.status
+
+    @classmethod
+    def transition(cls, withdrawal_id, from_states, to_state, **fields):
+        """
+        Move a withdrawal to `to_state` only if its status is one of `from_states`, as one
+        conditional UPDATE ... WHERE status IN (...). Returns True if this call made the
+        change, False if the row had already moved (another callback or admin won).
+        Extra `fields` are written in the same statement.
+        """
+        if isinstance(from_states, str):
+            from_states = [from_states]
+        illegal = [state for state in from_states if to_state not in ALLOWED_TRANSITIONS.get(state, ())]
+        if illegal:
+            raise ValueError(f"Illegal withdrawal transition {illegal} -> {to_state}")
+
+        now = timezone.now()
+        fields.setdefault('processed_at', now if to_state == 'completed' else None)
+        return cls.objects.filter(pk=withdrawal_id, status__in=from_states).update(
+            status=to_state, updated_at=now, **fields
+        ) == 1
+
+    @classmethod
+    def find_for_callback(cls, originator_id=None, conversation_id=None):
+        """Withdrawal a Daraja callback refers to, by OriginatorConversationID then ConversationID (both indexed)."""
+        if originator_id:
+            withdrawal = cls.objects.filter(originator_conversation_id=originator_id).first()
+            if withdrawal:
+                return withdrawal
+        if conversation_id:
+            return cls.objects.filter(daraja_conversation_id=conversation_id).first()
+        return None
+
+    def __str__(self):
+        return f"{self.user.email} - {self.amount} ({self.status})"
 
-    # 🔑 IDEMPOTENCY HELPER METHODS
-    def has_processed_callback(self, callback_id):
-        """Check if a callback ID has already been processed."""
-        return bool(callback_id and callback_id in self.processed_callbacks)
 
-    def mark_callback_processed(self, callback_id):
-        """Safely add a callback ID to the processed list."""
-        if callback_id and callback_id not in self.processed_callbacks:
-            self.processed_callbacks.append(callback_id)
-            self.save(update_fields=['processed_callbacks'])
+class ProcessedCallback(models.Model):
+    """
+    One row per Daraja callback already handled. The unique (provider, callback_id)
+    constraint makes duplicate deliveries fail on a single indexed insert, made in the
+    same transaction as the callback's effects.
+    """
+    PROVIDER_CHOICES = [
+        ('b2c_result', 'B2C Result'),
+        ('b2c_timeout', 'B2C Timeout'),
+    ]
+
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
+    callback_id = models.CharField(max_length=100, help_text="OriginatorConversationID or ConversationID")
+    withdrawal = models.ForeignKey(
+        WithdrawalRequest,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='callback_records'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'callback_id'], name='unique_processed_callback'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider}:{self.callback_id}"
+
+    @classmethod
+    def record(cls, provider, callback_id, withdrawal=None):
+        """
+        Claim a callback. Returns False if it was already processed.
+        Call inside the transaction that applies the callback: a concurrent duplicate
+        waits on the unique index and then fails, so the effects happen once.
+        """
+        try:
+            with transaction.atomic():
+                cls.objects.create(provider=provider, callback_id=callback_id, withdrawal=withdrawal)
+            return True
+        except IntegrityError:
+            return False
+
+
+class CallbackInbox(models.Model):
+    """
+    Append-only log of raw Daraja webhooks (B2C result/timeout, STK push).
+    The webhook stores the payload and answers at once; `process_callback_inbox` applies
+    rows in arrival order, one at a time per serial_key (a payout or a checkout).
+    """
+    KIND_CHOICES = [
+        ('b2c_result', 'B2C Result'),
+        ('b2c_timeout', 'B2C Timeout'),
+        ('stk', 'STK Push'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    serial_key = models.CharField(max_length=120, help_text="Rows with the same key are applied strictly in order")
+    payload = models.JSONField()
+    remote_addr = models.GenericIPAddressField(null=True, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name_plural = "Callback inbox"
+        indexes = [
+            # Worker claim: WHERE status = 'pending' AND next_attempt_at <= now ORDER BY id
+            models.Index(fields=['status', 'next_attempt_at'], name='callback_inbox_queue_idx'),
+            # Ordering guard: is an earlier row for this key still unfinished?
+            models.Index(fields=['serial_key', 'status'], name='callback_inbox_key_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.email} - {self.amount} ({self.status})"
\ No newline at end of file
+        return f"{self.kind} {self.serial_key} ({self.status})"
@@ -1,3 +1,746 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from django.contrib import admin
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.forms.models import model_to_dict
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from earn_backend.daraja import DarajaClient
+from users.models import User
+from wallets.models import WalletBalance, WalletTransaction
+from wallets.services import ledger_key, post_entries
+
+from . import daraja_payout, inbox
+from .admin import WithdrawalRequestAdmin
+from .callbacks import apply_b2c_result, apply_b2c_timeout
+from .dispatcher import (
+    RateLimiter, claim_batch, dispatch_one, originator_id_for, recover_stale_claims, requeue_for_dispatch
+)
+from .models import CallbackInbox, ProcessedCallback, WithdrawalRequest
+
+
+class DarajaStub(BaseHTTPRequestHandler):
+    """
+    Minimal Daraja: OAuth always succeeds; each B2C request takes the next
+    (status, body) from `responses`, or is accepted when the list is empty.
+    A str body is sent as-is; DROP closes the connection without answering.
+    """
+    DROP = 'drop'
+
+    responses = []
+    calls = []
+    token_requests = []
+    expires_in = '3599'
+    token_delay = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        DarajaStub.token_requests.append(time.monotonic())
+        time.sleep(DarajaStub.token_delay)
+        token = f'stub-token-{len(DarajaStub.token_requests)}'
+        self._reply(200, {'access_token': token, 'expires_in': DarajaStub.expires_in})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        payload['_token'] = self.headers.get('Authorization', '')
+        DarajaStub.calls.append(payload)
+        if DarajaStub.responses:
+            response = DarajaStub.responses.pop(0)
+            if response == DarajaStub.DROP:
+                self.close_connection = True
+                return
+            return self._reply(*response)
+        originator_id = payload['OriginatorConversationID']
+        self._reply(200, {
+            'ConversationID': f'AG_{originator_id}',
+            'OriginatorConversationID': originator_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Accept the service request successfully.',
+        })
+
+
+class DarajaStubMixin:
+    """Runs a DarajaStub for the test class and resets it before each test."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), DarajaStub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        DarajaStub.responses = []
+        DarajaStub.calls = []
+        DarajaStub.token_requests = []
+        DarajaStub.expires_in = '3599'
+        DarajaStub.token_delay = 0
+
+
+@override_settings(B2C_DISPATCH_MAX_ATTEMPTS=3, B2C_DISPATCH_RETRY_BASE=30)
+class PayoutDispatcherTests(DarajaStubMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(daraja_payout, 'MPESA_B2C_BASE_URL', self.base_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(email='payee@example.com', referral_code='PAYEE001')
+        self.withdrawal = WithdrawalRequest.objects.create(
+            user=self.user, wallet_type='referral', amount=100, method='mobile',
+            mobile_phone='0712345678', next_dispatch_at=timezone.now()
+        )
+
+    def _claim_one(self):
+        batch = claim_batch(10)
+        self.assertEqual([w.id for w in batch], [self.withdrawal.id])
+        return batch[0]
+
+    def _make_due(self):
+        WithdrawalRequest.objects.filter(id=self.withdrawal.id).update(next_dispatch_at=timezone.now())
+
+    def test_accepted_payout_records_conversation_id(self):
+        self.assertEqual(dispatch_one(self._claim_one()), 'sent')
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'pending')
+        self.assertEqual(self.withdrawal.daraja_conversation_id, f'AG_B2C_{self.withdrawal.id}')
+        self.assertIsNotNone(self.withdrawal.dispatched_at)
+        self.assertIsNone(self.withdrawal.dispatch_locked_at)
+        self.assertEqual(DarajaStub.calls[0]['PartyB'], '254712345678')
+        self.assertEqual(claim_batch(10), [])
+
+    def test_503_is_retried_with_backoff_then_sent(self):
+        DarajaStub.responses = [(503, {'errorMessage': 'System busy'})]
+
+        before = timezone.now()
+        self.assertEqual(dispatch_one(self._claim_one()), 'retry')
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'pending')
+        self.assertEqual(self.withdrawal.dispatch_attempts, 1)
+        self.assertIsNone(self.withdrawal.dispatch_locked_at)
+        self.assertGreaterEqual(self.withdrawal.next_dispatch_at, before + timedelta(seconds=30))
+        self.assertIn('System busy', self.withdrawal.last_dispatch_error)
+        self.assertEqual(claim_batch(10), [])  # backing off
+
+        self._make_due()
+        self.assertEqual(dispatch_one(self._claim_one()), 'sent')
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.dispatch_attempts, 2)
+        self.assertEqual(len(DarajaStub.calls), 2)
+
+    def test_exhausted_attempts_move_to_review_and_can_be_requeued(self):
+        DarajaStub.responses = [(503, {'errorMessage': 'down'})] * 3
+
+        outcomes = []
+        for _ in range(3):
+            outcomes.append(dispatch_one(self._claim_one()))
+            self._make_due()
+
+        self.assertEqual(outcomes, ['retry', 'retry', 'needs_review'])
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'needs_review')
+        self.assertIsNone(self.withdrawal.dispatched_at)
+        # Daraja refused every attempt, so a human may safely send it again
+        self.assertEqual(requeue_for_dispatch(WithdrawalRequest.objects.filter(id=self.withdrawal.id)), 1)
+        self.withdrawal.refresh_from_db()
+        self.assertEqual((self.withdrawal.status, self.withdrawal.dispatch_attempts), ('pending', 0))
+
+    def test_400_goes_straight_to_review(self):
+        DarajaStub.responses = [(400, {'errorMessage': 'Invalid PartyB'})]
+
+        self.assertEqual(dispatch_one(self._claim_one()), 'needs_review')
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'needs_review')
+        self.assertEqual(self.withdrawal.dispatch_attempts, 1)
+        self.assertIsNone(self.withdrawal.dispatched_at)
+        self.assertIn('Invalid PartyB', self.withdrawal.last_dispatch_error)
+
+    def test_read_timeout_is_ambiguous_and_never_requeued(self):
+        daraja_payout._client().get_token()  # the token fetch itself is not under test
+        with mock.patch('requests.Session.post', side_effect=requests.exceptions.ReadTimeout('read timed out')):
+            self.assertEqual(dispatch_one(self._claim_one()), 'needs_review')
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'needs_review')
+        self.assertIsNotNone(self.withdrawal.dispatched_at)
+        self.assertEqual(requeue_for_dispatch(WithdrawalRequest.objects.filter(id=self.withdrawal.id)), 0)
+        self.assertEqual(WithdrawalRequest.objects.get(id=self.withdrawal.id).status, 'needs_review')
+
+    def _assert_ambiguous(self):
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'needs_review')
+        self.assertIsNotNone(self.withdrawal.dispatched_at)
+        self.assertEqual(requeue_for_dispatch(WithdrawalRequest.objects.filter(id=self.withdrawal.id)), 0)
+        self.assertEqual(len(DarajaStub.calls), 1)
+
+    def test_non_json_200_is_ambiguous(self):
+        DarajaStub.responses = [(200, '<html>Gateway says OK</html>')]
+
+        self.assertEqual(dispatch_one(self._claim_one()), 'needs_review')
+        self._assert_ambiguous()
+        self.assertIn('Unreadable', self.withdrawal.last_dispatch_error)
+
+    def test_dropped_connection_after_sending_is_ambiguous(self):
+        DarajaStub.responses = [DarajaStub.DROP]
+
+        self.assertEqual(dispatch_one(self._claim_one()), 'needs_review')
+        self._assert_ambiguous()
+
+    def test_gateway_5xx_is_ambiguous(self):
+        for status in (500, 502, 504):
+            with self.subTest(status=status):
+                DarajaStub.calls = []
+                DarajaStub.responses = [(status, {'errorMessage': 'Bad gateway'})]
+                WithdrawalRequest.objects.filter(id=self.withdrawal.id).update(
+                    status='pending', dispatched_at=None, dispatch_attempts=0, next_dispatch_at=timezone.now()
+                )
+
+                self.assertEqual(dispatch_one(self._claim_one()), 'needs_review')
+                self._assert_ambiguous()
+
+    def test_429_is_transient(self):
+        DarajaStub.responses = [(429, {'errorMessage': 'Too many requests'})]
+
+        self.assertEqual(dispatch_one(self._claim_one()), 'retry')
+        self.withdrawal.refresh_from_db()
+        self.assertIsNone(self.withdrawal.dispatched_at)
+
+    def test_refused_connection_is_transient(self):
+        # Nothing listens on the port of a server that was just closed
+        closed = ThreadingHTTPServer(('127.0.0.1', 0), DarajaStub)
+        port = closed.server_address[1]
+        closed.server_close()
+
+        with mock.patch.object(daraja_payout, 'MPESA_B2C_BASE_URL', f'http://127.0.0.1:{port}'):
+            self.assertEqual(dispatch_one(self._claim_one()), 'retry')
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'pending')
+        self.assertIsNone(self.withdrawal.dispatched_at)
+
+    def test_connect_timeout_is_transient_but_read_timeout_is_not(self):
+        self.assertTrue(daraja_payout._never_sent(requests.exceptions.ConnectTimeout('connect timed out')))
+        self.assertFalse(daraja_payout._never_sent(requests.exceptions.ReadTimeout('read timed out')))
+        self.assertFalse(daraja_payout._never_sent(requests.exceptions.ConnectionError('Connection aborted.')))
+
+    def test_stale_claim_goes_to_review_is_not_sent_and_is_not_requeued(self):
+        claimed = self._claim_one()
+        WithdrawalRequest.objects.filter(id=self.withdrawal.id).update(
+            dispatch_locked_at=timezone.now() - timedelta(minutes=10)
+        )
+
+        self.assertEqual(recover_stale_claims(), 1)
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'needs_review')
+        self.assertIsNotNone(self.withdrawal.dispatched_at)
+        self.assertEqual(requeue_for_dispatch(WithdrawalRequest.objects.filter(id=self.withdrawal.id)), 0)
+
+        # The original dispatcher finally gets to this row: it must not send it
+        self.assertEqual(dispatch_one(claimed), 'skipped')
+        self.assertEqual(DarajaStub.calls, [])
+
+    def test_claim_is_restamped_before_each_send(self):
+        claimed = self._claim_one()
+        # Claimed long ago as part of a slow slice, but not yet recovered
+        WithdrawalRequest.objects.filter(id=self.withdrawal.id).update(
+            dispatch_locked_at=timezone.now() - timedelta(minutes=4, seconds=59)
+        )
+
+        real_send = daraja_payout.send_b2c_payment
+        recovered_during_send = []
+
+        def slow_send(*args, **kwargs):
+            # Another dispatcher's recovery pass runs while this request is in flight
+            with mock.patch('withdrawals.dispatcher.timezone.now', return_value=timezone.now() + timedelta(seconds=2)):
+                recovered_during_send.append(recover_stale_claims())
+            return real_send(*args, **kwargs)
+
+        with mock.patch('withdrawals.dispatcher.send_b2c_payment', side_effect=slow_send):
+            self.assertEqual(dispatch_one(claimed), 'sent')
+
+        self.assertEqual(recovered_during_send, [0])
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'pending')
+        self.assertIsNotNone(self.withdrawal.daraja_conversation_id)
+
+
+class DarajaClientTests(DarajaStubMixin, SimpleTestCase):
+
+    def _client(self, **kwargs):
+        return DarajaClient('key', 'secret', self.base_url, **kwargs)
+
+    def test_token_is_fetched_once_across_threads(self):
+        DarajaStub.token_delay = 0.1  # every thread arrives while the first fetch is in flight
+        client = self._client()
+        tokens = []
+
+        def worker():
+            tokens.append(client.get_token())
+
+        threads = [threading.Thread(target=worker) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(tokens, ['stub-token-1'] * 10)
+        self.assertEqual(client.token_fetches, 1)
+        self.assertEqual(len(DarajaStub.token_requests), 1)
+
+    def test_token_is_refreshed_refresh_margin_before_expiry(self):
+        DarajaStub.expires_in = '100'
+        client = self._client(refresh_margin=60)
+        clock = [1000.0]
+
+        with mock.patch('earn_backend.daraja.time.monotonic', side_effect=lambda: clock[0]):
+            self.assertEqual(client.get_token(), 'stub-token-1')
+            clock[0] += 39.9
+            self.assertEqual(client.get_token(), 'stub-token-1')
+            clock[0] += 0.2  # 40.1s in: inside the last 60s of a 100s token
+            self.assertEqual(client.get_token(), 'stub-token-2')
+
+        self.assertEqual(client.token_fetches, 2)
+
+    def test_401_is_retried_once_with_a_fresh_token(self):
+        DarajaStub.responses = [(401, {'errorMessage': 'Invalid Access Token'})]
+        client = self._client()
+
+        response = client.post('/mpesa/b2c/v3/paymentrequest', {'OriginatorConversationID': 'X1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([call['_token'] for call in DarajaStub.calls],
+                         ['Bearer stub-token-1', 'Bearer stub-token-2'])
+        self.assertEqual(client.token_fetches, 2)
+
+    def test_second_401_is_returned_not_retried_again(self):
+        DarajaStub.responses = [(401, {'errorMessage': 'Invalid Access Token'})] * 3
+        client = self._client()
+
+        response = client.post('/mpesa/b2c/v3/paymentrequest', {'OriginatorConversationID': 'X2'})
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(DarajaStub.calls), 2)
+
+    def test_token_is_reused_across_requests(self):
+        client = self._client()
+        for i in range(3):
+            client.post('/mpesa/b2c/v3/paymentrequest', {'OriginatorConversationID': f'S{i}'})
+        self.assertEqual(client.token_fetches, 1)
+        self.assertEqual(len(DarajaStub.calls), 3)
+
+
+class RateLimiterTests(SimpleTestCase):
+
+    def test_calls_are_spaced_across_threads(self):
+        limiter = RateLimiter(50)  # one call per 20ms
+        stamps = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(5):
+                limiter.wait()
+                with lock:
+                    stamps.append(time.monotonic())
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stamps.sort()
+        self.assertEqual(len(stamps), 20)
+        gaps = [b - a for a, b in zip(stamps, stamps[1:])]
+        self.assertGreaterEqual(min(gaps), 0.015)
+        self.assertGreaterEqual(stamps[-1] - stamps[0], 19 * 0.02 * 0.9)
+
+    def test_zero_rate_does_not_wait(self):
+        limiter = RateLimiter(0)
+        start = time.monotonic()
+        for _ in range(100):
+            limiter.wait()
+        self.assertLess(time.monotonic() - start, 0.05)
+
+
+class PendingWithdrawalMixin:
+    """A sent mobile withdrawal of 100 from a referral wallet of 500, with its pending debit posted."""
+
+    def _pending_withdrawal(self, email='pending@example.com', referral_code='PENDING1'):
+        user = User.objects.create_user(email=email, referral_code=referral_code)
+        post_entries([WalletTransaction(
+            user=user, wallet_type='referral', transaction_type='referral_bonus', amount=Decimal('500.00')
+        )])
+        withdrawal = WithdrawalRequest.objects.create(
+            user=user, wallet_type='referral', amount=Decimal('100.00'), method='mobile', mobile_phone='0712345678'
+        )
+        WithdrawalRequest.objects.filter(id=withdrawal.id).update(
+            originator_conversation_id=originator_id_for(withdrawal.id),
+            daraja_conversation_id=f'AG_{withdrawal.id}',
+            dispatched_at=timezone.now(),
+        )
+        post_entries([WalletTransaction(
+            user=user, wallet_type='referral', transaction_type='withdrawal_pending', amount=withdrawal.amount,
+            linked_withdrawal=withdrawal, idempotency_key=ledger_key('withdrawal_pending', withdrawal.id)
+        )])
+        withdrawal.refresh_from_db()
+        return withdrawal
+
+    def _result(self, withdrawal, code=0):
+        return {'Result': {
+            'ResultCode': code,
+            'OriginatorConversationID': withdrawal.originator_conversation_id,
+            'ConversationID': withdrawal.daraja_conversation_id,
+            'TransactionID': f'RCPT{withdrawal.id}',
+        }}
+
+    def _timeout(self, withdrawal):
+        return {
+            'OriginatorConversationID': withdrawal.originator_conversation_id,
+            'ConversationID': withdrawal.daraja_conversation_id,
+        }
+
+    def _referral_balance(self, withdrawal):
+        return WalletBalance.objects.get(user=withdrawal.user, wallet_type='referral').balance
+
+    def _entries(self, withdrawal, transaction_type):
+        return WalletTransaction.objects.filter(linked_withdrawal=withdrawal, transaction_type=transaction_type)
+
+
+class ProcessedCallbackTests(PendingWithdrawalMixin, TestCase):
+    """Duplicate Daraja deliveries are stopped by the unique (provider, callback_id) insert."""
+
+    def setUp(self):
+        self.withdrawal = self._pending_withdrawal()
+
+    def test_record_claims_a_callback_once_per_provider(self):
+        self.assertTrue(ProcessedCallback.record('b2c_result', 'CB1', self.withdrawal))
+        self.assertFalse(ProcessedCallback.record('b2c_result', 'CB1', self.withdrawal))
+        self.assertTrue(ProcessedCallback.record('b2c_timeout', 'CB1', self.withdrawal))
+        self.assertEqual(ProcessedCallback.objects.filter(callback_id='CB1').count(), 2)
+
+    def test_unique_constraint_rejects_a_second_row(self):
+        ProcessedCallback.objects.create(provider='b2c_result', callback_id='CB2')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProcessedCallback.objects.create(provider='b2c_result', callback_id='CB2')
+
+    def test_duplicate_success_callback_settles_once(self):
+        payload = self._result(self.withdrawal)
+
+        apply_b2c_result(payload)
+        apply_b2c_result(payload)
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'completed')
+        self.assertEqual(self.withdrawal.mpesa_receipt_number, f'RCPT{self.withdrawal.id}')
+        self.assertEqual(ProcessedCallback.objects.filter(provider='b2c_result').count(), 1)
+        self.assertEqual(self._entries(self.withdrawal, 'withdrawal').count(), 1)
+        self.assertEqual(self._referral_balance(self.withdrawal), Decimal('400.00'))
+
+    def test_duplicate_failure_callback_reverses_once(self):
+        payload = self._result(self.withdrawal, code=2001)
+
+        apply_b2c_result(payload)
+        apply_b2c_result(payload)
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'failed')
+        self.assertEqual(self._entries(self.withdrawal, 'withdrawal_reversal').count(), 1)
+        self.assertEqual(self._referral_balance(self.withdrawal), Decimal('500.00'))
+
+    def test_duplicate_timeout_is_recorded_once(self):
+        apply_b2c_timeout(self._timeout(self.withdrawal))
+        apply_b2c_timeout(self._timeout(self.withdrawal))
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'needs_review')
+        self.assertEqual(ProcessedCallback.objects.filter(provider='b2c_timeout').count(), 1)
+
+
+
+@override_settings(CALLBACK_INBOX_MAX_ATTEMPTS=3, CALLBACK_INBOX_RETRY_BASE=60)
+class CallbackInboxTests(PendingWithdrawalMixin, TestCase):
+
+    def setUp(self):
+        self.withdrawal = self._pending_withdrawal()
+
+    def _status(self, row):
+        return CallbackInbox.objects.get(id=row.id).status
+
+    def _process_all(self):
+        while True:
+            batch = inbox.claim_batch(10)
+            if not batch:
+                return
+            inbox.process_batch(batch)
+
+    def test_same_key_rows_are_claimed_one_at_a_time_in_arrival_order(self):
+        other = self._pending_withdrawal(email='other@example.com', referral_code='OTHER001')
+        result = inbox.receive('b2c_result', self._result(self.withdrawal))
+        timeout = inbox.receive('b2c_timeout', self._timeout(self.withdrawal))
+        other_result = inbox.receive('b2c_result', self._result(other))
+        self.assertEqual(result.serial_key, timeout.serial_key)
+
+        # Different keys run together; the timeout waits behind the earlier result
+        self.assertEqual([row.id for row in inbox.claim_batch(10)], [result.id, other_result.id])
+        self.assertEqual(inbox.claim_batch(10), [])
+
+        self.assertEqual(inbox.process_row(CallbackInbox.objects.get(id=result.id)), 'done')
+        self.assertEqual([row.id for row in inbox.claim_batch(10)], [timeout.id])
+
+        # Applied after the settlement, the timeout cannot park a completed payout for review
+        self.assertEqual(inbox.process_row(CallbackInbox.objects.get(id=timeout.id)), 'done')
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'completed')
+
+    def test_failing_row_is_retried_with_backoff_then_failed(self):
+        row = inbox.receive('b2c_result', self._result(self.withdrawal))
+        later = inbox.receive('b2c_timeout', self._timeout(self.withdrawal))
+
+        failing = mock.patch('withdrawals.callbacks.apply_b2c_result', side_effect=RuntimeError('database is down'))
+        with failing, self.assertLogs('withdrawals.inbox', 'WARNING'):
+            for attempt in (1, 2):
+                before = timezone.now()
+                self.assertEqual(inbox.process_row(inbox.claim_batch(10)[0]), 'retry')
+                row.refresh_from_db()
+                self.assertEqual((row.status, row.attempts), ('pending', attempt))
+                self.assertEqual(row.last_error, 'database is down')
+                self.assertGreaterEqual(row.next_attempt_at, before + timedelta(seconds=60 * 2 ** (attempt - 1)))
+                # Not due yet, and the later row for the same payout keeps waiting behind it
+                self.assertEqual(inbox.claim_batch(10), [])
+                CallbackInbox.objects.filter(id=row.id).update(next_attempt_at=timezone.now())
+
+            self.assertEqual(inbox.process_row(inbox.claim_batch(10)[0]), 'failed')
+
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), ('failed', 3))
+        # A failed row no longer holds up its key
+        self.assertEqual([r.id for r in inbox.claim_batch(10)], [later.id])
+
+    def test_stale_processing_row_is_reclaimed(self):
+        row = inbox.receive('b2c_result', self._result(self.withdrawal))
+        self.assertEqual([r.id for r in inbox.claim_batch(10)], [row.id])
+        # Claimed by a worker that is still within its lease
+        self.assertEqual(inbox.claim_batch(10), [])
+
+        CallbackInbox.objects.filter(id=row.id).update(
+            locked_at=timezone.now() - inbox.STALE_AFTER - timedelta(minutes=1)
+        )
+        batch = inbox.claim_batch(10)
+        self.assertEqual([r.id for r in batch], [row.id])
+
+        self.assertEqual(inbox.process_batch(batch), {'done': 1, 'retry': 0, 'failed': 0})
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'completed')
+
+    def test_replaying_applied_callbacks_changes_nothing(self):
+        failed = self._pending_withdrawal(email='failed@example.com', referral_code='FAILED01')
+        start = timezone.now() - timedelta(minutes=1)
+        inbox.receive('b2c_result', self._result(self.withdrawal))
+        inbox.receive('b2c_result', self._result(failed, code=2001))
+        self._process_all()
+
+        for _ in range(2):
+            call_command('replay_callbacks', '--since', start.isoformat(), '--status', 'all', stdout=StringIO())
+            self.assertEqual(CallbackInbox.objects.filter(status='pending').count(), 2)
+            self._process_all()
+
+        self.assertFalse(CallbackInbox.objects.exclude(status='done').exists())
+        self.withdrawal.refresh_from_db()
+        failed.refresh_from_db()
+        self.assertEqual((self.withdrawal.status, failed.status), ('completed', 'failed'))
+        self.assertEqual(self._entries(self.withdrawal, 'withdrawal').count(), 1)
+        self.assertEqual(self._entries(failed, 'withdrawal_reversal').count(), 1)
+        self.assertEqual(self._referral_balance(self.withdrawal), Decimal('400.00'))
+        self.assertEqual(self._referral_balance(failed), Decimal('500.00'))
+
+    def test_requeue_leaves_rows_in_flight_alone(self):
+        row = inbox.receive('b2c_result', self._result(self.withdrawal))
+        inbox.claim_batch(10)
+
+        self.assertEqual(inbox.requeue(CallbackInbox.objects.all()), 0)
+        self.assertEqual(self._status(row), 'processing')
+
+
+
+class WithdrawalTransitionTests(PendingWithdrawalMixin, TestCase):
+
+    def setUp(self):
+        self.withdrawal = self._pending_withdrawal()
+
+    def _status(self):
+        return WithdrawalRequest.objects.values_list('status', 'processed_at').get(id=self.withdrawal.id)
+
+    def test_first_writer_wins_and_the_second_is_told(self):
+        self.assertTrue(WithdrawalRequest.transition(self.withdrawal.id, ['pending'], 'failed'))
+        self.assertFalse(WithdrawalRequest.transition(self.withdrawal.id, ['pending'], 'completed'))
+        self.assertEqual(self._status(), ('failed', None))
+
+    def test_illegal_move_raises(self):
+        for from_states, to_state in ((['completed'], 'pending'), (['failed'], 'completed'), ('pending', 'pending')):
+            with self.assertRaises(ValueError):
+                WithdrawalRequest.transition(self.withdrawal.id, from_states, to_state)
+        self.assertEqual(self._status(), ('pending', None))
+
+    def test_processed_at_is_set_only_on_completion(self):
+        self.assertTrue(WithdrawalRequest.transition(self.withdrawal.id, ['pending'], 'needs_review'))
+        self.assertEqual(self._status(), ('needs_review', None))
+
+        before = timezone.now()
+        self.assertTrue(WithdrawalRequest.transition(self.withdrawal.id, ['needs_review'], 'completed'))
+        status, processed_at = self._status()
+        self.assertEqual(status, 'completed')
+        self.assertGreaterEqual(processed_at, before)
+
+    def test_success_callback_after_a_reversal_is_ignored(self):
+        apply_b2c_timeout(self._timeout(self.withdrawal))
+        apply_b2c_result(self._result(self.withdrawal, code=2001))
+
+        # A separate delivery (keyed by ConversationID only), so it gets past the duplicate check
+        with self.assertLogs('withdrawals.callbacks', 'WARNING'):
+            apply_b2c_result({'Result': {**self._result(self.withdrawal)['Result'], 'OriginatorConversationID': None}})
+
+        self.assertEqual(self._status(), ('failed', None))
+        self.assertFalse(self._entries(self.withdrawal, 'withdrawal').exists())
+        self.assertEqual(self._entries(self.withdrawal, 'withdrawal_reversal').count(), 1)
+        self.assertEqual(self._referral_balance(self.withdrawal), Decimal('500.00'))
+
+
+
+class WithdrawalAdminStaleSaveTests(PendingWithdrawalMixin, TestCase):
+    """An admin page loaded before the payout settled must not undo the settlement."""
+
+    def setUp(self):
+        self.withdrawal = self._pending_withdrawal()
+        self.model_admin = WithdrawalRequestAdmin(WithdrawalRequest, admin.site)
+        self.request = RequestFactory().post('/admin/withdrawals/withdrawalrequest/')
+        self.request.user = User.objects.create_superuser(email='ops@example.com', password='x', referral_code='OPS00001')
+        self.request._messages = CookieStorage(self.request)
+
+    def _submit(self, stale, **changes):
+        """Post the change form as rendered from `stale`, with `changes` edited."""
+        form_class = self.model_admin.get_form(self.request, stale, change=True)
+        data = {k: '' if v is None else v for k, v in model_to_dict(stale, fields=form_class.base_fields).items()}
+        data.update(changes)
+        form = form_class(data, instance=stale)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.model_admin.save_model(self.request, form.save(commit=False), form, change=True)
+
+    def _settle(self):
+        apply_b2c_result(self._result(self.withdrawal))
+        return WithdrawalRequest.objects.get(id=self.withdrawal.id)
+
+    def test_stale_edit_saves_only_the_edited_field(self):
+        stale = WithdrawalRequest.objects.get(id=self.withdrawal.id)
+        settled = self._settle()
+
+        self._submit(stale, mobile_phone='0722000000')
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.mobile_phone, '0722000000')
+        self.assertEqual(self.withdrawal.status, 'completed')
+        for field in ('processed_at', 'mpesa_receipt_number', 'dispatched_at', 'daraja_conversation_id'):
+            self.assertEqual(getattr(self.withdrawal, field), getattr(settled, field), field)
+
+    def test_stale_status_change_loses_to_the_callback(self):
+        stale = WithdrawalRequest.objects.get(id=self.withdrawal.id)
+        self._settle()
+
+        self._submit(stale, status='failed')
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'completed')
+        self.assertFalse(self._entries(self.withdrawal, 'withdrawal_reversal').exists())
+        self.assertIn('updated by another process', str(list(get_messages(self.request))[0]))
+
+    def test_full_save_of_a_stale_copy_keeps_the_workers_fields(self):
+        stale = WithdrawalRequest.objects.get(id=self.withdrawal.id)
+        settled = self._settle()
+
+        stale.mobile_phone = '0722000000'
+        stale.save()
+
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.mobile_phone, '0722000000')
+        for field in WithdrawalRequest.WORKER_FIELDS:
+            self.assertEqual(getattr(self.withdrawal, field), getattr(settled, field), field)
+
+    def test_save_refuses_status_changes(self):
+        self.withdrawal.status = 'failed'
+        with self.assertRaises(ValidationError):
+            self.withdrawal.save()
+        self.assertEqual(WithdrawalRequest.objects.get(id=self.withdrawal.id).status, 'pending')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'the withdrawals migrations build indexes concurrently')
+class CopyProcessedCallbacksMigrationTests(TransactionTestCase):
+    """0006 moves the old processed_callbacks JSON lists into ProcessedCallback rows."""
+
+    before = [('withdrawals', '0005_withdrawalrequest_dispatch')]
+    after = [('withdrawals', '0006_processedcallback')]
+
+    def _migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self._migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_old_ids_are_recorded_for_both_providers(self):
+        apps = self._migrate(self.before)
+        OldUser = apps.get_model('users', 'User')
+        OldWithdrawal = apps.get_model('withdrawals', 'WithdrawalRequest')
+        user = OldUser.objects.create(email='migrated@example.com', referral_code='MIGRATE1')
+        seen = OldWithdrawal.objects.create(
+            user=user, wallet_type='referral', amount=Decimal('100.00'), method='mobile',
+            mobile_phone='0712345678', reference_code='WDMIGRATE1', processed_callbacks=['AG_1', 'B2C_1', 'AG_1'],
+        )
+        OldWithdrawal.objects.create(
+            user=user, wallet_type='referral', amount=Decimal('50.00'), method='mobile',
+            mobile_phone='0712345678', reference_code='WDMIGRATE2', processed_callbacks=[],
+        )
+
+        apps = self._migrate(self.after)
+        NewProcessedCallback = apps.get_model('withdrawals', 'ProcessedCallback')
+
+        self.assertEqual(
+            set(NewProcessedCallback.objects.values_list('provider', 'callback_id', 'withdrawal_id')),
+            {(provider, callback_id, seen.id)
+             for provider in ('b2c_result', 'b2c_timeout') for callback_id in ('AG_1', 'B2C_1')},
+        )
@@ -26,6 +26,13 @@ def is_safaricom_ip(ip_str):
         pass
     return False
 
+def get_client_ip(request):
+    """Real client IP (supports X-Forwarded-For if behind proxy)."""
+    forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if forwarded_for:
+        return forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
 def require_safaricom_ip(view_func):
     """
     Decorator to allow only Safaricom Daraja IPs.
@@ -33,12 +40,7 @@ def require_safaricom_ip(view_func):
     """
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
-        # Get real client IP (support X-Forwarded-For if behind proxy)
-        forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if forwarded_for:
-            client_ip = forwarded_for.split(',')[0].strip()
-        else:
-            client_ip = request.META.get('REMOTE_ADDR', '')
+        client_ip = get_client_ip(request)
 
         if not is_safaricom_ip(client_ip):
             logger.warning(f"Daraja callback from non-whitelisted IP: {client_ip}")
@@ -13,11 +13,11 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
+from . import inbox
 from .models import WithdrawalRequest, SystemSetting
-from .daraja_payout import send_b2c_payment
-from .utils import require_safaricom_ip
-from wallets.models import WalletTransaction
-from users.utils import send_withdrawal_completed_email
+from .utils import get_client_ip, require_safaricom_ip
+from wallets.models import WalletTransaction, WalletBalance
+from wallets.services import ledger_key
 
 logger = logging.getLogger(__name__)
 
@@ -57,11 +57,8 @@ class WithdrawalRequestView(APIView):
             return Response({'error': 'Invalid amount'}, status=400)
 
         with transaction.atomic():
-            last_tx = WalletTransaction.objects.select_for_update().filter(
-                user=user, wallet_type=wallet_type
-            ).order_by('-created_at', '-id').first()
-
-            balance = last_tx.running_balance if last_tx else Decimal('0.00')
+            wallet = WalletBalance.objects.lock(user, wallet_type)
+            balance = wallet.balance
             if amount > balance:
                 return Response({'error': 'Insufficient balance'}, status=400)
 
@@ -103,7 +100,9 @@ class WithdrawalRequestView(APIView):
                 bank_name=bank_name,
                 bank_branch=bank_branch,
                 account_number=account_number,
-                status='pending'
+                status='pending',
+                # Mobile payouts are sent by the dispatcher (python manage.py dispatch_payouts)
+                next_dispatch_at=timezone.now() if method == 'mobile' else None
             )
 
             WalletTransaction.objects.create(
@@ -112,29 +111,13 @@ class WithdrawalRequestView(APIView):
                 transaction_type='withdrawal_pending',
                 amount=amount,
                 linked_withdrawal=withdrawal,
-                description=f"Withdrawal {withdrawal.reference_code} pending M-Pesa processing"
+                description=f"Withdrawal {withdrawal.reference_code} pending M-Pesa processing",
+                idempotency_key=ledger_key('withdrawal_pending', withdrawal.id)
             )
 
         if method == 'mobile':
-            try:
-                originator_id = f"B2C_{withdrawal.id}"[:20]
-                resp = send_b2c_payment(phone, float(amount), originator_id=originator_id)
-
-                withdrawal.originator_conversation_id = originator_id
-                withdrawal.daraja_conversation_id = (
-                    resp.get('ConversationID')
-                    or resp.get('Response', {}).get('ConversationID')
-                )
-                withdrawal.save(update_fields=[
-                    'originator_conversation_id',
-                    'daraja_conversation_id'
-                ])
-
-            except Exception as e:
-                logger.error(f"Daraja send error for withdrawal {withdrawal.id}: {e}", exc_info=True)
-
             return Response({
-                'message': 'Withdrawal accepted and sent to M-Pesa',
+                'message': 'Withdrawal accepted and queued for M-Pesa payout',
                 'request_id': withdrawal.id,
                 'status': 'pending'
             }, status=202)
@@ -158,6 +141,14 @@ class WithdrawalHistoryView(APIView):
             user=request.user
         ).order_by('-created_at')
 
+        # One indexed lookup for all reversal keys instead of an exists() per row
+        reversal_keys = {ledger_key('withdrawal_reversal', w.id): w.id for w in withdrawals}
+        reversed_ids = {
+            reversal_keys[key] for key in WalletTransaction.objects.filter(
+                idempotency_key__in=list(reversal_keys)
+            ).values_list('idempotency_key', flat=True)
+        }
+
         data = []
         for w in withdrawals:
             data.append({
@@ -169,10 +160,7 @@ class WithdrawalHistoryView(APIView):
                 'reference_code': w.reference_code,
                 'created_at': w.created_at.isoformat(),
                 'processed_at': w.processed_at.isoformat() if w.processed_at else None,
-                'is_reversed': WalletTransaction.objects.filter(
-                    linked_withdrawal=w,
-                    transaction_type='withdrawal_reversal'
-                ).exists()
+                'is_reversed': w.id in reversed_ids
             })
         return Response(data)
 
@@ -185,84 +173,8 @@ class WithdrawalHistoryView(APIView):
 @require_POST
 @require_safaricom_ip
 def daraja_b2c_result(request):
-    try:
-        payload = json.loads(request.body)
-        result = payload.get('Result', {})
-        result_code = result.get('ResultCode')
-        originator_id = result.get('OriginatorConversationID')
-        conversation_id = result.get('ConversationID')
-        receipt = result.get('TransactionID', '')
-
-        callback_id = originator_id or conversation_id
-        if not callback_id:
-            return HttpResponse("Missing ID", status=400)
-
-        withdrawal = (
-            WithdrawalRequest.objects.filter(originator_conversation_id=originator_id).first()
-            or WithdrawalRequest.objects.filter(daraja_conversation_id=conversation_id).first()
-        )
-
-        if not withdrawal:
-            return HttpResponse("OK", status=200)
-
-        if withdrawal.has_processed_callback(callback_id):
-            return HttpResponse("OK", status=200)
-
-        with transaction.atomic():
-            if result_code == 0:
-                WalletTransaction.objects.create(
-                    user=withdrawal.user,
-                    wallet_type=withdrawal.wallet_type,
-                    transaction_type='withdrawal',
-                    amount=Decimal('0.00'),
-                    linked_withdrawal=withdrawal,
-                    description=f"M-Pesa withdrawal settled. Receipt {receipt}"
-                )
-
-                withdrawal.status = 'completed'
-                withdrawal.processed_at = timezone.now()
-                withdrawal.mpesa_receipt_number = receipt
-                withdrawal.save(update_fields=[
-                    'status', 'processed_at', 'mpesa_receipt_number'
-                ])
-
-                try:
-                    send_withdrawal_completed_email(
-                        user=withdrawal.user,
-                        amount=withdrawal.amount,
-                        method=withdrawal.method,
-                        destination=withdrawal.mobile_phone,
-                        processed_at=withdrawal.processed_at,
-                        receipt_number=receipt,
-                        reference_code=withdrawal.reference_code,
-                        recipient_name = f"{withdrawal.user.first_name} {withdrawal.user.last_name}".strip() or withdrawal.user.email
-                    )
-                except Exception:
-                    logger.warning(f"Email failed for withdrawal {withdrawal.id}")
-
-            else:
-                from wallets.services import reverse_pending_withdrawal
-                reverse_pending_withdrawal(
-                    withdrawal,
-                    reason=f"Daraja failure code {result_code}"
-                )
-
-                withdrawal.status = 'failed'
-                withdrawal.save(update_fields=['status'])
-
-                from wallets.services import reverse_pending_withdrawal
-                reverse_pending_withdrawal(
-                    withdrawal,
-                    reason=f"Daraja failure code {result_code}"
-                )
-
-            withdrawal.mark_callback_processed(callback_id)
-
-        return HttpResponse("OK", status=200)
-
-    except Exception as e:
-        logger.error(f"B2C result callback error: {e}", exc_info=True)
-        return HttpResponse("Error", status=500)
+    """Store the result in the callback inbox and acknowledge; process_callback_inbox applies it."""
+    return _receive_callback(request, 'b2c_result')
 
 
 # =========================================================
@@ -273,30 +185,19 @@ def daraja_b2c_result(request):
 @require_POST
 @require_safaricom_ip
 def daraja_b2c_timeout(request):
+    """Store the timeout in the callback inbox and acknowledge; process_callback_inbox applies it."""
+    return _receive_callback(request, 'b2c_timeout')
+
+
+def _receive_callback(request, kind):
     try:
         payload = json.loads(request.body)
-        callback_id = payload.get('OriginatorConversationID') or payload.get('ConversationID')
-
-        if not callback_id:
+        if not isinstance(payload, dict) or not inbox.receive(kind, payload, get_client_ip(request) or None):
             return HttpResponse("Missing ID", status=400)
-
-        withdrawal = (
-            WithdrawalRequest.objects.filter(originator_conversation_id=callback_id).first()
-            or WithdrawalRequest.objects.filter(daraja_conversation_id=callback_id).first()
-        )
-
-        if not withdrawal:
-            return HttpResponse("OK", status=200)
-
-        if withdrawal.has_processed_callback(callback_id):
-            return HttpResponse("OK", status=200)
-
-        withdrawal.status = 'needs_review'
-        withdrawal.save(update_fields=['status'])
-        withdrawal.mark_callback_processed(callback_id)
-
         return HttpResponse("OK", status=200)
 
+    except ValueError:
+        return HttpResponse("Invalid JSON", status=400)
     except Exception as e:
-        logger.error(f"B2C timeout callback error: {e}", exc_info=True)
+        logger.error(f"B2C {kind} callback error: {e}", exc_info=True)
         return HttpResponse("Error", status=500)
@@ -154,10 +154,26 @@ const WalletPage = () => {
       if (startDate) params.append('start_date', startDate);
       if (endDate) params.append('end_date', endDate);
 
-      const response = await api.get(`/wallets/statement/?${params.toString()}`, {
+      let response = await api.get(`/wallets/statement/?${params.toString()}`, {
         responseType: 'blob',
       });
 
+      // 202 = statement queued; poll the job until the worker has rendered it
+      if (response.status === 202) {
+        const job = JSON.parse(await response.data.text());
+        let status = job.status;
+        for (let attempt = 0; attempt < 60 && (status === 'queued' || status === 'running'); attempt++) {
+          await new Promise((resolve) => setTimeout(resolve, 2000));
+          status = (await api.get(`/wallets/statement/jobs/${job.job_id}/`)).data.status;
+        }
+        if (status !== 'done') {
+          throw new Error('Statement is taking longer than expected. Please try again shortly.');
+        }
+        response = await api.get(`/wallets/statement/jobs/${job.job_id}/download/`, {
+          responseType: 'blob',
+        });
+      }
+
       const url = window.URL.createObjectURL(new Blob([response.data]));
       const link = document.createElement('a');
       link.href = url;